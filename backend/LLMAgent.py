@@ -1,11 +1,17 @@
-import os
 import json
-from TableAgent import *
-from gpt_function_tools import *
-from claude_function_tools import *
-
-from openai import OpenAI
-import boto3
+import time
+import asyncio
+from TableAgent import TableAgent
+from table_serializer import DEFAULT_TABLE_FORMAT, DEFAULT_TOKEN_BUDGET
+from gpt_function_tools import gpt_tools, gpt_single_call_sys_msg
+from claude_function_tools import claude_tools, claude_single_call_sys_message
+from llm_cache import ToolCallCache, tool_call_cache
+from plan_stream import PlanStreamParser
+from intent_router import route_task
+from stream_events import format_event
+from tracing import Trace, current_span, set_span_attributes, span
+from clients import build_bedrock_client, build_openai_client
+from resilience import call_with_backoff, get_backoff_delay, is_retryable
 
 model_to_model_IDs = {
     "gpt-4o": "gpt-4o",
@@ -32,21 +38,53 @@ instruction_type_to_tool_name = {
     "OTHER": "other_instruction",
 }
 
-# TODO: timeit measure latency of class methods
+tool_name_to_instruction_type = {tool_name: instruction_type for instruction_type, tool_name in instruction_type_to_tool_name.items()}
+
+# Tools offered together in single call mode, get_instructions lets the model fall back to planning
+single_call_tool_names = ["write_table", "create_chart", "question", "other_instruction", "get_instructions"]
+
+# Tools whose array arguments are zipped into one list per cell or instruction
+zipped_tool_names = {"get_instructions", "write_table", "read_table"}
+
+# Instruction types that must not run at the same time as the given type.
+# WRITE and READ share the local table, CHART and OTHER share the Sheets client and push the WRITEs
+# before them, OTHER can touch anything.
+instruction_type_conflicts = {
+    "WRITE": {"WRITE", "READ", "CHART", "OTHER"},
+    "READ": {"WRITE", "OTHER"},
+    "CHART": {"WRITE", "CHART", "OTHER"},
+    "QUESTION": set(),
+    "OTHER": {"WRITE", "READ", "CHART", "OTHER"},
+}
+
+# Instruction types with side effects outside the local table, held back until the whole plan has
+# streamed in so a late INAPPROPRIATE can still stop them
+remote_instruction_types = {"CHART", "OTHER"}
+
 class LLMAgent:
     """LLMAgent is the orchestrated agent responsible for making LLM calls to plan and produce instructions"""
 
-    def __init__(self, default_call="gpt", default_gpt_model="gpt-4o", default_claude_model="claude-3.5", tools_to_models={}):
+    def __init__(self, default_call="gpt", default_gpt_model="gpt-4o", default_claude_model="claude-3.5", tools_to_models={}, tool_call_cache=tool_call_cache, single_call=False, stream_plan=True, stream_timings=False, wait_for_writes=True, route_intents=True,
+                 openai_client=None, bedrock_client=None, drive_service=None, sheets_service=None):
         self.max_attempts = 5
+        self.max_parallel_instructions = 4
+        self.table_format = DEFAULT_TABLE_FORMAT
+        self.table_token_budget = DEFAULT_TOKEN_BUDGET
         self.default_call = default_call # Either 'gpt' or 'claude'
         self.default_gpt_model = default_gpt_model
         self.default_claude_model = default_claude_model
         self.tools_to_models = tools_to_models # Maps tool's function name to model to use for that tool
-        self.openai_client = OpenAI(organization=os.environ["OPENAI_PERSONAL_ORG"])
-        self.bedrock_client = boto3.client(service_name='bedrock-runtime', region_name='us-east-1',
-                                aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-                                aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
-                                )
+        self.tool_call_cache = tool_call_cache # Shared cache of parsed tool call results, see llm_cache
+        self.single_call = single_call # Plan and execute simple tasks in one model call
+        self.stream_plan = stream_plan # Start executing instructions while the planner is still answering
+        self.stream_timings = stream_timings # End the stream with a timings event breaking down the request's spans
+        self.wait_for_writes = wait_for_writes # Prompt instructions after the earlier WRITEs are done so they see the written values
+        self.route_intents = route_intents # Skip the planner for single-intent tasks the local intent router is sure about
+        # Clients are normally built once per container and passed in, see api.py
+        self.openai_client = openai_client if openai_client is not None else build_openai_client()
+        self.bedrock_client = bedrock_client if bedrock_client is not None else build_bedrock_client()
+        self.drive_service = drive_service # Passed on to the TableAgent of each act call
+        self.sheets_service = sheets_service
     
     def set_default_call(self, call):
         """Sets the default call (either gpt or claude)"""
@@ -80,55 +118,151 @@ class LLMAgent:
                 print("Could not find LLM model to use")
         return ""
     
-    def call_gpt(self, model_ID, user_msg_content, tool_name):
+    async def call_gpt(self, model_ID, user_msg_content, tool_name):
         """Call GPT on OpenAI"""
         tool, sys_msg = gpt_tools["gpt_" + tool_name]
+        return await self.call_gpt_tools(model_ID, user_msg_content, [tool], sys_msg)
+
+    async def call_gpt_tools(self, model_ID, user_msg_content, tools, sys_msg):
+        """Call GPT on OpenAI, requiring it to call at least one of the given tools"""
         user_msg = {
             "role": "user",
             "content": user_msg_content
         }
         messages = [sys_msg, user_msg]
 
-        response = self.openai_client.chat.completions.create(
-            model=model_ID,
-            messages=messages,
-            tools=[tool],
-            tool_choice="required",
-        )
+        with span("llm_call", model=model_ID):
+            response = await call_with_backoff(lambda: self.openai_client.chat.completions.create(
+                model=model_ID,
+                messages=messages,
+                tools=tools,
+                tool_choice="required",
+            ), "gpt")
         print(response.choices[0].message)
         return response.choices[0].message
     
-    def call_claude(self, model_ID, user_msg_content, tool_name):
+    async def call_claude(self, model_ID, user_msg_content, tool_name):
         """Call Claude on AWS Bedrock"""
         tool, sys_msg = claude_tools["claude_" + tool_name]
+        return await self.call_claude_tools(model_ID, user_msg_content, [tool], sys_msg)
+
+    async def call_claude_tools(self, model_ID, user_msg_content, tools, sys_msg, tool_choice=None):
+        """Call Claude on AWS Bedrock with the given tools. boto3 is blocking so the call runs on a worker thread."""
         messages = [{"role": "user", "content": user_msg_content}]
-        body = json.dumps({
+        request = {
             "anthropic_version": "bedrock-2023-05-31",
             "system": sys_msg,
             "messages": messages,
             "max_tokens": 4000,
-            "tools": [tool]
-        })
+            "tools": tools
+        }
+        if tool_choice:
+            request["tool_choice"] = tool_choice
+        body = json.dumps(request)
 
-        response = self.bedrock_client.invoke_model(body=body, modelId=model_ID)
-        response_body = json.loads(response['body'].read())
+        with span("llm_call", model=model_ID):
+            response_body = await call_with_backoff(lambda: asyncio.to_thread(self.invoke_bedrock_model, body, model_ID), "claude")
         print(response_body['content'])
         return response_body['content']
 
-    def get_instruction_args(self, tool_name, task, sheet_content, args_names, prev_response, prev_response_error):
-        """Gets instructions arguments.
+    def invoke_bedrock_model(self, body, model_ID):
+        """Invokes the Bedrock model and returns the parsed response body"""
+        response = self.bedrock_client.invoke_model(body=body, modelId=model_ID)
+        return json.loads(response['body'].read())
+
+    async def open_tool_input_stream(self, model_ID, user_msg_content, tool_name):
+        """Calls model_ID with tool_name in streaming mode.
+        Opening the stream is retried like a regular call, the returned async iterator yields
+        (tool call index, arguments JSON fragment) pairs as the model writes them.
+        """
+        tool, sys_msg = self.get_tool(model_ID, tool_name)
+        if model_ID.startswith("gpt"):
+            with span("llm_stream_open", model=model_ID):
+                stream = await call_with_backoff(lambda: self.openai_client.chat.completions.create(
+                    model=model_ID,
+                    messages=[sys_msg, {"role": "user", "content": user_msg_content}],
+                    tools=[tool],
+                    tool_choice="required",
+                    stream=True,
+                ), "gpt")
+            return iterate_gpt_tool_input(stream)
+        elif model_ID.startswith("anthropic"):
+            body = json.dumps({
+                "anthropic_version": "bedrock-2023-05-31",
+                "system": sys_msg,
+                "messages": [{"role": "user", "content": user_msg_content}],
+                "max_tokens": 4000,
+                "tools": [tool]
+            })
+            with span("llm_stream_open", model=model_ID):
+                response = await call_with_backoff(lambda: asyncio.to_thread(self.bedrock_client.invoke_model_with_response_stream, body=body, modelId=model_ID), "claude")
+            return iterate_claude_tool_input(response['body'])
+        raise ValueError(f"Invalid LLM {model_ID}")
+
+    def get_tool(self, model_ID, tool_name):
+        """Returns the tool schema and system message sent to model_ID for tool_name"""
+        if model_ID.startswith("gpt"):
+            return gpt_tools["gpt_" + tool_name]
+        elif model_ID.startswith("anthropic"):
+            return claude_tools["claude_" + tool_name]
+        return None, None
+
+    def get_args_cache_key(self, tool_name, task, sheet_content, prev_response=None, prev_response_error=None):
+        """Returns the tool call cache key of a get_instruction_args call"""
+        model_ID = self.get_model_ID(tool_name)
+        tool, sys_msg = self.get_tool(model_ID, tool_name)
+        return ToolCallCache.get_key(model_ID, tool, sys_msg, get_user_msg(task, sheet_content, prev_response, prev_response_error))
+
+    async def get_instruction_args(self, tool_name, task, sheet_content, args_names, prev_response, prev_response_error, use_cache=True, cache_result=True):
+        """Gets instructions arguments, reusing the cached result of an identical earlier call.
+        Pass use_cache=False to always call the model, and cache_result=False to cache the args only
+        once they are known to work, see run_instruction.
         Returns success bool, error message, and args.
         """
-        user_msg = "Table:\n" + sheet_content + f"\nEnd Table.\nInstructions:\n{task}"
-        if prev_response:
-            user_msg += f"\nYour previous response was {prev_response} which resulted in an error."
-        if prev_response_error:
-            user_msg += f"\nThe error was: {prev_response_error}"
+        user_msg = get_user_msg(task, sheet_content, prev_response, prev_response_error)
         print("User message:", user_msg)
         model_ID = self.get_model_ID(tool_name)
         print("Using model:", model_ID)
+        cache_key = self.get_args_cache_key(tool_name, task, sheet_content, prev_response, prev_response_error)
+        with span("get_instruction_args", tool=tool_name, model=model_ID) as args_span:
+            if use_cache:
+                cached_result = self.tool_call_cache.get(cache_key)
+                if cached_result is not None:
+                    print(f"Using cached {tool_name} result", self.tool_call_cache.stats())
+                    if args_span:
+                        args_span.set(cached=True)
+                    return tuple(cached_result)
+            success, error_msg, args = await self.call_instruction_args(model_ID, tool_name, user_msg, args_names)
+            if success and cache_result:
+                self.tool_call_cache.put(cache_key, [success, error_msg, args])
+            return success, error_msg, args
+
+    def get_failover_model_ID(self, model_ID):
+        """Returns the default model of the other provider"""
+        if model_ID.startswith("gpt"):
+            return model_to_model_IDs[self.default_claude_model]
+        return model_to_model_IDs[self.default_gpt_model]
+
+    async def call_instruction_args(self, model_ID, tool_name, user_msg, args_names):
+        """Calls model_ID with tool_name and parses its tool calls, failing over to the other
+        provider when model_ID's provider is throttled, down, or its circuit breaker is open.
+        Returns success bool, error message, and args.
+        """
+        try:
+            return await self.call_model_instruction_args(model_ID, tool_name, user_msg, args_names)
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            failover_model_ID = self.get_failover_model_ID(model_ID)
+            print(f"{model_ID} unavailable ({e}), failing over {tool_name} to {failover_model_ID}")
+            return await self.call_model_instruction_args(failover_model_ID, tool_name, user_msg, args_names)
+
+    async def call_model_instruction_args(self, model_ID, tool_name, user_msg, args_names):
+        """Calls model_ID with tool_name and parses its tool calls.
+        Returns success bool, error message, and args.
+        """
         if model_ID.startswith("gpt"):
-            gpt_response = self.call_gpt(model_ID, user_msg, tool_name)
+            gpt_response = await self.call_gpt(model_ID, user_msg, tool_name)
             tool_calls = gpt_response.tool_calls
             args_collection = [None for _ in range(len(args_names))]
             for i in range(len(tool_calls)):
@@ -158,7 +292,7 @@ class LLMAgent:
             print("Args zipped:", instruction_args)
             return True, "", instruction_args
         elif model_ID.startswith("anthropic"):
-            claude_response = self.call_claude(model_ID, user_msg, tool_name)
+            claude_response = await self.call_claude(model_ID, user_msg, tool_name)
             args_collection = {}
             for item in claude_response:
                 if item['type'] == "tool_use":
@@ -191,38 +325,76 @@ class LLMAgent:
             print("Invalid LLM")
             return False, "Invalid LLM", ""
 
-    def get_arg_names(self, instruction_type):
-        if instruction_type == "get_instructions":
-            return ["types", "instructions"]
-        elif instruction_type == "WRITE":
-            return ["rows", "columns", "values"]
-        elif instruction_type == "READ":
-            return ["rows", "columns"]
-        elif instruction_type == "CHART":
-            return ["chart_arg"]
-        elif instruction_type == "QUESTION":
-            return ["answer"]
-        elif instruction_type == "OTHER":
-            return ["body"]
-    
-    def act_streamer(self, task_prompt: str, sheet_id: str, sheet_range: str):
-        """Attempts to complete given task prompt and streams outputs"""
-        try:
-            table_agent = TableAgent(sheet_id)
-            sheet_content = table_agent.get_sheet_content(sheet_range)
-            yield get_chunk_to_yield("Finished reading in data...")
-        except:
-            yield get_chunk_to_yield("Error reading data")
-            return
-        
-        # 1. Get instructions
+    async def get_single_call_instructions(self, task_prompt, sheet_content, use_cache=True):
+        """Offers the model every execution tool plus get_instructions in one call.
+        If the model plans with get_instructions, its instructions are returned with no args so they
+        are executed the usual way. Otherwise each tool call becomes an instruction for the whole task
+        with its args already filled in. Tasks unrelated to Google Sheets are planned as one INAPPROPRIATE
+        instruction, which scheduler.add refuses like a planned one.
+        Returns success bool, error message, instructions and the args of each instruction (or None).
+        """
+        user_msg = "Table:\n" + sheet_content + f"\nEnd Table.\nTask:\n{task_prompt}"
+        model_ID = self.get_model_ID("get_instructions")
+        print("Using model for single call:", model_ID)
+        if model_ID.startswith("gpt"):
+            tools = [gpt_tools["gpt_" + tool_name][0] for tool_name in single_call_tool_names]
+            sys_msg = gpt_single_call_sys_msg
+        elif model_ID.startswith("anthropic"):
+            tools = [claude_tools["claude_" + tool_name][0] for tool_name in single_call_tool_names]
+            sys_msg = claude_single_call_sys_message
+        else:
+            print("Invalid LLM")
+            return False, "Invalid LLM", None, None
+
+        cache_key = ToolCallCache.get_key(model_ID, tools, sys_msg, user_msg)
+        tool_calls = self.tool_call_cache.get(cache_key) if use_cache else None
+        if tool_calls is None:
+            if model_ID.startswith("gpt"):
+                gpt_response = await self.call_gpt_tools(model_ID, user_msg, tools, sys_msg)
+                tool_calls = [[tool_call.function.name, json.loads(tool_call.function.arguments)] for tool_call in gpt_response.tool_calls or []]
+            else:
+                claude_response = await self.call_claude_tools(model_ID, user_msg, tools, sys_msg, tool_choice={"type": "any"})
+                tool_calls = [[item['name'], item['input']] for item in claude_response if item['type'] == "tool_use"]
+            if tool_calls:
+                self.tool_call_cache.put(cache_key, tool_calls)
+        print("Single call tool calls:", tool_calls)
+        if not tool_calls:
+            return False, "No tool calls", None, None
+
+        for tool_name, tool_input in tool_calls:
+            if tool_name == "get_instructions":
+                success, error_msg, instructions = get_args_from_tool_input(tool_name, tool_input, self.get_arg_names("get_instructions"))
+                if not success:
+                    return False, error_msg, None, None
+                # Nothing of a refused task may start before the refusal
+                refusals = [instruction for instruction in instructions if instruction[0] == "INAPPROPRIATE"]
+                if refusals:
+                    return True, "", refusals[:1], [None]
+                return True, "", instructions, [None for _ in instructions]
+
+        instructions = []
+        instructions_args = []
+        for tool_name, tool_input in tool_calls:
+            if tool_name not in tool_name_to_instruction_type:
+                return False, f"Unrecognized tool {tool_name}", None, None
+            instruction_type = tool_name_to_instruction_type[tool_name]
+            success, error_msg, args = get_args_from_tool_input(tool_name, tool_input, self.get_arg_names(instruction_type))
+            if not success:
+                return False, error_msg, None, None
+            instructions.append([instruction_type, task_prompt])
+            instructions_args.append((self.get_info_instruction_type(instruction_type, args), args))
+        return True, "", instructions, instructions_args
+
+    async def plan_instructions(self, task_prompt, sheet_content):
+        """Gets the instructions for the task from the planner.
+        Returns the instructions, or None and the message to show the user.
+        """
         prev_response = None
         prev_response_error = None
-        instructions = None
         for attempt_num in range(1, self.max_attempts+1):
             try:
                 print(f"Attempt {attempt_num} of get_instructions")
-                success, error_msg, args = self.get_instruction_args("get_instructions", task_prompt, sheet_content, self.get_arg_names("get_instructions"), prev_response, prev_response_error)
+                success, error_msg, args = await self.get_instruction_args("get_instructions", task_prompt, sheet_content, self.get_arg_names("get_instructions"), prev_response, prev_response_error)
                 if not success:
                     assert(type(error_msg) == type(args) == str)
                     prev_response = args
@@ -230,83 +402,397 @@ class LLMAgent:
                     print("Error in get_instructions", error_msg)
                     continue
                 else:
-                    instructions = args
-                    break
+                    return args, ""
             except Exception as e:
                 print("Error in get_instructions")
                 print(e)
-                if str(e).startswith("Error code: 429"):
-                    # Rate limited
-                    yield get_chunk_to_yield("Sorry, please try again in a few minutes!")
-                    return
+                if is_retryable(e):
+                    # Every provider is throttled or down
+                    return None, "Sorry, please try again in a few minutes!"
+                await asyncio.sleep(get_backoff_delay(attempt_num))
                 continue
-        print("Instructions:", instructions)
-        if instructions == None:
-            yield get_chunk_to_yield("Error getting instructions")
-            return
-        print_instructions = " ".join([instr[1] for instr in instructions])
-        yield get_chunk_to_yield(f"Plan: {print_instructions}")
+        return None, "Error getting instructions"
 
-        if "INAPPROPRIATE" in [instr[0] for instr in instructions]:
-            yield get_chunk_to_yield(f"Sorry I can't help with: {task_prompt}")
-            return
+    async def stream_instructions(self, task_prompt, sheet_content, use_cache=True):
+        """Streams the planner's instructions, yielding each [type, instruction] pair as soon as it is complete.
+        Fails over to the other provider if the stream can't be opened, and caches the finished plan
+        under the same key as get_instruction_args. Raises if the plan can't be streamed or is invalid.
+        """
+        user_msg = get_user_msg(task_prompt, sheet_content)
+        model_ID = self.get_model_ID("get_instructions")
+        print("Streaming instructions from:", model_ID)
+        tool, sys_msg = self.get_tool(model_ID, "get_instructions")
+        cache_key = ToolCallCache.get_key(model_ID, tool, sys_msg, user_msg)
+        if use_cache:
+            cached_result = self.tool_call_cache.get(cache_key)
+            if cached_result is not None:
+                print("Using cached get_instructions result", self.tool_call_cache.stats())
+                for instruction in cached_result[2]:
+                    yield instruction
+                return
+        try:
+            fragments = await self.open_tool_input_stream(model_ID, user_msg, "get_instructions")
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            failover_model_ID = self.get_failover_model_ID(model_ID)
+            print(f"{model_ID} unavailable ({e}), failing over get_instructions to {failover_model_ID}")
+            fragments = await self.open_tool_input_stream(failover_model_ID, user_msg, "get_instructions")
+
+        # GPT may split the plan over several tool calls, whose instructions are concatenated in order
+        parsers = {}
+        instructions = []
+        async for tool_call_index, fragment in fragments:
+            parser = parsers.setdefault(tool_call_index, PlanStreamParser())
+            for instruction in parser.feed(fragment):
+                instructions.append(instruction)
+                yield instruction
+        if not parsers or not all(parser.is_valid() for parser in parsers.values()):
+            raise ValueError("Invalid instructions length")
+        print("Streamed instructions:", instructions)
+        self.tool_call_cache.put(cache_key, [True, "", instructions])
+
+    async def plan_into_scheduler(self, task_prompt, sheet_content, scheduler):
+        """Plans the task, adding each instruction to scheduler as soon as it is known.
+        Single-intent tasks are planned locally when the intent router is sure, see intent_router.
+        Falls back to the non-streaming planner if streaming fails before the first instruction.
+        """
+        try:
+            with span("plan", single_call=self.single_call, stream_plan=self.stream_plan):
+                if self.route_intents:
+                    instructions = route_task(task_prompt, headers=scheduler.table_agent.sheet_content.header_index)
+                    set_span_attributes(routed=instructions is not None)
+                    if instructions is not None:
+                        for instruction in instructions:
+                            if not scheduler.add(instruction):
+                                return
+                        return
+
+                if self.single_call:
+                    try:
+                        success, error_msg, instructions, instructions_args = await self.get_single_call_instructions(task_prompt, sheet_content)
+                        if success:
+                            for instruction, instruction_args in zip(instructions, instructions_args):
+                                if not scheduler.add(instruction, instruction_args):
+                                    return
+                            return
+                        print("Single call failed, falling back to planner:", error_msg)
+                    except Exception as e:
+                        print("Single call failed, falling back to planner:", e)
+
+                if self.stream_plan:
+                    try:
+                        async for instruction in self.stream_instructions(task_prompt, sheet_content):
+                            if not scheduler.add(instruction):
+                                return
+                        return
+                    except Exception as e:
+                        print("Error streaming instructions:", e)
+                        if scheduler.instructions:
+                            scheduler.chunk_queue.put_nowait(format_event("error", message="Error getting the rest of the plan"))
+                            return
+
+                instructions, error_chunk = await self.plan_instructions(task_prompt, sheet_content)
+                if instructions is None:
+                    scheduler.chunk_queue.put_nowait(format_event("error", message=error_chunk))
+                    return
+                print("Instructions:", instructions)
+                for instruction in instructions:
+                    if not scheduler.add(instruction):
+                        return
+        finally:
+            scheduler.plan_ready.set()
+
+    def get_info_instruction_type(self, instruction_type, args):
+        """Returns the instruction type TableAgent.execute_instruction expects.
+        Charts depend on the format of the model that answered, which may be the failover model:
+        GPT returns a list of chart arguments and Claude a JSON string request.
+        """
+        if instruction_type == "CHART":
+            if isinstance(args[0], str):
+                return "CHART-claude"
+            return "CHART-gpt"
+        return instruction_type
+
+    def get_arg_names(self, instruction_type):
+        if instruction_type == "get_instructions":
+            return ["types", "instructions"]
+        elif instruction_type == "WRITE":
+            return ["rows", "columns", "values"]
+        elif instruction_type == "READ":
+            return ["rows", "columns"]
+        elif instruction_type == "CHART":
+            return ["chart_arg"]
+        elif instruction_type == "QUESTION":
+            return ["answer"]
+        elif instruction_type == "OTHER":
+            return ["body"]
+    
+    async def act_streamer(self, task_prompt: str, sheet_id: str, sheet_range: str = None):
+        """Attempts to complete given task prompt and streams its progress as SSE events, see stream_events.
+        Instructions work on the tab titled sheet_range, the first tab by default.
+        Blocking Google API calls run on worker threads so many requests can share the event loop.
+        The request is traced, see tracing.
+        """
+        trace = Trace("act", sheet_id=sheet_id, sheet_range=sheet_range)
+        print("Request ID:", trace.request_id)
+        try:
+            try:
+                with trace.activate(), span("read_sheet"):
+                    table_agent = await asyncio.to_thread(TableAgent, sheet_id, self.table_format, self.table_token_budget, self.drive_service, self.sheets_service)
+                    sheet_content = await asyncio.to_thread(table_agent.get_sheet_content, sheet_range)
+            except:
+                yield format_event("error", message="Error reading data")
+                return
+            yield format_event("status", message="Finished reading in data...")
 
-        # 2. Execute instructions
-        need_to_push_sheet_content = False
-        for instruction in instructions:
-            print("Executing", instruction)
-            yield get_chunk_to_yield(f"Executing...\n{instruction[1]}")
-            prev_response = None
-            prev_response_error = None
-            failed_all_attempts = True
-            for attempt_num in range(1, self.max_attempts+1):
-                try:
-                    instruction_type = instruction[0]
-                    instruction_command = instruction[1]
-                    print(f"Attempt {attempt_num} of {instruction_type}: {instruction_command}")
-                    if instruction_type not in instruction_type_to_tool_name:
-                        print("Unrecognized instruction type")
-                        break
-                    
-                    success, error_msg, args = self.get_instruction_args(instruction_type_to_tool_name[instruction_type], instruction_command, sheet_content, self.get_arg_names(instruction_type), prev_response, prev_response_error)
-                    if not success:
-                        assert(type(error_msg) == type(args) == str)
-                        prev_response = args
-                        prev_response_error = error_msg
-                        print("Error:", error_msg)
+            # 1. Plan the task. Planned instructions start running while the planner streams the rest.
+            # 2. Execute instructions, overlapping the ones that don't depend on each other
+            chunk_queue = asyncio.Queue()
+            scheduler = InstructionScheduler(self, trace, task_prompt, table_agent, chunk_queue)
+            with trace.activate():
+                planner_task = asyncio.create_task(self.plan_into_scheduler(task_prompt, sheet_content, scheduler))
+            planner_task.add_done_callback(lambda _: chunk_queue.put_nowait(None))
+            try:
+                # The planner and every instruction put a None when done, and the planner is done
+                # only after it has added all its instructions
+                finished = 0
+                while finished < 1 + len(scheduler.tasks):
+                    chunk = await chunk_queue.get()
+                    if chunk is None:
+                        finished += 1
                         continue
-                    info_instruction_type = instruction_type
-                    if instruction_type == "CHART":
-                        if "create_chart" in self.tools_to_models:
-                            if self.tools_to_models["create_chart"].startswith("claude"):
-                                info_instruction_type += "-claude"
+                    yield chunk
+            finally:
+                planner_task.cancel()
+                scheduler.cancel()
+            if scheduler.refused or not scheduler.tasks:
+                return
+            need_to_push_sheet_content = scheduler.wrote_to_table()
+            yield format_event("status", message="Finished executing all instructions.")
+            if need_to_push_sheet_content:
+                with trace.activate(), span("push_sheet_content"):
+                    await asyncio.to_thread(table_agent.push_sheet_content, table_agent.sheet_range)
+            # Charts and OTHER instructions push the writes before them themselves
+            cells_written = table_agent.cells_pushed
+            if cells_written:
+                yield format_event("status", message=f"Wrote {cells_written} cells to Google Sheets")
+            total_ms = round(trace.root.get_duration_ms(), 2)
+            yield format_event("done", request_id=trace.request_id, total_ms=total_ms, cells_written=cells_written)
+            if self.stream_timings:
+                yield format_event("timings", request_id=trace.request_id, total_ms=total_ms, phases=trace.get_breakdown())
+        finally:
+            trace.finish()
+
+    async def run_instruction(self, index, instruction, table_agent, dependencies_done, writes_done, done, llm_call_slots, chunk_queue, instruction_args=None):
+        """Gets args for and executes a single instruction as its own task.
+        instruction_args is an (info instruction type, args) pair from single call mode used for the first attempt.
+        Waits on writes_done, the earlier WRITEs, before rendering the table for its prompt, holds one of
+        llm_call_slots while calling the model, waits on the instructions it depends on before touching
+        the table, puts its events on chunk_queue, and returns whether it wrote to the table.
+        """
+        wrote_to_table = False
+        start = time.perf_counter()
+        try:
+            with span("instruction", index=index+1, instruction_type=instruction[0]):
+                print("Executing", instruction)
+                chunk_queue.put_nowait(get_instruction_event(index, "executing", instruction=instruction[1]))
+                prev_response = None
+                prev_response_error = None
+                failed_all_attempts = True
+                for attempt_num in range(1, self.max_attempts+1):
+                    # The model's args are cached only after they executed, so bad args are never replayed
+                    args_cache_key = None
+                    try:
+                        with span("attempt", attempt=attempt_num):
+                            instruction_type = instruction[0]
+                            instruction_command = instruction[1]
+                            print(f"Attempt {attempt_num} of {instruction_type}: {instruction_command}")
+                            if instruction_type not in instruction_type_to_tool_name:
+                                print("Unrecognized instruction type")
+                                break
+
+                            if attempt_num == 1 and instruction_args is not None:
+                                info_instruction_type, args = instruction_args
                             else:
-                                info_instruction_type += "-gpt"
-                        else:
-                            info_instruction_type += "-" + self.default_call
-                    success, error_msg, result = table_agent.execute_instruction(info_instruction_type, args)
-                    if not success:
-                        assert(type(error_msg) == type(result) == str)
-                        prev_response = result
-                        prev_response_error = error_msg
-                        print("Error:", error_msg)
+                                with span("wait_writes", count=len(writes_done)):
+                                    for write_done in writes_done:
+                                        await write_done.wait()
+                                # READs naming their cells are resolved without the model, see read_resolver
+                                args = None
+                                if instruction_type == "READ" and attempt_num == 1:
+                                    args = await asyncio.to_thread(table_agent.resolve_read, instruction_command)
+                                    set_span_attributes(resolved_locally=args is not None)
+                                if args is not None:
+                                    info_instruction_type = instruction_type
+                                else:
+                                    with span("wait_llm_slot"):
+                                        await llm_call_slots.acquire()
+                                    try:
+                                        # The table as earlier writes left it, and the other tabs the instruction names
+                                        sheet_content = await asyncio.to_thread(table_agent.get_prompt_content)
+                                        referenced_tabs = await asyncio.to_thread(table_agent.get_referenced_tabs, instruction_command)
+                                        tool_name = instruction_type_to_tool_name[instruction_type]
+                                        args_cache_key = self.get_args_cache_key(tool_name, instruction_command, sheet_content + referenced_tabs, prev_response, prev_response_error)
+                                        success, error_msg, args = await self.get_instruction_args(tool_name, instruction_command, sheet_content + referenced_tabs, self.get_arg_names(instruction_type), prev_response, prev_response_error, cache_result=False)
+                                    finally:
+                                        llm_call_slots.release()
+                                    if not success:
+                                        assert(type(error_msg) == type(args) == str)
+                                        prev_response = args
+                                        prev_response_error = error_msg
+                                        print("Error:", error_msg)
+                                        continue
+                                    info_instruction_type = self.get_info_instruction_type(instruction_type, args)
+                            with span("wait_dependencies", count=len(dependencies_done)):
+                                for dependency_done in dependencies_done:
+                                    await dependency_done.wait()
+                            with span("execute", instruction_type=info_instruction_type):
+                                success, error_msg, result = await asyncio.to_thread(table_agent.execute_instruction, info_instruction_type, args)
+                            if not success:
+                                assert(type(error_msg) == type(result) == str)
+                                if args_cache_key:
+                                    self.tool_call_cache.delete(args_cache_key)
+                                prev_response = result
+                                prev_response_error = error_msg
+                                print("Error:", error_msg)
+                                continue
+                            if args_cache_key:
+                                self.tool_call_cache.put(args_cache_key, [True, "", args])
+                            if instruction_type == "WRITE":
+                                wrote_to_table = True
+                            chunk_queue.put_nowait(get_instruction_event(index, "result", result=str(result), elapsed_ms=get_elapsed_ms(start)))
+                            failed_all_attempts = False
+                            break
+                    except Exception as e:
+                        print("Exception in instruction:", e)
+                        if args_cache_key:
+                            self.tool_call_cache.delete(args_cache_key)
+                        prev_response = None
+                        prev_response_error = None
+                        await asyncio.sleep(get_backoff_delay(attempt_num))
                         continue
-                    if instruction_type == "WRITE":
-                        need_to_push_sheet_content = True
-                    yield get_chunk_to_yield(result)
-                    failed_all_attempts = False
-                    break
-                except Exception as e:
-                    prev_response = None
-                    prev_response_error = None
-                    continue
-            if failed_all_attempts:
-                yield get_chunk_to_yield("Failed instruction after all attempts")
-        yield get_chunk_to_yield("Finished executing all instructions.")
-        if need_to_push_sheet_content:
-            table_agent.push_sheet_content(sheet_range)
-            yield get_chunk_to_yield("Wrote to Google Sheets")
-        return
-
-def get_chunk_to_yield(chunk):
-    return chunk + " --END_CHUNK-- "
\ No newline at end of file
+                if failed_all_attempts:
+                    chunk_queue.put_nowait(get_instruction_event(index, "error", message="Failed instruction after all attempts"))
+        finally:
+            done.set()
+        return wrote_to_table
+
+class InstructionScheduler:
+    """Runs instructions as tasks as soon as they are planned.
+    Each instruction waits on the earlier instructions it conflicts with, and remote instructions
+    also wait for the plan to be complete. With wait_for_writes, instructions are prompted only
+    after the earlier WRITEs, so they see the table those left. Every task puts a None on chunk_queue when it ends.
+    """
+    def __init__(self, llm_agent, trace, task_prompt, table_agent, chunk_queue):
+        self.llm_agent = llm_agent
+        self.trace = trace
+        self.task_prompt = task_prompt
+        self.table_agent = table_agent
+        self.chunk_queue = chunk_queue
+        self.llm_call_slots = asyncio.Semaphore(llm_agent.max_parallel_instructions)
+        self.plan_ready = asyncio.Event()
+        self.instructions = []
+        self.instructions_done = []
+        self.tasks = []
+        self.refused = False
+
+    def add(self, instruction, instruction_args=None):
+        """Streams the instruction as part of the plan and starts running it.
+        An INAPPROPRIATE instruction refuses the whole task instead, returning False.
+        """
+        if self.refused:
+            return False
+        if instruction[0] == "INAPPROPRIATE":
+            self.refused = True
+            self.cancel()
+            self.chunk_queue.put_nowait(format_event("refused", message=f"Sorry I can't help with: {self.task_prompt}"))
+            return False
+        index = len(self.instructions)
+        self.instructions.append(instruction)
+        self.chunk_queue.put_nowait(get_instruction_event(index, "plan", instruction_type=instruction[0], instruction=instruction[1]))
+        plan_span = current_span.get()
+        if index == 0 and plan_span is not None:
+            plan_span.set(first_instruction_ms=round(plan_span.get_duration_ms(), 2))
+        dependencies_done = [self.instructions_done[j] for j in get_instruction_dependencies(self.instructions)[index]]
+        if instruction[0] in remote_instruction_types:
+            dependencies_done.append(self.plan_ready)
+        writes_done = []
+        if self.llm_agent.wait_for_writes:
+            writes_done = [self.instructions_done[j] for j in range(index) if self.instructions[j][0] == "WRITE"]
+        self.instructions_done.append(asyncio.Event())
+        # Instruction spans hang off the request, not off the plan span that is current here
+        with self.trace.activate():
+            task = asyncio.create_task(self.llm_agent.run_instruction(index, instruction, self.table_agent, dependencies_done, writes_done, self.instructions_done[index], self.llm_call_slots, self.chunk_queue, instruction_args))
+        # Done callbacks also run for tasks cancelled before they started
+        task.add_done_callback(lambda _: self.chunk_queue.put_nowait(None))
+        self.tasks.append(task)
+        return True
+
+    def cancel(self):
+        for task in self.tasks:
+            task.cancel()
+
+    def wrote_to_table(self):
+        """Whether any finished instruction wrote to the local table"""
+        return any(task.done() and not task.cancelled() and task.result() for task in self.tasks)
+
+def get_args_from_tool_input(tool_name, tool_input, args_names):
+    """Converts one tool call's input to instruction args, zipping array arguments when needed.
+    Returns success bool, error message, and args.
+    """
+    missing = [arg_name for arg_name in args_names if arg_name not in tool_input]
+    if missing:
+        return False, f"Missing arguments {missing} for {tool_name}", str(tool_input)
+    args = [tool_input[arg_name] for arg_name in args_names]
+    if tool_name not in zipped_tool_names:
+        return True, "", args
+    if any(len(arg) != len(args[0]) for arg in args):
+        return False, "Invalid instructions length", str(tool_input)
+    return True, "", [list(zipped_args) for zipped_args in zip(*args)]
+
+def get_user_msg(task, sheet_content, prev_response=None, prev_response_error=None):
+    user_msg = "Table:\n" + sheet_content + f"\nEnd Table.\nInstructions:\n{task}"
+    if prev_response:
+        user_msg += f"\nYour previous response was {prev_response} which resulted in an error."
+    if prev_response_error:
+        user_msg += f"\nThe error was: {prev_response_error}"
+    return user_msg
+
+async def iterate_gpt_tool_input(stream):
+    """Yields (tool call index, arguments fragment) pairs from an OpenAI chat completion stream"""
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        for tool_call in chunk.choices[0].delta.tool_calls or []:
+            if tool_call.function and tool_call.function.arguments:
+                yield tool_call.index, tool_call.function.arguments
+
+async def iterate_claude_tool_input(event_stream):
+    """Yields (content block index, partial JSON) pairs from a Bedrock response stream.
+    botocore's event stream is blocking, so each event is read on a worker thread.
+    """
+    events = iter(event_stream)
+    while True:
+        event = await asyncio.to_thread(next, events, None)
+        if event is None:
+            return
+        if "chunk" not in event:
+            continue
+        message = json.loads(event["chunk"]["bytes"])
+        if message["type"] == "content_block_delta" and message["delta"]["type"] == "input_json_delta":
+            yield message["index"], message["delta"]["partial_json"]
+
+def get_instruction_dependencies(instructions):
+    """Returns, for each instruction, the indices of earlier instructions it must run after"""
+    dependencies = []
+    for i, instruction in enumerate(instructions):
+        conflicts = instruction_type_conflicts.get(instruction[0], set(instruction_type_conflicts))
+        dependencies.append([j for j in range(i) if instructions[j][0] in conflicts or instructions[j][0] not in instruction_type_conflicts])
+    return dependencies
+
+def get_instruction_event(index, event_type, **payload):
+    return format_event(event_type, index=index+1, **payload)
+
+def get_elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 2)
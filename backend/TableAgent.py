@@ -1,179 +1,363 @@
 import os
+import re
+import asyncio
 import pandas as pd
 import json
-from io import BytesIO
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
+from clients import build_google_services, execute_batch, get_google_credentials
+from formula_engine import evaluate_formulas, get_referenced_columns, is_formula
+from read_resolver import resolve_read
+from sheet_cache import sheet_snapshot_cache
+from sheet_table import SheetTable
+from table_serializer import DEFAULT_TABLE_FORMAT, DEFAULT_TOKEN_BUDGET, TableRenderer, get_column_letter, serialize_table
+from tracing import set_span_attributes, span
 
 class TableAgent:
     """TableAgent is the agent responsible for manipulating the underlying table"""
-    def __init__(self, sheet_id = -1):
+    def __init__(self, sheet_id = -1, table_format=DEFAULT_TABLE_FORMAT, token_budget=DEFAULT_TOKEN_BUDGET, drive_service=None, sheets_service=None, sheet_pool=None):
         self.sheet_id = sheet_id
         self.sheet_content = None
-        creds_json = json.loads(os.environ["GOOGLE_CREDS_CRICK"])
-        creds = Credentials(creds_json['token'],
-                        refresh_token=creds_json['refresh_token'],
-                        token_uri=creds_json['token_uri'],
-                        client_id=creds_json['client_id'],
-                        client_secret=creds_json['client_secret'],
-                        scopes=creds_json['scopes']
-                        )        
-        self.drive_service = build('drive', 'v3', credentials=creds)
-        self.sheets_service = build("sheets", "v4", credentials=creds)
+        self.table_format = table_format # How the table is serialized for prompts, see table_serializer
+        self.token_budget = token_budget # Max tokens the serialized table may use in a prompt
+        self.renderer = TableRenderer(table_format, token_budget) # Prompt rendering of sheet_content, kept current by writes
+        self.dirty_cells = set() # (row, col) cells changed locally since the last push
+        self.cells_pushed = 0 # Cells pushed by this agent, by push_sheet_content before remote instructions too
+        self.formulas = {} # Formula text of the dirty cells holding formulas, their computed values are in sheet_content
+        self.sheet_range = None # Title of the tab instructions work on
+        self.tabs = {} # Tab properties by title, see get_sheet_metadata
+        self.tab_contents = {} # SheetTable of every tab by title
+        if drive_service is None or sheets_service is None:
+            # Services are normally built once per container and passed in, see api.py
+            drive_service, sheets_service = build_google_services(get_google_credentials())
+        self.drive_service = drive_service
+        self.sheets_service = sheets_service
+        self.sheet_pool = sheet_pool # Ready spreadsheets for uploads, see spreadsheet_pool
     
-    def get_sheets_title(self, user_sheets_id):
-        """Returns the title of the user's sheets"""
-        user_sheets = self.sheets_service.spreadsheets().get(spreadsheetId=user_sheets_id).execute()
-        user_sheets_title = user_sheets.get('properties').get('title')
-        print("Found user sheets title:", user_sheets_title)
-        return user_sheets_title
-    
-    def copy_user_sheets(self, user_sheets_id, user_sheets_title):
-        request_body = {
-            'name': user_sheets_title + ' w sheetfreak',
-            'parents': [os.environ["GOOGLE_DRIVE_FOLDER_ID"]]
-        }
-
-        copied_file = self.drive_service.files().copy(
-            fileId=user_sheets_id,
-            body=request_body
-        ).execute()
+    def copy_user_sheets(self, user_sheets_id):
+        """Copies the user's sheets into our Drive folder and returns the share link of the copy.
+        The copy and the lookup of the original's name run concurrently, then the copy is renamed and
+        shared in one batch request, so this takes two round trips.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Run in a copy of the caller's context so the lookup shows up in its trace. The request is
+            # built on the worker thread, requests are bound to the connection of the thread building them.
+            source_file = executor.submit(contextvars.copy_context().run,
+                lambda: self.drive_service.files().get(fileId=user_sheets_id, fields='name').execute())
+            copied_file = self.drive_service.files().copy(
+                fileId=user_sheets_id,
+                body={'parents': [os.environ["GOOGLE_DRIVE_FOLDER_ID"]]},
+                fields='id, webViewLink'
+            ).execute()
+            user_sheets_title = source_file.result().get('name')
         copied_file_id = copied_file.get("id")
         self.sheet_id = copied_file_id
         print("Copied file ID:", copied_file_id)
-        
+
         #Make file editable to anyone with the link
+        self.share_sheets(copied_file_id, body={'name': user_sheets_title + ' w sheetfreak'})
+        return copied_file.get('webViewLink')
+
+    def share_sheets(self, file_id, **file_update):
+        """Makes the file editable by anyone with the link. file_update holds files().update arguments,
+        like a new name or parent, sent in the same batch.
+        """
         permission = {
             'type': 'anyone',
             'role': 'writer'
         }
-        self.drive_service.permissions().create(fileId=copied_file_id, body=permission).execute()
-        file = self.drive_service.files().get(fileId=copied_file_id, fields='webViewLink').execute()
-        share_link = file.get('webViewLink')
-        return share_link
+        requests = [self.drive_service.permissions().create(fileId=file_id, body=permission, fields='id')]
+        if file_update:
+            requests.insert(0, self.drive_service.files().update(fileId=file_id, fields='id', **file_update))
+        execute_batch(self.drive_service, requests)
     
-    async def upload_user_sheets(self, file, sheet_range="Sheet1"):
-        """Uploads user .xlsx or .csv to a Google Sheets file"""
-        contents = await file.read()
-        
+    async def upload_user_sheets(self, file, csv_tab_title="Sheet1"):
+        """Uploads user .xlsx or .csv to a Google Sheets file, each worksheet of an .xlsx as its own tab
+        named like the worksheet, a .csv on the tab csv_tab_title. Act reads the first tab by default.
+        The file is streamed into the sheet in batches, see ingest, so large files are never fully in memory.
+        """
+        from ingest import get_tab_titles, get_worksheet_names, ingest_upload, save_upload
+        from spreadsheet_pool import POOL_MARKER
+        xlsx_path = None
         if file.filename.endswith('.xlsx'):
-            df = pd.read_excel(BytesIO(contents))
+            file_type = "xlsx"
+            xlsx_path = await asyncio.to_thread(save_upload, file.file)
         elif file.filename.endswith('.csv'):
-            df = pd.read_csv(BytesIO(contents))
+            file_type = "csv"
         else:
             return "Error: unsupported file type. Please upload .xlsx or .csv file."
-        
+
+        try:
+            if xlsx_path:
+                worksheet_names = await asyncio.to_thread(get_worksheet_names, xlsx_path)
+                worksheets = list(zip(worksheet_names, get_tab_titles(worksheet_names)))
+            else:
+                worksheets = [(None, csv_tab_title)]
+
+            title = file.filename + " w sheetfreak"
+            # Taking from the pool pops from its shared inventory over the network, so it runs on a worker thread too
+            pooled_sheet = await asyncio.to_thread(self.sheet_pool.take) if self.sheet_pool else None
+            # Requests are built on the worker threads sending them, each thread has its own connection
+            if pooled_sheet:
+                sheet_id, share_link, tab_properties = await asyncio.to_thread(self.prepare_pooled_sheets, pooled_sheet, title, worksheets)
+                # Renaming and unmarking the file is sent while the data is written
+                finish = asyncio.to_thread(lambda: self.drive_service.files().update(
+                    fileId=sheet_id,
+                    body={'name': title, 'appProperties': {POOL_MARKER: None}},
+                    fields='id'
+                ).execute())
+            else:
+                sheet_id, share_link, tab_properties = await asyncio.to_thread(self.create_sheets, title, worksheets)
+                # Moving and sharing the file is one batch request, sent while the data is written
+                finish = asyncio.to_thread(self.share_sheets, sheet_id, addParents=os.environ["GOOGLE_DRIVE_FOLDER_ID"])
+            source = xlsx_path or file.file
+            write_values = asyncio.to_thread(ingest_upload, self.sheets_service, source, file_type, sheet_id, worksheets, tab_properties)
+            _, (rows, cells) = await asyncio.gather(finish, write_values)
+            print(f"Uploaded {rows} rows ({cells} cells) in {len(worksheets)} tabs from {file.filename}")
+        finally:
+            if xlsx_path:
+                os.remove(xlsx_path)
+
+        return share_link
+
+    def create_sheets(self, title, worksheets):
+        """Creates a spreadsheet with a tab per worksheet, returns its ID, share link and tab properties by title"""
+        # Every tab is created along with the spreadsheet
         sheet_metadata = {
             'properties': {
-                'title': file.filename + " w sheetfreak"
+                'title': title
             },
+            'sheets': [{'properties': {'title': tab_title, 'index': i}} for i, (_, tab_title) in enumerate(worksheets)],
         }
+        created_sheet = self.sheets_service.spreadsheets().create(
+            body=sheet_metadata,
+            fields='spreadsheetId,spreadsheetUrl,sheets.properties'
+        ).execute()
+        tab_properties = {sheet['properties']['title']: sheet['properties'] for sheet in created_sheet['sheets']}
+        # The spreadsheet URL is the file's share link, so it needs no extra files().get
+        return created_sheet['spreadsheetId'], created_sheet['spreadsheetUrl'], tab_properties
 
-        copied_sheet = self.sheets_service.spreadsheets().create(body=sheet_metadata).execute()
-        sheet_id = copied_sheet['spreadsheetId']
+    def prepare_pooled_sheets(self, pooled_sheet, title, worksheets):
+        """Gives a pooled spreadsheet a tab per worksheet, in one batchUpdate if it needs any change.
+        Returns its ID, share link and tab properties by title.
+        """
+        sheet_id = pooled_sheet["spreadsheet_id"]
+        first_tab = dict(pooled_sheet["tab_properties"])
+        requests = []
+        if first_tab["title"] != worksheets[0][1]:
+            first_tab["title"] = worksheets[0][1]
+            requests.append({'updateSheetProperties': {'properties': {'sheetId': first_tab["sheetId"], 'title': first_tab["title"]}, 'fields': 'title'}})
+        for i, (_, tab_title) in enumerate(worksheets[1:], 1):
+            requests.append({'addSheet': {'properties': {'title': tab_title, 'index': i}}})
+        tab_properties = {first_tab["title"]: first_tab}
+        if requests:
+            response = self.sheets_service.spreadsheets().batchUpdate(spreadsheetId=sheet_id, body={'requests': requests}).execute()
+            for reply in response.get('replies', []):
+                if 'addSheet' in reply:
+                    properties = reply['addSheet']['properties']
+                    tab_properties[properties['title']] = properties
+        return sheet_id, pooled_sheet["url"], tab_properties
 
-        file = self.drive_service.files().update(
-            fileId=sheet_id,
-            addParents=os.environ["GOOGLE_DRIVE_FOLDER_ID"],
-            fields='id, parents'
+    def get_sheet_version(self):
+        """Returns the Drive version of the sheet, which changes on every edit"""
+        file = self.drive_service.files().get(fileId=self.sheet_id, fields='version').execute()
+        return file.get('version')
+
+    def get_sheet_metadata(self):
+        """Returns the properties of every tab by title, in tab order"""
+        metadata = self.sheets_service.spreadsheets().get(
+            spreadsheetId=self.sheet_id,
+            fields='sheets.properties(sheetId,title,index,gridProperties(rowCount,columnCount))'
         ).execute()
+        return {sheet['properties']['title']: sheet['properties'] for sheet in metadata.get('sheets', [])}
 
-        values = [df.columns.tolist()] + df.values.tolist()
+    def get_sheet_content(self, sheet_range=None):
+        """Gets content of sheet ID, reusing the container's snapshots of tabs that are unchanged.
+        sheet_range is the title of the tab instructions work on, the first tab by default. The used range
+        of every tab without a snapshot at the current version is read in one values().batchGet, and every
+        tab read is snapshotted, so later requests at the same version read none of them again. Values
+        are read unformatted so column types can be inferred, see sheet_table.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # The version and the tabs are independent, fetch them concurrently
+            version_future = executor.submit(contextvars.copy_context().run, self.get_sheet_version)
+            self.tabs = self.get_sheet_metadata()
+            self.version = version_future.result()
+        if sheet_range is None:
+            sheet_range = next(iter(self.tabs))
+        elif sheet_range not in self.tabs:
+            raise ValueError(f"No tab named {sheet_range}")
+        self.sheet_range = sheet_range
 
-        request_body = {
-            'values': values
-        }
+        self.tab_contents = {}
+        for title in self.tabs:
+            tab_content = sheet_snapshot_cache.get(self.sheet_id, title, self.version)
+            if tab_content is not None:
+                self.tab_contents[title] = tab_content
+        uncached_titles = [title for title in self.tabs if title not in self.tab_contents]
+        set_span_attributes(cache_hit=not uncached_titles, tabs=len(self.tabs), tabs_read=len(uncached_titles))
+        if uncached_titles:
+            read_sheet_result = (
+                self.sheets_service.spreadsheets().values()
+                .batchGet(spreadsheetId=self.sheet_id, ranges=[quote_tab_title(title) for title in uncached_titles],
+                          valueRenderOption="UNFORMATTED_VALUE", dateTimeRenderOption="FORMATTED_STRING")
+                .execute()
+            )
+            for title, value_range in zip(uncached_titles, read_sheet_result.get("valueRanges", [])):
+                tab_content = SheetTable.from_values(value_range.get("values", []))
+                print(f"Read values of {title}:", tab_content)
+                sheet_snapshot_cache.put(self.sheet_id, title, self.version, tab_content)
+                self.tab_contents[title] = tab_content
+        else:
+            print(f"Reusing cached sheet at version {self.version}")
 
-        self.sheets_service.spreadsheets().values().update(
-            spreadsheetId=sheet_id, range=sheet_range,
-            valueInputOption='RAW', body=request_body).execute()
+        sheet_content = self.get_tab_content(sheet_range)
+        print("Sheet cache:", sheet_snapshot_cache.stats())
+        set_span_attributes(rows=sheet_content.n_rows, columns=sheet_content.n_cols)
+        self.sheet_content = sheet_content
+        self.renderer.update(sheet_content)
+        return self.get_prompt_content()
 
-        permission = {
-            'type': 'anyone',
-            'role': 'writer'
-        }
+    def get_prompt_content(self):
+        """Returns the current table serialized for a prompt, followed by the overview of the other tabs"""
+        with span("serialize_table", table_format=self.table_format):
+            return self.renderer.render() + self.get_tabs_overview()
 
-        self.drive_service.permissions().create(fileId=sheet_id, body=permission).execute()
-        file = self.drive_service.files().get(fileId=sheet_id, fields='webViewLink').execute()
-        share_link = file.get('webViewLink')
-        return share_link
+    def get_tab_content(self, title):
+        """Returns the SheetTable of a tab read by get_sheet_content"""
+        return self.tab_contents[title]
 
-    def get_sheet_content(self, sheet_range):
-        """Gets content of sheet ID"""
-        read_sheet_result = (
-            self.sheets_service.spreadsheets().values()
-            .get(spreadsheetId=self.sheet_id, range=sheet_range)
-            .execute()
-        )
-        sheet_content = read_sheet_result.get("values", [])
-        sheet_content = pd.DataFrame(sheet_content)
-        print("Read values:", sheet_content)
-        self.sheet_content = sheet_content
-        return sheet_content.to_string()
+    def get_tabs_overview(self):
+        """Lists the tabs besides the one instructions work on, so the model knows they exist"""
+        other_titles = [title for title in self.tabs if title != self.sheet_range]
+        if not other_titles:
+            return ""
+        tabs = ", ".join(f"'{title}' ({' x '.join(map(str, self.get_tab_content(title).shape))})" for title in other_titles)
+        return f"\nTable is tab '{self.sheet_range}'. Other tabs (rows x columns): {tabs}"
+
+    def get_referenced_tabs(self, instruction):
+        """Returns the serialized content of the other tabs the instruction names, for its prompt"""
+        referenced = []
+        for title in self.get_referenced_tab_titles(instruction):
+            with span("serialize_table", table_format=self.table_format, tab=title):
+                tab_table = serialize_table(self.get_tab_content(title), self.table_format, self.token_budget)
+            referenced.append(f"\nTab '{title}' (read only):\n{tab_table}")
+        return "".join(referenced)
+
+    def get_referenced_tab_titles(self, instruction):
+        """Returns the titles of the other tabs the instruction names, see is_tab_referenced"""
+        return [title for title in self.tabs if title != self.sheet_range and is_tab_referenced(title, instruction)]
     
     def push_sheet_content(self, sheet_range):
-        """Writes sheet content back to online Google Sheets file"""
+        """Writes changed cells back to online Google Sheets file.
+        Returns the number of cells and bytes sent.
+        """
+        if not self.dirty_cells:
+            print("No changed cells to push")
+            return {"cells": 0, "bytes": 0}
+        data = []
+        for top, left, bottom, right in get_dirty_rectangles(self.dirty_cells):
+            values = [
+                [self.formulas.get((row, col), to_sheet_value(self.sheet_content.get_cell(row, col))) for col in range(left, right+1)]
+                for row in range(top, bottom+1)
+            ]
+            data.append({
+                "range": get_a1_range(sheet_range, top, left, bottom, right),
+                "values": values,
+            })
         write_sheet_body = {
-            "values": self.sheet_content.values.tolist()
+            "valueInputOption": "USER_ENTERED",
+            "data": data,
         }
         write_sheet_result = (
             self.sheets_service.spreadsheets().values()
-            .update(
-                spreadsheetId=self.sheet_id,
-                range=sheet_range,
-                valueInputOption="USER_ENTERED",
-                body=write_sheet_body,
-            )
+            .batchUpdate(spreadsheetId=self.sheet_id, body=write_sheet_body)
             .execute()
         )
         print(write_sheet_result)
+        push_stats = {
+            "cells": len(self.dirty_cells),
+            "bytes": len(json.dumps(write_sheet_body).encode("utf-8")),
+        }
+        print(f"Pushed {push_stats['cells']} cells in {len(data)} ranges ({push_stats['bytes']} bytes)")
+        set_span_attributes(ranges=len(data), **push_stats)
+        self.dirty_cells = set()
+        self.formulas = {}
+        self.cells_pushed += push_stats["cells"]
+        # The local table is not what the sheet holds now: Sheets recalculated the formulas that depend on
+        # the pushed cells and other edits may have landed since the read, so the next request re-reads it
+        sheet_snapshot_cache.invalidate(self.sheet_id, sheet_range)
+        return push_stats
     
     def expand_table(self, newRows, newCols):
         """Expand the table to size newRows x newCols"""
-        currRows = len(self.sheet_content)
-        currCols = len(self.sheet_content.columns)
-        if newCols < currCols and newRows < currRows:
-            return
-        
-        print(f"Expanding table to {newRows+1} x {newCols+1}")
-        if newCols >= currCols:
-            for i in range(currCols, newCols+1):
-                self.sheet_content[i] = [pd.NA for _ in range(currRows)]
-            currCols = newCols+1
-        if newRows >= currRows:
-            for i in range(currRows, newRows + 1):
-                self.sheet_content.loc[i] = [pd.NA for _ in range(currCols)]
-        return
+        self.sheet_content = self.sheet_content.expand(newRows+1, newCols+1)
+        self.renderer.update(self.sheet_content, rows=[])
 
     def write_table(self, args):
         """Write the table at the given rows and columns to the given values"""
-        for write_args in args:
-            row = write_args[0]
-            col = write_args[1]
-            value = write_args[2]
-
-            self.expand_table(row, col)
-
-            print(f"Setting {row}, {col} to {value}")
-            self.sheet_content.iloc[row, col] = value
+        if not args:
+            return
+        rows, cols, values = zip(*args)
+        print(f"Writing {len(args)} cells")
+        self.sheet_content = self.sheet_content.write_cells(rows, cols, values)
+        self.dirty_cells.update(zip(rows, cols))
+        # Formulas are computed locally so later instructions see their values, the push sends the formula text
+        formula_cells = {}
+        for row, col, value in args:
+            if is_formula(value):
+                formula_cells[(row, col)] = value
+            else:
+                formula_cells.pop((row, col), None)
+                self.formulas.pop((row, col), None)
+        dependents = self.get_dependent_formulas(formula_cells, cols)
+        if dependents:
+            # Formulas written earlier that read the changed columns are computed again from their text
+            dependent_rows, dependent_cols = zip(*dependents)
+            self.sheet_content = self.sheet_content.write_cells(dependent_rows, dependent_cols, list(dependents.values()))
+            rows = rows + dependent_rows
+        if formula_cells or dependents:
+            self.formulas.update(formula_cells)
+            cells = [(row, col, formula) for (row, col), formula in {**formula_cells, **dependents}.items()]
+            self.sheet_content, evaluated = evaluate_formulas(self.sheet_content, cells)
+            print(f"Evaluated {evaluated} of {len(cells)} formulas locally, {len(dependents)} of them written earlier")
+        self.renderer.update(self.sheet_content, rows)
         print("Final sheet:", self.sheet_content)
 
+    def get_dependent_formulas(self, formula_cells, cols):
+        """Returns the local formulas, other than formula_cells, that read the written columns directly
+        or through other formulas, in the order they can be computed in
+        """
+        earlier = {cell: formula for cell, formula in self.formulas.items() if cell not in formula_cells}
+        if not earlier:
+            return {}
+        cache = {}
+        referenced_columns = {cell: get_referenced_columns(formula, cache) for cell, formula in earlier.items()}
+        changed_cols = set(cols)
+        dependents = {}
+        while True:
+            new_dependents = {cell: earlier[cell] for cell, columns in referenced_columns.items()
+                              if cell not in dependents and not changed_cols.isdisjoint(columns)}
+            if not new_dependents:
+                return dependents
+            dependents.update(new_dependents)
+            changed_cols.update(col for _, col in new_dependents)
+
     def read_table(self, args):
-        """Gets the table values at the specified rows and columns"""
-        rows = args[0]
-        columns = args[1]
-        
-        maxRows = max(rows)
-        maxCols = max(columns)
-        self.expand_table(maxRows, maxCols)
-        
-        returned_values = []
-        n = len(rows)
-        for i in range(n):
-            returned_values.append(self.sheet_content.iloc[rows[i], columns[i]])
+        """Gets the table values at the given [row, col] cells.
+        Cells outside the table read as empty without growing it, so concurrent reads are safe.
+        """
+        returned_values = [self.sheet_content.get_cell(row, col) for row, col in args]
         print("Read in", returned_values)
         return returned_values
+
+    def resolve_read(self, instruction):
+        """Returns read_table args for a READ instruction that names its cells, or None if the model is needed"""
+        if self.get_referenced_tab_titles(instruction):
+            return None
+        first_row_label = 1 if self.table_format == "a1" else 0
+        return resolve_read(instruction, self.sheet_content, first_row_label)
     
     def get_chart_req(self, args):
         """Creates chart request from GPT response"""
@@ -203,18 +387,27 @@ class TableAgent:
         return create_chart_request
     
     def create_chart(self, req):
-        """Creates a chart"""
+        """Creates a chart, pushing the local writes first so it charts them"""
+        self.push_sheet_content(self.sheet_range)
         print("Creating chart with", req)
         create_chart_response = self.sheets_service.spreadsheets().batchUpdate(spreadsheetId=self.sheet_id, body=req).execute()
         print("Finished operation", create_chart_response)
     
     def other_instruction(self, args):
         """Performs other instruction via spreadsheets.batchUpdate()"""
+        # Local writes are pushed to the cells they were made for before the request can move rows or
+        # tabs, and the tables are read again after it, since pushes only send the changed cells
+        self.push_sheet_content(self.sheet_range)
         print("Executing other instruction with", args)
         other_instruction_response = self.sheets_service.spreadsheets().batchUpdate(
             spreadsheetId=self.sheet_id, body=args[0]
             ).execute()
         print("Finished operation", other_instruction_response)
+        try:
+            self.get_sheet_content(self.sheet_range)
+        except ValueError as e:
+            print(f"{e}, working on the first tab")
+            self.get_sheet_content()
     
     def execute_instruction(self, instruction_type, args):
         print(f"Attempting {instruction_type} with {args}")
@@ -245,3 +438,75 @@ class TableAgent:
         except Exception as e:
             print("Exception when attempting instruction:", e)
             return False, str(e), str(args)
+
+def quote_tab_title(title):
+    """Quotes a tab title for A1 notation. Titles are always quoted, unquoted ones like Q1 or FY2024 read as cells."""
+    return "'" + title.replace("'", "''") + "'"
+
+def is_tab_referenced(title, instruction):
+    """Whether an instruction names a tab: quoted or next to the word tab or sheet in any case, or as a
+    whole word in the exact case for titles of 4 or more characters, so tabs like "A" or "data" don't
+    match every instruction
+    """
+    name = r"(?<!\w)" + re.escape(title) + r"(?!\w)"
+    quoted = rf"['\"]{re.escape(title)}['\"]|\b(tab|sheet)\s+{name}|{name}\s+(tab|sheet)\b"
+    if re.search(quoted, instruction, re.I):
+        return True
+    return len(title) >= 4 and re.search(name, instruction) is not None
+
+def get_a1_range(sheet_range, top, left, bottom, right):
+    """Returns the A1 notation of the 0-index inclusive rectangle in the tab titled sheet_range"""
+    sheet_name = quote_tab_title(sheet_range)
+    start = f"{get_column_letter(left)}{top+1}"
+    end = f"{get_column_letter(right)}{bottom+1}"
+    if start == end:
+        return f"{sheet_name}!{start}"
+    return f"{sheet_name}!{start}:{end}"
+
+def get_dirty_rectangles(cells):
+    """Groups (row, col) cells into inclusive (top, left, bottom, right) rectangles.
+    Each row is split into runs of adjacent columns, then runs covering the same columns
+    in consecutive rows are merged, so a block of changed cells becomes a single range.
+    """
+    rows = {}
+    for row, col in cells:
+        rows.setdefault(row, []).append(col)
+
+    open_rects = {} # (left, right) -> [top, bottom] of the rectangle still growing downwards
+    rectangles = []
+    for row in sorted(rows):
+        cols = sorted(rows[row])
+        runs = []
+        start = prev = cols[0]
+        for col in cols[1:]:
+            if col != prev + 1:
+                runs.append((start, prev))
+                start = col
+            prev = col
+        runs.append((start, prev))
+
+        next_open_rects = {}
+        for run in runs:
+            rect = open_rects.pop(run, None)
+            if rect is not None and rect[1] == row - 1:
+                rect[1] = row
+            else:
+                if rect is not None:
+                    rectangles.append((rect[0], run[0], rect[1], run[1]))
+                rect = [row, row]
+            next_open_rects[run] = rect
+        for run, rect in open_rects.items():
+            rectangles.append((rect[0], run[0], rect[1], run[1]))
+        open_rects = next_open_rects
+    for run, rect in open_rects.items():
+        rectangles.append((rect[0], run[0], rect[1], run[1]))
+    return rectangles
+
+def to_sheet_value(value):
+    """Converts a DataFrame cell to a JSON serializable Google Sheets value"""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return ""
+    if hasattr(value, "item"):
+        # numpy scalar
+        return value.item()
+    return value
@@ -1,7 +1,8 @@
-from LLMAgent import LLMAgent
-from TableAgent import TableAgent
+import json
+import time
 
-from modal import App, Image, web_endpoint, Secret
+# Heavy modules (pandas, googleapiclient, openai, boto3) are imported in load_modules, before the memory snapshot
+from modal import App, Image, web_endpoint, Secret, enter
 from fastapi import File, UploadFile, FastAPI
 from fastapi.responses import StreamingResponse
 
@@ -9,13 +10,15 @@ app = App("sheetfreak")
 
 image = (
     Image.debian_slim()
-    .pip_install("pandas")
-    .pip_install("openpyxl")
-    .pip_install("google-api-python-client")
-    .pip_install("google-auth-httplib2")
-    .pip_install("google-auth-oauthlib")
-    .pip_install("openai")
-    .pip_install("boto3")
+    .pip_install(
+        "pandas",
+        "openpyxl",
+        "google-api-python-client",
+        "google-auth-httplib2",
+        "google-auth-oauthlib",
+        "openai",
+        "boto3",
+    )
 )
 
 @app.function(image=image)
@@ -23,58 +26,126 @@ image = (
 def home():
     return "sheetfreak"
 
-@app.function(image=image, secrets=[Secret.from_name("sheetfreak_GOOGLE_CREDS_CRICK"), Secret.from_name("sheetfreak_GOOGLE_DRIVE_FOLDER_ID")])
-@web_endpoint(method="POST")
-async def upload(file: UploadFile = File(...)):
-    """Upload a file (.xlsx or .csv), convert to DataFrame, and save as Google Sheet"""
-    try:
-        table_agent = TableAgent()
-        return await table_agent.upload_user_sheets(file)
-    except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error: {error_details}")
-        return "Error processing file"
-
-
-@app.function(image=image, secrets=[Secret.from_name("sheetfreak_GOOGLE_CREDS_CRICK"), Secret.from_name("sheetfreak_GOOGLE_DRIVE_FOLDER_ID")])
-@web_endpoint(method="POST")
-def ingest(req: dict):
-    """Copy the user given Google Sheets into local Google Drive and return local sheets ID"""
-    user_sheets_share_link: str = req["google_sheets_link"]
-
-    if not user_sheets_share_link:
-        return "No input provided"
-    
-    try:
-        user_sheets_id = user_sheets_share_link.split('/')[5]
-        print("Found user sheets id:", user_sheets_id)
-
-        table_agent = TableAgent()
-        user_sheets_title = table_agent.get_sheets_title(user_sheets_id)
-
-        share_link = table_agent.copy_user_sheets(user_sheets_id, user_sheets_title)
-        return share_link
-    except:
-        return "Please provide a valid Google Sheets share link and select 'Anyone with the link can view'!"
-
-@app.function(image=image, secrets=[Secret.from_name("sheetfreak_GOOGLE_CREDS_CRICK"), Secret.from_name("sheetfreak_OPENAI_PERSONAL_API_KEY"), Secret.from_name("sheetfreak_OPENAI_PERSONAL_ORG"), Secret.from_name("sheetfreak_AWS_ACCESS_KEY_ID"), Secret.from_name("sheetfreak_AWS_SECRET_ACCESS_KEY")])
-@web_endpoint(method="POST")
-def act(req: dict):
-    """Given the task prompt and sheet ID, execute the instructions"""
-    task_prompt: str = req["task_prompt"]
-    sheet_id: str = req["sheet_id"]
-    sheet_range = "Sheet1"
-
-    if not task_prompt:
-        return "Please provide a task!"
-    
-    if not sheet_id:
-        return "No sheet ID provided"
-    
-    agent = LLMAgent()
-    return StreamingResponse(
-        agent.act_streamer(task_prompt, sheet_id, sheet_range), media_type="text/event-stream"
-    )
-    
-    
\ No newline at end of file
+@app.cls(image=image, enable_memory_snapshot=True, secrets=[Secret.from_name("sheetfreak_GOOGLE_CREDS_CRICK"), Secret.from_name("sheetfreak_GOOGLE_DRIVE_FOLDER_ID"), Secret.from_name("sheetfreak_OPENAI_PERSONAL_API_KEY"), Secret.from_name("sheetfreak_OPENAI_PERSONAL_ORG"), Secret.from_name("sheetfreak_AWS_ACCESS_KEY_ID"), Secret.from_name("sheetfreak_AWS_SECRET_ACCESS_KEY")])
+class SheetFreak:
+    """Serves the table endpoints, building the Google, OpenAI and Bedrock clients once per container"""
+
+    @enter(snap=True)
+    def load_modules(self):
+        """Warm-up run before the memory snapshot: imports the backend and the client libraries, parses the
+        Google discovery documents and preloads tool schemas. Only the connections wait until after restore.
+        """
+        start = time.perf_counter()
+        import LLMAgent
+        import TableAgent
+        import httplib2
+        import google_auth_httplib2
+        import googleapiclient.discovery
+        import googleapiclient.http
+        import google.oauth2.credentials
+        import openai
+        import boto3
+        import botocore.config
+        from clients import load_discovery_documents
+        self.cold_start_report = {"import_s": time.perf_counter() - start}
+        start = time.perf_counter()
+        load_discovery_documents()
+        self.cold_start_report["discovery_s"] = time.perf_counter() - start
+        start = time.perf_counter()
+        json.dumps([LLMAgent.gpt_tools, LLMAgent.claude_tools])
+        self.cold_start_report["tool_schemas_s"] = time.perf_counter() - start
+        self.first_request = True
+
+    @enter(snap=False)
+    def build_clients(self):
+        """Builds clients after restore, since network connections can't be snapshotted"""
+        from clients import build_bedrock_client, build_google_services, build_openai_client, get_google_credentials
+        from spreadsheet_pool import SpreadsheetPool, get_shared_inventory
+        start = time.perf_counter()
+        google_creds = get_google_credentials()
+        self.drive_service, self.sheets_service = build_google_services(google_creds)
+        # Uploads take ready spreadsheets from the pool, which fills in the background. Its inventory is
+        # shared by the containers, so spreadsheets outlive the container that made them
+        self.sheet_pool = SpreadsheetPool(self.drive_service, self.sheets_service, inventory=get_shared_inventory())
+        self.sheet_pool.start_refill()
+        self.openai_client = build_openai_client()
+        self.bedrock_client = build_bedrock_client()
+        self.cold_start_report["build_clients_s"] = time.perf_counter() - start
+        self.ready_at = time.perf_counter()
+        print("Cold start:", self.cold_start_report)
+
+    def get_table_agent(self):
+        from TableAgent import TableAgent
+        return TableAgent(drive_service=self.drive_service, sheets_service=self.sheets_service, sheet_pool=self.sheet_pool)
+
+    def report_first_request(self, endpoint, request_start):
+        """Logs how long the first request of this container took, to track cold start regressions"""
+        if not self.first_request:
+            return
+        self.first_request = False
+        report = dict(self.cold_start_report)
+        report["first_request"] = endpoint
+        report["first_request_setup_s"] = time.perf_counter() - request_start
+        report["first_request_since_ready_s"] = time.perf_counter() - self.ready_at
+        print("First request:", report)
+
+    # Labels keep the URLs the functions had before they moved into this class
+    @web_endpoint(method="POST", label="sheetfreak-upload")
+    async def upload(self, file: UploadFile = File(...)):
+        """Upload a file (.xlsx or .csv), convert to DataFrame, and save as Google Sheet"""
+        request_start = time.perf_counter()
+        try:
+            table_agent = self.get_table_agent()
+            self.report_first_request("upload", request_start)
+            return await table_agent.upload_user_sheets(file)
+        except Exception as e:
+            import traceback
+            error_details = traceback.format_exc()
+            print(f"Error: {error_details}")
+            return "Error processing file"
+
+    @web_endpoint(method="POST", label="sheetfreak-ingest")
+    def ingest(self, req: dict):
+        """Copy the user given Google Sheets into local Google Drive and return local sheets ID"""
+        user_sheets_share_link: str = req["google_sheets_link"]
+
+        if not user_sheets_share_link:
+            return "No input provided"
+
+        request_start = time.perf_counter()
+        try:
+            user_sheets_id = user_sheets_share_link.split('/')[5]
+            print("Found user sheets id:", user_sheets_id)
+
+            table_agent = self.get_table_agent()
+            self.report_first_request("ingest", request_start)
+            share_link = table_agent.copy_user_sheets(user_sheets_id)
+            return share_link
+        except:
+            return "Please provide a valid Google Sheets share link and select 'Anyone with the link can view'!"
+
+    @web_endpoint(method="POST", label="sheetfreak-act")
+    async def act(self, req: dict):
+        """Given the task prompt and sheet ID, execute the instructions"""
+        task_prompt: str = req["task_prompt"]
+        sheet_id: str = req["sheet_id"]
+        sheet_range: str = req.get("sheet_range") # Tab title, the first tab if not given
+
+        if not task_prompt:
+            return "Please provide a task!"
+
+        if not sheet_id:
+            return "No sheet ID provided"
+
+        setup_start = time.perf_counter()
+        from LLMAgent import LLMAgent
+        from stream_events import with_heartbeats
+        agent = LLMAgent(single_call=req.get("single_call", False), stream_timings=req.get("timings", False),
+                         openai_client=self.openai_client, bedrock_client=self.bedrock_client,
+                         drive_service=self.drive_service, sheets_service=self.sheets_service)
+        print(f"Request setup took {(time.perf_counter() - setup_start) * 1000:.2f}ms")
+        self.report_first_request("act", setup_start)
+        return StreamingResponse(
+            with_heartbeats(agent.act_streamer(task_prompt, sheet_id, sheet_range)), media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
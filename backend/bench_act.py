@@ -0,0 +1,205 @@
+"""
+End-to-end benchmark of act_streamer, upload_user_sheets and copy_user_sheets against the offline
+fakes in fakes.py, over synthetic sheets from 1k to 1M cells.
+Reports latency percentiles, bytes sent to and received from Google, LLM tokens and peak memory,
+and checks that copy and upload stick to their expected Google calls.
+The routed measure is a single-intent task planned by intent_router without the planner call.
+Run with: python bench_act.py [--cells 1000 10000 ...] [--runs 5] [--no-latency]
+"""
+import os
+import io
+import csv
+import time
+import asyncio
+import argparse
+import contextlib
+import tracemalloc
+
+os.environ.setdefault("GOOGLE_DRIVE_FOLDER_ID", "bench-folder")
+
+from fakes import CallLog, FakeBedrock, FakeGoogle, FakeOpenAI, FakeUploadFile, LatencyModel, no_latency
+from llm_cache import ToolCallCache
+from sheet_cache import sheet_snapshot_cache
+from spreadsheet_pool import SpreadsheetPool
+from LLMAgent import LLMAgent
+from TableAgent import TableAgent
+
+N_COLS = 10
+WRITE_ROWS = 1000
+
+# Roughly what the real services add per call, see the "google_api" and "llm_call" spans of a trace
+google_latency = LatencyModel(base_ms=120, per_kb_ms=0.02, jitter_ms=40, seed=1)
+llm_latency = LatencyModel(base_ms=600, jitter_ms=200, per_chunk_ms=4, seed=2)
+
+# Google calls other than the data writes, a batch HTTP request counts as one
+COPY_CALLS = {"drive.files.get": 1, "drive.files.copy": 1, "drive.batch": 1}
+UPLOAD_CALLS = {"sheets.spreadsheets.create": 1, "drive.batch": 1}
+POOLED_UPLOAD_CALLS = {"drive.files.update": 1}
+
+def make_grid(n_cells, n_cols=N_COLS):
+    """Returns a header row plus enough rows of text and numbers to hold n_cells cells"""
+    header = [f"Column {j}" for j in range(n_cols)]
+    n_rows = max(1, n_cells // n_cols - 1)
+    return [header] + [[f"r{i}" if j == 0 else (i * 31 + j * 7) % 1000 for j in range(n_cols)] for i in range(n_rows)]
+
+def make_csv(grid):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(grid)
+    return buffer.getvalue().encode("utf-8")
+
+def make_responder(n_rows):
+    """Answers every tool the way a model would for a fill, read and question task"""
+    write_rows = list(range(1, min(n_rows, WRITE_ROWS)))
+    tool_inputs = {
+        "get_instructions": {
+            "types": ["WRITE", "READ", "QUESTION"],
+            "instructions": ["Put the total of columns B and C in column K", "Get the values in A2:A11", "What does column B hold?"],
+        },
+        "write_table": {"rows": write_rows, "columns": [N_COLS for _ in write_rows], "values": [f"=B{row+1}+C{row+1}" for row in write_rows]},
+        "read_table": {"rows": list(range(1, 11)), "columns": [0 for _ in range(10)]},
+        "question": {"answer": "Column B holds numbers between 0 and 999."},
+    }
+    def responder(tool_names, user_msg):
+        for tool_name in ["get_instructions"] + tool_names:
+            if tool_name in tool_names and tool_name in tool_inputs:
+                return [[tool_name, tool_inputs[tool_name]]]
+        raise KeyError(f"No synthetic answer for tools {tool_names}")
+    return responder
+
+def get_percentile(timings, percentile):
+    """Nearest rank percentile of a list of timings"""
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, max(0, round(percentile / 100 * len(ordered) + 0.5) - 1))]
+
+def format_timings(timings):
+    return " ".join(f"p{p} {get_percentile(timings, p):8.1f} ms" for p in (50, 90, 99))
+
+def format_totals(call_log):
+    google = call_log.totals("google")
+    llm_in = call_log.totals("openai")["input_tokens"] + call_log.totals("bedrock")["input_tokens"]
+    llm_out = call_log.totals("openai")["output_tokens"] + call_log.totals("bedrock")["output_tokens"]
+    return (f"google {google['calls']} calls, {google['bytes_sent'] / 1024:.1f} KB sent, {google['bytes_received'] / 1024:.1f} KB received | "
+            f"LLM {llm_in} tokens in, {llm_out} tokens out")
+
+async def run_act(google, sheet_id, n_rows, call_log, default_call, task_prompt="Add totals and describe the table"):
+    """Runs one act request with empty caches, returns (total ms, first plan event ms)"""
+    responder = make_responder(n_rows)
+    agent = LLMAgent(default_call=default_call, tool_call_cache=ToolCallCache(),
+                     openai_client=FakeOpenAI(responder=responder, latency=llm_latency, call_log=call_log),
+                     bedrock_client=FakeBedrock(responder=responder, latency=llm_latency, call_log=call_log),
+                     drive_service=google.drive_service, sheets_service=google.sheets_service)
+    start = time.perf_counter()
+    first_plan_ms = None
+    async for event in agent.act_streamer(task_prompt, sheet_id, "Sheet1"):
+        if first_plan_ms is None and event.startswith("event: plan"):
+            first_plan_ms = (time.perf_counter() - start) * 1000
+    return (time.perf_counter() - start) * 1000, first_plan_ms
+
+async def run_upload(google, contents, sheet_pool=None):
+    table_agent = TableAgent(drive_service=google.drive_service, sheets_service=google.sheets_service, sheet_pool=sheet_pool)
+    start = time.perf_counter()
+    await table_agent.upload_user_sheets(FakeUploadFile("bench.csv", contents))
+    return (time.perf_counter() - start) * 1000
+
+def run_copy(google, sheet_id):
+    table_agent = TableAgent(drive_service=google.drive_service, sheets_service=google.sheets_service)
+    start = time.perf_counter()
+    table_agent.copy_user_sheets(sheet_id)
+    return (time.perf_counter() - start) * 1000
+
+def check_round_trips(grid, contents):
+    """Asserts that copy and upload make no Google calls beyond the expected ones.
+    Upload data goes in values().batchUpdate calls plus any batchUpdate growing the grid.
+    """
+    call_log = CallLog()
+    google = FakeGoogle(call_log=call_log, keep_values=False)
+    sheet_id = google.add_spreadsheet("bench", {"Sheet1": grid})
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        run_copy(google, sheet_id)
+    assert get_call_counts(call_log) == COPY_CALLS, get_call_counts(call_log)
+    call_log.reset()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        asyncio.run(run_upload(google, contents))
+    calls = get_call_counts(call_log)
+    data_calls = calls.pop("sheets.spreadsheets.values.batchUpdate", 0) + calls.pop("sheets.spreadsheets.batchUpdate", 0)
+    assert calls == UPLOAD_CALLS and data_calls >= 1, get_call_counts(call_log)
+    # A pool that is not refilled afterwards, so only the upload's own calls are counted
+    sheet_pool = SpreadsheetPool(google.drive_service, google.sheets_service, target_size=1)
+    sheet_pool.refill()
+    sheet_pool.target_size = 0
+    call_log.reset()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        asyncio.run(run_upload(google, contents, sheet_pool))
+    calls = get_call_counts(call_log)
+    data_calls = calls.pop("sheets.spreadsheets.values.batchUpdate", 0) + calls.pop("sheets.spreadsheets.batchUpdate", 0)
+    assert calls == POOLED_UPLOAD_CALLS and data_calls >= 1, get_call_counts(call_log)
+
+def get_call_counts(call_log):
+    counts = {}
+    for call in call_log.calls:
+        counts[call["method"]] = counts.get(call["method"], 0) + 1
+    return counts
+
+def measure(name, n_runs, run, call_log):
+    """Times n_runs calls of run, then one more under tracemalloc for peak memory.
+    The backend's logging is silenced while it runs.
+    """
+    timings = []
+    extra = []
+    call_log.reset()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(n_runs):
+            result = run()
+            timings.append(result[0] if isinstance(result, tuple) else result)
+            if isinstance(result, tuple) and result[1] is not None:
+                extra.append(result[1])
+        totals = format_totals(call_log)
+        tracemalloc.start()
+        run()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    print(f"  {name:<7} {format_timings(timings)} | peak {peak_mb:7.1f} MB")
+    if extra:
+        print(f"  {'':<7} first plan event {format_timings(extra)}")
+    print(f"  {'':<7} {n_runs} runs: {totals}")
+
+def bench(cell_counts, n_runs, latency=True, default_call="gpt"):
+    global google_latency, llm_latency
+    if not latency:
+        google_latency = llm_latency = no_latency
+    for n_cells in cell_counts:
+        grid = make_grid(n_cells)
+        contents = make_csv(grid)
+        call_log = CallLog()
+        google = FakeGoogle(latency=google_latency, call_log=call_log)
+        sheet_id = google.add_spreadsheet("bench", {"Sheet1": grid})
+        runs = n_runs if n_cells < 1_000_000 else max(1, n_runs // 2)
+        print(f"{len(grid) * N_COLS} cells ({len(grid)} x {N_COLS}), {len(contents) / 2**20:.1f} MB as CSV:")
+        check_round_trips(grid, contents)
+
+        def act(task_prompt="Add totals and describe the table"):
+            # Each run reads the sheet and calls the models, like a request on a new sheet
+            sheet_snapshot_cache.invalidate(sheet_id, "Sheet1")
+            return asyncio.run(run_act(google, sheet_id, len(grid), call_log, default_call, task_prompt))
+        measure("act", runs, act, call_log)
+        # A single-intent task the intent router plans locally
+        measure("routed", runs, lambda: act("Get the values in A2:A11"), call_log)
+        # Uploaded values are dropped so peak memory is the backend's, not the fake's copy of the sheet
+        upload_google = FakeGoogle(latency=google_latency, call_log=call_log, keep_values=False)
+        measure("upload", runs, lambda: asyncio.run(run_upload(upload_google, contents)), call_log)
+        # The pool is topped up between runs, as the background refill would between requests
+        sheet_pool = SpreadsheetPool(upload_google.drive_service, upload_google.sheets_service, target_size=1)
+        def pooled_upload():
+            sheet_pool.refill()
+            return asyncio.run(run_upload(upload_google, contents, sheet_pool))
+        measure("pooled", runs, pooled_upload, call_log)
+        measure("copy", runs, lambda: run_copy(google, sheet_id), call_log)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cells", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-latency", action="store_true", help="measure backend overhead only")
+    parser.add_argument("--claude", action="store_true", help="use the Bedrock fake instead of the OpenAI fake")
+    args = parser.parse_args()
+    bench(args.cells, args.runs, latency=not args.no_latency, default_call="claude" if args.claude else "gpt")
@@ -0,0 +1,68 @@
+"""
+Cold start report for the backend.
+Times each heavy import in a fresh interpreter, then parsing the bundled discovery documents,
+which happens before the memory snapshot, and building the Google services from them, which happens after restore. Run with: python bench_cold_start.py
+The per-container numbers from Modal are logged by api.py as "Cold start:" and "First request:".
+"""
+import subprocess
+import sys
+import time
+
+modules = [
+    "pandas",
+    "numpy",
+    "googleapiclient.discovery",
+    "openai",
+    "boto3",
+    "openpyxl",
+    "clients",
+    "table_serializer",
+    "gpt_function_tools",
+    "claude_function_tools",
+    "TableAgent",
+    "LLMAgent",
+]
+
+def time_import(module, repeats=3):
+    """Returns the best wall time in seconds of importing module in a fresh interpreter"""
+    best = None
+    for _ in range(repeats):
+        code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        elapsed = float(result.stdout.strip().splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def time_static_discovery():
+    """Returns the seconds taken to parse the Drive and Sheets discovery documents and to build
+    the services from them, without network access
+    """
+    import httplib2
+    from googleapiclient.discovery import build_from_document
+    from clients import load_discovery_documents
+    start = time.perf_counter()
+    documents = load_discovery_documents()
+    parsed = time.perf_counter()
+    build_from_document(documents["drive", "v3"], http=httplib2.Http())
+    build_from_document(documents["sheets", "v4"], http=httplib2.Http())
+    return parsed - start, time.perf_counter() - parsed
+
+def report():
+    print("Import times (fresh interpreter, best of 3):")
+    for module in modules:
+        elapsed = time_import(module)
+        if elapsed is None:
+            print(f"  {module:<24} not importable")
+        else:
+            print(f"  {module:<24} {elapsed * 1000:8.1f} ms")
+    try:
+        parse_s, build_s = time_static_discovery()
+        print(f"Parse drive + sheets discovery documents (before snapshot): {parse_s * 1000:.1f} ms")
+        print(f"Build drive + sheets services (after restore): {build_s * 1000:.1f} ms")
+    except ImportError:
+        print("Build drive + sheets services: googleapiclient not installed")
+
+if __name__ == "__main__":
+    report()
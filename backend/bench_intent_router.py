@@ -0,0 +1,60 @@
+"""
+Hit rate and accuracy of intent_router against the labeled prompts in intent_prompts.jsonl.
+Cross-validated: each fold is routed by a model trained on the other folds, so prompts are never
+routed by a model that saw them. Also reports the shipped model on the whole set and its speed.
+Questions are routed as if asked about a sheet with the headers in bench_headers, see names_sheet_cells.
+Run with: python bench_intent_router.py [--folds 5] [--threshold 0.9]
+"""
+import time
+import random
+import argparse
+
+from intent_router import PLANNER_INTENT, ROUTE_THRESHOLD, IntentModel, classify_task, intent_model, load_labeled_prompts
+
+# Common headers, which off-topic questions use as words too
+bench_headers = ["name", "date", "price", "total", "region", "sales", "revenue", "score", "month", "product"]
+
+def get_folds(examples, n_folds, seed=0):
+    """Splits the examples into n_folds folds, each intent spread evenly over them"""
+    shuffled = list(examples)
+    random.Random(seed).shuffle(shuffled)
+    shuffled.sort(key=lambda example: example[1])
+    return [shuffled[i::n_folds] for i in range(n_folds)]
+
+def score(routed):
+    """Prints hit rate and accuracy of (prompt, intent, routed intent) triples"""
+    single = [entry for entry in routed if entry[1] != PLANNER_INTENT]
+    hits = [entry for entry in routed if entry[2] != PLANNER_INTENT]
+    correct = [entry for entry in hits if entry[2] == entry[1]]
+    false_routes = [entry for entry in hits if entry[1] == PLANNER_INTENT]
+    print(f"  hit rate {len(hits) / len(routed):.1%} of all prompts, {sum(entry[1] != PLANNER_INTENT for entry in hits) / len(single):.1%} of single-intent prompts")
+    print(f"  accuracy {len(correct) / max(len(hits), 1):.1%} of routed prompts ({len(correct)}/{len(hits)}), "
+          f"{len(false_routes)} of {len(routed) - len(single)} planner prompts routed")
+    for prompt, intent, routed_intent in hits:
+        if routed_intent != intent:
+            print(f"    {prompt!r}: routed as {routed_intent}, labeled {intent}")
+
+def bench(n_folds=5, threshold=ROUTE_THRESHOLD):
+    examples = load_labeled_prompts()
+    print(f"{len(examples)} labeled prompts, threshold {threshold}")
+    routed = []
+    folds = get_folds(examples, n_folds)
+    for i, fold in enumerate(folds):
+        model = IntentModel.train([example for j, other in enumerate(folds) if j != i for example in other])
+        routed += [(prompt, intent, classify_task(prompt, model, threshold, bench_headers)[0]) for prompt, intent in fold]
+    print(f"{n_folds}-fold cross-validation:")
+    score(routed)
+
+    print("Shipped model on the whole set:")
+    start = time.perf_counter()
+    routed = [(prompt, intent, classify_task(prompt, intent_model, threshold, bench_headers)[0]) for prompt, intent in examples]
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    score(routed)
+    print(f"  {elapsed_ms / len(examples):.3f} ms per prompt")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=ROUTE_THRESHOLD)
+    args = parser.parse_args()
+    bench(args.folds, args.threshold)
@@ -0,0 +1,59 @@
+"""
+Checks and micro-benchmark for read_resolver: which READ instructions resolve without a model call
+and to which cells, and how long resolving takes on a wide table.
+Run with: python bench_read_resolver.py
+"""
+import time
+
+from read_resolver import resolve_read
+from sheet_table import SheetTable
+
+header = ["Name", "Region", "Revenue", "Total", "Count", "Value"]
+
+# (instruction, resolved [row, col] cells or None when the model is needed), rows in 0-based prompt labels
+cases = [
+    ("Get the value in B2", [[1, 1]]),
+    ("Read A2:B3", [[1, 0], [1, 1], [2, 0], [2, 1]]),
+    ("What's in the Revenue column for row 2", [[2, 2]]),
+    ("Show row 1", [[1, col] for col in range(len(header))]),
+    ("Get the Value column for row 3", [[3, 5]]),
+    # Headers that are also aggregates could mean the column or a computation over it
+    ("Get the Total", None),
+    ("Get the Total column for row 2", None),
+    ("Read the Count column", None),
+    ("What is the total of the Revenue column", None),
+    ("Get the average Revenue", None),
+    ("Get the max of column C", None),
+    ("Get the highest price", None),
+    ("Get the Revenue", None),
+    # Reads over MAX_RESOLVED_CELLS are left to the model without building their cells
+    ("Read A1:Z200000", None),
+    ("Read rows 1 to 3000000", None),
+    ("Read A1:Z200000 and rows 1 to 3000000", None),
+]
+
+def check():
+    table = SheetTable.from_values([header] + [[f"r{i}", "North", i * 10, i * 11, i, i * 2] for i in range(5)])
+    for instruction, expected in cases:
+        resolved = resolve_read(instruction, table)
+        assert resolved == expected, (instruction, resolved, expected)
+    print(f"{len(cases)} instructions resolved as expected")
+
+def bench(n_cols=500, repeats=1000):
+    table = SheetTable.from_values([[f"Metric {j}" for j in range(n_cols)], list(range(n_cols))])
+    start = time.perf_counter()
+    for _ in range(repeats):
+        resolve_read("What's in the Metric 250 column for row 1", table)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"resolve_read on {n_cols} headers: {elapsed_ms / repeats:.3f} ms per instruction")
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        resolve_read("Read A1:Z200000", table)
+        resolve_read("Read rows 1 to 3000000", table)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"resolve_read of ranges too large to resolve: {elapsed_ms / repeats / 2:.3f} ms per instruction")
+
+if __name__ == "__main__":
+    check()
+    bench()
@@ -0,0 +1,78 @@
+"""
+Checks for resilience's circuit breakers: a half-open breaker's trial call must settle the breaker
+however it ends, and the overhead call_with_backoff adds to a call that succeeds.
+Run with: python bench_resilience.py
+"""
+import time
+import asyncio
+
+from resilience import CircuitBreaker, CircuitOpenError, call_with_backoff, circuit_breakers
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+def open_breaker(provider):
+    """Replaces the provider's breaker with one that is open and due for a trial call"""
+    circuit_breaker = CircuitBreaker(provider, failure_threshold=1, reset_timeout=0)
+    circuit_breaker.record_failure()
+    circuit_breakers[provider] = circuit_breaker
+    return circuit_breaker
+
+async def succeed():
+    return "ok"
+
+async def reject():
+    raise StatusError(400)
+
+async def hang():
+    await asyncio.sleep(60)
+
+async def check():
+    saved = dict(circuit_breakers)
+    try:
+        # A trial rejected as a bad request means the provider answered
+        circuit_breaker = open_breaker("gpt")
+        try:
+            await call_with_backoff(reject, "gpt", max_attempts=1)
+        except StatusError:
+            pass
+        assert circuit_breaker.opened_at is None and not circuit_breaker.trial_in_flight
+        assert await call_with_backoff(succeed, "gpt") == "ok"
+
+        # A cancelled trial lets the next call be the trial
+        circuit_breaker = open_breaker("gpt")
+        task = asyncio.create_task(call_with_backoff(hang, "gpt", max_attempts=1))
+        await asyncio.sleep(0)
+        assert circuit_breaker.trial_in_flight
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        assert not circuit_breaker.trial_in_flight
+        assert await call_with_backoff(succeed, "gpt") == "ok"
+
+        # While a trial is in flight every other call is turned away
+        circuit_breaker = open_breaker("gpt")
+        assert circuit_breaker.allow()
+        try:
+            await call_with_backoff(succeed, "gpt", max_attempts=1)
+            raise AssertionError("Expected CircuitOpenError")
+        except CircuitOpenError:
+            pass
+    finally:
+        circuit_breakers.update(saved)
+    print("Circuit breaker checks passed")
+
+async def bench(n_calls=10_000):
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        await call_with_backoff(succeed, "gpt")
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"call_with_backoff overhead: {elapsed_ms / n_calls * 1000:.1f} us per call")
+
+if __name__ == "__main__":
+    asyncio.run(check())
+    asyncio.run(bench())
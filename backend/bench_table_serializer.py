@@ -0,0 +1,49 @@
+"""
+Compares prompt tokens per cell of the table serializers against DataFrame.to_string().
+Uses tiktoken for exact counts when it is installed, otherwise the 4 characters per token estimate.
+Run with: python bench_table_serializer.py
+"""
+import random
+
+from sheet_table import SheetTable
+from table_serializer import estimate_tokens, serialize_table, table_serializers
+
+try:
+    import tiktoken
+    encoding = tiktoken.encoding_for_model("gpt-4o")
+    count_tokens = lambda text: len(encoding.encode(text))
+except ImportError:
+    count_tokens = estimate_tokens
+
+def make_sheet(n_rows, seed=0):
+    """Returns a sheet with a header row and a mix of text, numbers and blanks"""
+    rng = random.Random(seed)
+    header = ["Name", "Region", "Units", "Price", "Notes"]
+    rows = [header]
+    for i in range(n_rows):
+        rows.append([
+            f"Customer {i}",
+            rng.choice(["North", "South", "East", "West"]),
+            rng.randrange(1, 500),
+            round(rng.uniform(1, 100), 2),
+            rng.choice(["", "", "repeat", "priority shipping"]),
+        ])
+    return SheetTable.from_values(rows)
+
+def bench(n_rows=200, token_budget=1_000_000):
+    sheet = make_sheet(n_rows)
+    n_cells = sheet.n_rows * sheet.n_cols
+    baseline = count_tokens(sheet.to_frame().to_string())
+    print(f"{sheet.n_rows} x {sheet.n_cols} sheet, {n_cells} cells")
+    print(f"to_string: {baseline} tokens, {baseline / n_cells:.2f} tokens/cell")
+    for table_format in table_serializers:
+        tokens = count_tokens(serialize_table(sheet, table_format, token_budget))
+        print(f"{table_format}: {tokens} tokens, {tokens / n_cells:.2f} tokens/cell ({100 * tokens / baseline:.0f}% of to_string)")
+
+    large_sheet = make_sheet(50_000)
+    text = serialize_table(large_sheet, "tsv", 8000)
+    print(f"50000 row sheet with an 8000 token budget: {count_tokens(text)} tokens")
+    print(text.splitlines()[-1])
+
+if __name__ == "__main__":
+    bench()
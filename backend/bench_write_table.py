@@ -0,0 +1,50 @@
+"""
+Micro-benchmark for the bulk write engine used by TableAgent.write_table, and the memory of a
+typed SheetTable against the all-object DataFrame of formatted strings it replaced.
+Run with: python bench_write_table.py
+"""
+import random
+import time
+
+import pandas as pd
+
+from sheet_table import SheetTable
+
+def make_values(n_rows, n_cols, seed=0):
+    """Returns unformatted values shaped like a Google Sheet read: a header, then names, regions, counts and prices"""
+    rng = random.Random(seed)
+    kinds = [lambda i: f"r{i}", lambda i: rng.choice(["North", "South", "East", "West"]),
+             lambda i: rng.randrange(1000), lambda i: round(rng.uniform(1, 100), 2)]
+    header = [f"Column {j}" for j in range(n_cols)]
+    return [header] + [[(kinds[j] if j < 2 else kinds[2 + j % 2])(i) for j in range(n_cols)] for i in range(n_rows)]
+
+def make_writes(n_cells, max_row, max_col, seed=0):
+    """Returns n_cells random (row, col, value) triples, some past the current end of the sheet"""
+    rng = random.Random(seed)
+    return [(rng.randrange(max_row), rng.randrange(max_col), str(rng.random())) for _ in range(n_cells)]
+
+def get_frame_bytes(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+def bench(n_rows=100_000, n_cols=10, n_cells=10_000, repeats=5):
+    values = make_values(n_rows, n_cols)
+    sheet = SheetTable.from_values(values)
+    writes = make_writes(n_cells, n_rows + 1000, n_cols + 2)
+    rows, cols, cell_values = zip(*writes)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = sheet.write_cells(rows, cols, cell_values)
+        timings.append((time.perf_counter() - start) * 1000)
+    expected = {(row, col): value for row, col, value in writes}
+    assert all(result.get_cell(row, col) == value for (row, col), value in expected.items())
+    timings.sort()
+    print(f"{n_cells} cell writes onto {sheet.n_rows} x {sheet.n_cols} table -> {result.n_rows} x {result.n_cols}")
+    print(f"best {timings[0]:.1f} ms, median {timings[len(timings)//2]:.1f} ms over {repeats} runs")
+
+    formatted = pd.DataFrame([[str(value) for value in row] for row in values], dtype=object)
+    typed_bytes = int(sheet.memory_usage().sum())
+    print(f"Memory: {get_frame_bytes(formatted) / 2**20:.1f} MB as object strings, {typed_bytes / 2**20:.1f} MB typed {sheet.get_dtypes()}")
+
+if __name__ == "__main__":
+    bench()
@@ -6,6 +6,7 @@ Function calling tools
 - claude_create_chart
 - claude_question
 - claude_other_instruction
+- claude_single_call (system message offering every execution tool at once)
 """
 
 claude_get_instructions_tool = {
@@ -94,7 +95,7 @@ claude_write_table_tool = {
 }
 
 claude_write_table_sys_message = """You are an expert assistant using Google Sheets.
-    Given a table in a pandas dataframe representation and new-line separated instructions to write values to cells,
+    Given a table (tab separated, with the row and column labels its first line describes) and new-line separated instructions to write values to cells,
     return the function call to complete the writes as if the table is a Google Sheets. 
     Each index of the returned lists should correspond to each instruction, so all the arrays should have the same length.
     If a Google Sheets formula can be used, use the formula instead of hard-coding values or I will touch you."""
@@ -129,7 +130,7 @@ claude_read_table_tool = {
 }
 
 claude_read_table_sys_message = """You are an expert assistant using Google Sheets.
-    Given a table in a pandas dataframe representation and new-line separated instructions to get values inside cells,
+    Given a table (tab separated, with the row and column labels its first line describes) and new-line separated instructions to get values inside cells,
     return the function call to complete the get calls as if the table is a Google Sheets. 
     Each index of the returned lists correspond, so both the arrays will have the same length."""
 
@@ -169,7 +170,7 @@ claude_question_tool = {
 }
 
 claude_question_sys_message = """You are an expert assistant using Google Sheets.
-    Given a table in a pandas dataframe representation and a question regarding Google Sheets
+    Given a table (tab separated, with the row and column labels its first line describes) and a question regarding Google Sheets
     return the function call to answer the question as if the table is a Google Sheets."""
 
 claude_other_instruction_tool = {
@@ -188,7 +189,7 @@ claude_other_instruction_tool = {
 }
 
 claude_other_instruction_sys_message = """You are an expert assistant using Google Sheets.
-    Given a table in a pandas dataframe representation and an operation to be executed via the spreadsheets batchUpdate() API endpoint,
+    Given a table (tab separated, with the row and column labels its first line describes) and an operation to be executed via the spreadsheets batchUpdate() API endpoint,
     return the request body to complete the requested operation as if the table is a Google Sheets sheet."""
 
 claude_tools = {
@@ -198,4 +199,12 @@ claude_tools = {
     "claude_create_chart": (claude_create_chart_tool, claude_create_chart_sys_message),
     "claude_question": (claude_question_tool, claude_question_sys_message),
     "claude_other_instruction": (claude_other_instruction_tool, claude_other_instruction_sys_message),
-}
\ No newline at end of file
+}
+
+claude_single_call_sys_message = """You are an expert assistant using Google Sheets.
+    Given a table (tab separated, with the row and column labels its first line describes) and a task, complete the task directly with the write_table, create_chart, question, or other_instruction tools.
+    You may use several of these tools if the task needs them, each tool use is executed in the order given.
+    If the task is complex and needs several dependent steps, or you are unsure how to complete it directly, use only get_instructions to break it down into lower level instructions instead.
+    If the task is not relevant to Google Sheets at all, never complete it with question, use only get_instructions with a single INAPPROPRIATE instruction so the task is refused.
+    The instructions for each tool follow.
+    """ + "\n".join([claude_write_table_sys_message, claude_create_chart_sys_message, claude_question_sys_message, claude_other_instruction_sys_message, claude_get_instructions_sys_message])
@@ -0,0 +1,98 @@
+"""
+Builders for the Google, OpenAI and Bedrock clients.
+A container builds these once and hands them to LLMAgent and TableAgent.
+Client libraries are imported inside the builders so importing this module stays cheap.
+"""
+import os
+import json
+import threading
+from tracing import span
+
+thread_local = threading.local()
+discovery_documents = {} # Parsed discovery document of each (api, version), see load_discovery_documents
+
+def get_google_credentials():
+    """Returns the OAuth credentials in GOOGLE_CREDS_CRICK, refreshed automatically when they expire"""
+    from google.oauth2.credentials import Credentials
+    creds_json = json.loads(os.environ["GOOGLE_CREDS_CRICK"])
+    return Credentials(creds_json['token'],
+                    refresh_token=creds_json['refresh_token'],
+                    token_uri=creds_json['token_uri'],
+                    client_id=creds_json['client_id'],
+                    client_secret=creds_json['client_secret'],
+                    scopes=creds_json['scopes']
+                    )
+
+def load_discovery_documents(apis=(("drive", "v3"), ("sheets", "v4"))):
+    """Parses the discovery documents bundled with google-api-python-client.
+    Run before the memory snapshot, so restored containers neither read nor parse them.
+    """
+    from googleapiclient.discovery_cache import get_static_doc
+    for api in apis:
+        if api not in discovery_documents:
+            discovery_documents[api] = json.loads(get_static_doc(*api))
+    return discovery_documents
+
+def build_google_services(creds):
+    """Returns the Drive and Sheets services sharing one set of credentials.
+    httplib2 connections are not thread safe, so each worker thread sends its requests
+    through its own authorized connection which it keeps reusing.
+    Discovery documents come from the copies bundled with google-api-python-client, see
+    load_discovery_documents, so no network fetch happens on a cold container.
+    """
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build_from_document
+    from googleapiclient.http import HttpRequest
+
+    class TracedHttpRequest(HttpRequest):
+        """Times every Google API call as a span named after its method, e.g. sheets.spreadsheets.values.get"""
+        def execute(self, *args, **kwargs):
+            with span("google_api", method=self.methodId):
+                return super().execute(*args, **kwargs)
+
+    def build_request(http, *args, **kwargs):
+        if not hasattr(thread_local, "http"):
+            thread_local.http = AuthorizedHttp(creds, http=httplib2.Http())
+        return TracedHttpRequest(thread_local.http, *args, **kwargs)
+
+    documents = load_discovery_documents()
+    drive_service = build_from_document(documents["drive", "v3"], credentials=creds, requestBuilder=build_request)
+    sheets_service = build_from_document(documents["sheets", "v4"], credentials=creds, requestBuilder=build_request)
+    return drive_service, sheets_service
+
+def execute_batch(service, requests):
+    """Sends requests to one Google API as a single batch HTTP request, so they cost one round trip.
+    Returns their responses in order and raises the error of the first request that failed.
+    """
+    responses = [None] * len(requests)
+    errors = [None] * len(requests)
+
+    def on_response(request_id, response, exception):
+        responses[int(request_id)] = response
+        errors[int(request_id)] = exception
+
+    batch = service.new_batch_http_request(callback=on_response)
+    for i, request in enumerate(requests):
+        batch.add(request, request_id=str(i))
+    with span("google_api", method="batch", requests=len(requests)):
+        batch.execute()
+    for error in errors:
+        if error is not None:
+            raise error
+    return responses
+
+# Retries are done by resilience.call_with_backoff so they can feed the circuit breakers,
+# the clients' own retries are turned off
+def build_openai_client():
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(organization=os.environ["OPENAI_PERSONAL_ORG"], max_retries=0)
+
+def build_bedrock_client():
+    import boto3
+    from botocore.config import Config
+    return boto3.client(service_name='bedrock-runtime', region_name='us-east-1',
+                        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+                        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'],
+                        config=Config(retries={"mode": "standard", "max_attempts": 1}),
+                        )
@@ -0,0 +1,660 @@
+"""
+Offline stand-ins for the OpenAI, Bedrock and Google clients used by LLMAgent and TableAgent,
+so the backend can be benchmarked with no network access.
+
+FakeOpenAI and FakeBedrock replay model responses from a Cassette, a JSON file of responses keyed
+by a hash of the request. Requests missing from the cassette are answered by a responder function,
+or, when a real client is given, sent to the real API and recorded into the cassette.
+FakeGoogle is an in-memory Drive and Sheets that keeps every spreadsheet as grids of values and
+answers the subset of the Drive v3 and Sheets v4 APIs the backend uses.
+
+Every fake sleeps for the delay of its LatencyModel and records calls, bytes and tokens in a CallLog.
+"""
+import io
+import re
+import copy
+import datetime
+import json
+import time
+import random
+import asyncio
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from table_serializer import estimate_tokens
+from tracing import span
+
+class LatencyModel:
+    """base_ms per call plus per_kb_ms per KB sent and received, with up to jitter_ms of uniform jitter.
+    Streamed model responses also wait per_chunk_ms before each chunk.
+    """
+    def __init__(self, base_ms=0, per_kb_ms=0, jitter_ms=0, per_chunk_ms=0, seed=0):
+        self.base_ms = base_ms
+        self.per_kb_ms = per_kb_ms
+        self.jitter_ms = jitter_ms
+        self.per_chunk_ms = per_chunk_ms
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def get_delay(self, n_bytes=0):
+        with self.lock:
+            jitter_ms = self.rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0
+        return (self.base_ms + self.per_kb_ms * n_bytes / 1024 + jitter_ms) / 1000
+
+    def sleep(self, n_bytes=0):
+        delay = self.get_delay(n_bytes)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def async_sleep(self, n_bytes=0):
+        delay = self.get_delay(n_bytes)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+no_latency = LatencyModel()
+
+class CallLog:
+    """Calls made to the fakes of one run, with the bytes and tokens each one moved"""
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def record(self, surface, method, bytes_sent=0, bytes_received=0, input_tokens=0, output_tokens=0):
+        with self.lock:
+            self.calls.append({
+                "surface": surface,
+                "method": method,
+                "bytes_sent": bytes_sent,
+                "bytes_received": bytes_received,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+            })
+
+    def count(self, surface=None, method=None):
+        with self.lock:
+            return sum(1 for call in self.calls
+                       if (surface is None or call["surface"] == surface) and (method is None or call["method"] == method))
+
+    def totals(self, surface=None):
+        """Returns the number of calls and the sums of their bytes and tokens"""
+        totals = {"calls": 0, "bytes_sent": 0, "bytes_received": 0, "input_tokens": 0, "output_tokens": 0}
+        with self.lock:
+            for call in self.calls:
+                if surface is not None and call["surface"] != surface:
+                    continue
+                totals["calls"] += 1
+                for name in ("bytes_sent", "bytes_received", "input_tokens", "output_tokens"):
+                    totals[name] += call[name]
+        return totals
+
+    def reset(self):
+        with self.lock:
+            self.calls = []
+
+class Cassette:
+    """Recorded model responses keyed by a hash of the request, stored in path as one JSON object"""
+    def __init__(self, path=None):
+        self.path = path
+        self.responses = {}
+        self.lock = threading.Lock()
+        if path:
+            try:
+                with open(path) as f:
+                    self.responses = json.load(f)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def get_key(surface, request):
+        content = json.dumps([surface, request], sort_keys=True, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            return self.responses.get(key)
+
+    def put(self, key, response):
+        with self.lock:
+            self.responses[key] = response
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            with open(self.path, "w") as f:
+                json.dump(self.responses, f, indent=1, sort_keys=True)
+
+def get_json_size(value):
+    return len(json.dumps(value, default=str).encode("utf-8"))
+
+def split_text(text, chunk_chars):
+    return [text[i:i+chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+
+class FakeLLM:
+    """Shared replay logic. A responder is called as responder(tool_names, user_msg) and returns
+    the [tool name, tool input] pairs the model should answer with.
+    """
+    surface = None
+
+    def __init__(self, cassette=None, responder=None, real_client=None, latency=no_latency, call_log=None, stream_chunk_chars=16):
+        self.cassette = cassette if cassette is not None else Cassette()
+        self.responder = responder
+        self.real_client = real_client
+        self.latency = latency
+        self.call_log = call_log if call_log is not None else CallLog()
+        self.stream_chunk_chars = stream_chunk_chars
+
+    def get_replayed(self, request):
+        """Returns the recorded response for request, answering it with the responder if there is none"""
+        key = Cassette.get_key(self.surface, request)
+        response = self.cassette.get(key)
+        if response is None and self.responder is not None:
+            tool_names, user_msg = self.describe_request(request)
+            response = self.build_response(self.responder(tool_names, user_msg), request)
+        return key, response
+
+    def log(self, request, response, input_tokens, output_tokens):
+        self.call_log.record(self.surface, "invoke", get_json_size(request), get_json_size(response), input_tokens, output_tokens)
+
+class FakeOpenAI(FakeLLM):
+    """Stands in for openai.AsyncOpenAI, answering chat.completions.create with tool calls.
+    Responses are stored as {"tool_calls": [{"name", "arguments"}], "usage": {"prompt_tokens", "completion_tokens"}}.
+    """
+    surface = "openai"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def describe_request(self, request):
+        tool_names = [tool["function"]["name"] for tool in request.get("tools", [])]
+        return tool_names, request["messages"][-1]["content"]
+
+    def build_response(self, tool_calls, request):
+        arguments = [json.dumps(tool_input) for _, tool_input in tool_calls]
+        return {
+            "tool_calls": [{"name": name, "arguments": args} for (name, _), args in zip(tool_calls, arguments)],
+            "usage": {
+                "prompt_tokens": estimate_tokens(json.dumps(request)),
+                "completion_tokens": sum(estimate_tokens(args) for args in arguments),
+            },
+        }
+
+    async def create(self, **request):
+        stream = request.pop("stream", False)
+        key, response = self.get_replayed(request)
+        if response is None:
+            if self.real_client is None:
+                raise KeyError(f"No recorded OpenAI response for request {key}")
+            response = await self.record(request)
+            self.cassette.put(key, response)
+        self.log(request, response, response["usage"]["prompt_tokens"], response["usage"]["completion_tokens"])
+        await self.latency.async_sleep(get_json_size(request))
+        if stream:
+            return self.stream(response)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=None, tool_calls=[
+                SimpleNamespace(id=f"call_{i}", type="function", function=SimpleNamespace(name=call["name"], arguments=call["arguments"]))
+                for i, call in enumerate(response["tool_calls"])
+            ]))],
+            usage=SimpleNamespace(**response["usage"]),
+        )
+
+    async def record(self, request):
+        real_response = await self.real_client.chat.completions.create(**request)
+        message = real_response.choices[0].message
+        return {
+            "tool_calls": [{"name": call.function.name, "arguments": call.function.arguments} for call in message.tool_calls or []],
+            "usage": {"prompt_tokens": real_response.usage.prompt_tokens, "completion_tokens": real_response.usage.completion_tokens},
+        }
+
+    async def stream(self, response):
+        for index, call in enumerate(response["tool_calls"]):
+            for i, fragment in enumerate(split_text(call["arguments"], self.stream_chunk_chars)):
+                if self.latency.per_chunk_ms:
+                    await asyncio.sleep(self.latency.per_chunk_ms / 1000)
+                function = SimpleNamespace(name=call["name"] if i == 0 else None, arguments=fragment)
+                tool_call = SimpleNamespace(index=index, id=f"call_{index}" if i == 0 else None, function=function)
+                yield SimpleNamespace(choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=None, tool_calls=[tool_call]))])
+
+class FakeBedrock(FakeLLM):
+    """Stands in for the boto3 bedrock-runtime client with Anthropic models.
+    Responses are stored as the Anthropic messages response body.
+    """
+    surface = "bedrock"
+
+    def describe_request(self, request):
+        body = request["body"]
+        tool_names = [tool["name"] for tool in body.get("tools", [])]
+        content = body["messages"][-1]["content"]
+        return tool_names, content if isinstance(content, str) else json.dumps(content)
+
+    def build_response(self, tool_calls, request):
+        content = [{"type": "tool_use", "id": f"toolu_{i}", "name": name, "input": tool_input}
+                   for i, (name, tool_input) in enumerate(tool_calls)]
+        return {
+            "type": "message",
+            "role": "assistant",
+            "content": content,
+            "stop_reason": "tool_use",
+            "usage": {
+                "input_tokens": estimate_tokens(json.dumps(request)),
+                "output_tokens": sum(estimate_tokens(json.dumps(item["input"])) for item in content),
+            },
+        }
+
+    def get_response(self, body, modelId):
+        request = {"modelId": modelId, "body": json.loads(body)}
+        key, response = self.get_replayed(request)
+        if response is None:
+            if self.real_client is None:
+                raise KeyError(f"No recorded Bedrock response for request {key}")
+            real_response = self.real_client.invoke_model(body=body, modelId=modelId)
+            response = json.loads(real_response["body"].read())
+            self.cassette.put(key, response)
+        self.log(request, response, response["usage"]["input_tokens"], response["usage"]["output_tokens"])
+        self.latency.sleep(len(body))
+        return response
+
+    def invoke_model(self, body, modelId, **kwargs):
+        response = self.get_response(body, modelId)
+        return {"body": io.BytesIO(json.dumps(response).encode("utf-8")), "contentType": "application/json"}
+
+    def invoke_model_with_response_stream(self, body, modelId, **kwargs):
+        response = self.get_response(body, modelId)
+        return {"body": self.stream(response)}
+
+    def stream(self, response):
+        """Yields the response as Bedrock stream events, waiting per_chunk_ms before each delta"""
+        def event(message):
+            return {"chunk": {"bytes": json.dumps(message).encode("utf-8")}}
+        yield event({"type": "message_start", "message": {**response, "content": []}})
+        for index, item in enumerate(response["content"]):
+            if item["type"] == "tool_use":
+                yield event({"type": "content_block_start", "index": index, "content_block": {**item, "input": {}}})
+                deltas = [{"type": "input_json_delta", "partial_json": fragment}
+                          for fragment in split_text(json.dumps(item["input"]), self.stream_chunk_chars)]
+            else:
+                yield event({"type": "content_block_start", "index": index, "content_block": {"type": "text", "text": ""}})
+                deltas = [{"type": "text_delta", "text": fragment} for fragment in split_text(item.get("text", ""), self.stream_chunk_chars)]
+            for delta in deltas:
+                if self.latency.per_chunk_ms:
+                    time.sleep(self.latency.per_chunk_ms / 1000)
+                yield event({"type": "content_block_delta", "index": index, "delta": delta})
+            yield event({"type": "content_block_stop", "index": index})
+        yield event({"type": "message_delta", "delta": {"stop_reason": response.get("stop_reason")}, "usage": response["usage"]})
+        yield event({"type": "message_stop"})
+
+a1_cell_pattern = re.compile(r"^([A-Za-z]*)(\d*)$")
+
+def get_column_index(letters):
+    index = 0
+    for letter in letters.upper():
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+def unquote_tab_title(title):
+    if title.startswith("'") and title.endswith("'"):
+        return title[1:-1].replace("''", "'")
+    return title
+
+def parse_a1_range(a1_range, tab_titles):
+    """Returns the tab title and the 0-indexed inclusive top, left, bottom, right of an A1 range.
+    Open ends, as in "Sheet1" or "Sheet1!A:C", are None. Ranges without a tab are on the first tab.
+    """
+    if unquote_tab_title(a1_range) in tab_titles:
+        tab, cells = unquote_tab_title(a1_range), ""
+    elif "!" in a1_range:
+        tab, cells = a1_range.rsplit("!", 1)
+        tab = unquote_tab_title(tab)
+    else:
+        tab, cells = tab_titles[0], a1_range
+    if tab not in tab_titles:
+        raise ValueError(f"Unable to parse range: {a1_range}")
+    if not cells:
+        return tab, None, None, None, None
+    start, _, end = cells.partition(":")
+    end = end or start
+    start_col, start_row = a1_cell_pattern.match(start).groups()
+    end_col, end_row = a1_cell_pattern.match(end).groups()
+    return (
+        tab,
+        int(start_row) - 1 if start_row else None,
+        get_column_index(start_col) if start_col else None,
+        int(end_row) - 1 if end_row else None,
+        get_column_index(end_col) if end_col else None,
+    )
+
+def to_user_entered(value):
+    """Parses a string the way USER_ENTERED input does for plain numbers, formulas stay strings"""
+    if isinstance(value, str):
+        try:
+            number = float(value)
+            return int(number) if number.is_integer() and "." not in value else number
+        except ValueError:
+            return value
+    return value
+
+def to_formatted(value):
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+class FakeRequest:
+    """A pending fake API call, like googleapiclient.http.HttpRequest"""
+    def __init__(self, google, method_id, handler, request):
+        self.google = google
+        self.methodId = method_id
+        self.handler = handler
+        self.request = request
+
+    def execute(self, num_retries=0):
+        with span("google_api", method=self.methodId):
+            response = self.handler()
+            bytes_sent = get_json_size(self.request)
+            bytes_received = get_json_size(response)
+            self.google.call_log.record("google", self.methodId, bytes_sent, bytes_received)
+            self.google.latency.sleep(bytes_sent + bytes_received)
+        return response
+
+class FakeBatchRequest:
+    """A fake batch HTTP request, like googleapiclient.http.BatchHttpRequest. It is logged as one
+    call named after the API, e.g. drive.batch, and pays the latency of a single round trip.
+    """
+    def __init__(self, google, api, callback=None):
+        self.google = google
+        self.api = api
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback or self.callback, request_id or str(len(self.requests) + 1)))
+
+    def execute(self, http=None):
+        method_id = f"{self.api}.batch"
+        results = []
+        with span("google_api", method=method_id):
+            bytes_sent = bytes_received = 0
+            for request, callback, request_id in self.requests:
+                try:
+                    response, exception = request.handler(), None
+                except Exception as e:
+                    response, exception = None, e
+                bytes_sent += get_json_size(request.request)
+                bytes_received += get_json_size(response)
+                results.append((callback, request_id, response, exception))
+            self.google.call_log.record("google", method_id, bytes_sent, bytes_received)
+            self.google.latency.sleep(bytes_sent + bytes_received)
+        for callback, request_id, response, exception in results:
+            if callback is not None:
+                callback(request_id, response, exception)
+
+class FakeResource:
+    """Maps attribute access to handler methods of FakeGoogle, e.g. spreadsheets().values().get(...)"""
+    def __init__(self, google, prefix, children=()):
+        self.google = google
+        self.prefix = prefix
+        self.children = children
+
+    def __getattr__(self, name):
+        if name == "new_batch_http_request" and "." not in self.prefix:
+            return lambda callback=None: FakeBatchRequest(self.google, self.prefix, callback)
+        if name in self.children:
+            return lambda: FakeResource(self.google, f"{self.prefix}.{name}", self.children[name])
+        method_id = f"{self.prefix}.{name}"
+        handler = getattr(self.google, method_id.replace(".", "_"), None)
+        if handler is None:
+            raise AttributeError(f"{method_id} is not faked")
+        return lambda **kwargs: FakeRequest(self.google, method_id, lambda: handler(**kwargs), kwargs)
+
+class FakeGoogle:
+    """In-memory Drive and Sheets, use drive_service and sheets_service like the built services.
+    Spreadsheets are kept as {"name", "parents", "version", "permissions", "tabs"} where tabs maps each
+    tab title to {"sheet_id", "grid"} and grid is a list of rows of values.
+    With keep_values=False written values are dropped, so benchmarks only measure the caller's memory.
+    """
+    def __init__(self, latency=no_latency, call_log=None, keep_values=True):
+        self.latency = latency
+        self.keep_values = keep_values
+        self.call_log = call_log if call_log is not None else CallLog()
+        self.files = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.RLock()
+        self.drive_service = FakeResource(self, "drive", {"files": {}, "permissions": {}})
+        self.sheets_service = FakeResource(self, "sheets", {"spreadsheets": {"values": {}}})
+
+    def add_spreadsheet(self, name, tabs=None):
+        """Adds a spreadsheet directly, without a call, and returns its ID. tabs maps tab titles to grids."""
+        with self.lock:
+            file_id = f"fake-sheet-{next(self.ids)}"
+            self.files[file_id] = {"name": name, "parents": [], "version": 1, "permissions": [], "tabs": OrderedDict(),
+                                   "app_properties": {}, "created_at": time.time()}
+            for title, grid in (tabs or {"Sheet1": []}).items():
+                self.add_tab(file_id, title, [list(row) for row in grid])
+            return file_id
+
+    def add_tab(self, file_id, title, grid=None):
+        tab = {"sheet_id": next(self.ids), "grid": grid if grid is not None else [], "row_count": 1000, "column_count": 26}
+        self.files[file_id]["tabs"][title] = tab
+        return tab
+
+    def get_file(self, file_id):
+        if file_id not in self.files:
+            raise KeyError(f"File {file_id} not found")
+        return self.files[file_id]
+
+    def get_values(self, file_id, a1_range, value_render_option="FORMATTED_VALUE"):
+        spreadsheet = self.get_file(file_id)
+        tab_title, top, left, bottom, right = parse_a1_range(a1_range, list(spreadsheet["tabs"]))
+        grid = spreadsheet["tabs"][tab_title]["grid"]
+        rows = grid[top or 0: None if bottom is None else bottom + 1]
+        values = []
+        for row in rows:
+            row = row[left or 0: None if right is None else right + 1]
+            while row and row[-1] in ("", None):
+                row = row[:-1]
+            if value_render_option == "FORMATTED_VALUE":
+                row = ["" if value is None else to_formatted(value) for value in row]
+            values.append(row)
+        while values and not values[-1]:
+            values.pop()
+        return {"range": a1_range, "majorDimension": "ROWS", "values": values} if values else {"range": a1_range, "majorDimension": "ROWS"}
+
+    def set_values(self, file_id, a1_range, values, value_input_option):
+        spreadsheet = self.get_file(file_id)
+        tab_title, top, left, _, _ = parse_a1_range(a1_range, list(spreadsheet["tabs"]))
+        tab = spreadsheet["tabs"][tab_title]
+        grid = tab["grid"]
+        top = top or 0
+        left = left or 0
+        if not self.keep_values:
+            tab["row_count"] = max(tab["row_count"], top + len(values))
+            spreadsheet["version"] += 1
+            return {"spreadsheetId": file_id, "updatedRange": a1_range, "updatedRows": len(values),
+                    "updatedCells": sum(len(row) for row in values)}
+        for i, row in enumerate(values):
+            while len(grid) <= top + i:
+                grid.append([])
+            grid_row = grid[top + i]
+            if len(grid_row) < left + len(row):
+                grid_row.extend([""] * (left + len(row) - len(grid_row)))
+            for j, value in enumerate(row):
+                grid_row[left + j] = to_user_entered(value) if value_input_option == "USER_ENTERED" else value
+        tab["row_count"] = max(tab["row_count"], len(grid))
+        tab["column_count"] = max(tab["column_count"], max((len(row) for row in grid), default=0))
+        spreadsheet["version"] += 1
+        return {"spreadsheetId": file_id, "updatedRange": a1_range, "updatedRows": len(values),
+                "updatedCells": sum(len(row) for row in values)}
+
+    def get_metadata(self, file_id):
+        spreadsheet = self.get_file(file_id)
+        return {
+            "spreadsheetId": file_id,
+            "properties": {"title": spreadsheet["name"]},
+            "sheets": [{"properties": {"sheetId": tab["sheet_id"], "title": title, "index": index,
+                                       "gridProperties": {"rowCount": tab["row_count"], "columnCount": tab["column_count"]}}}
+                       for index, (title, tab) in enumerate(spreadsheet["tabs"].items())],
+            "spreadsheetUrl": f"https://docs.google.com/spreadsheets/d/{file_id}/edit",
+        }
+
+    # Sheets v4
+
+    def sheets_spreadsheets_create(self, body, fields=None):
+        with self.lock:
+            tabs = [sheet["properties"]["title"] for sheet in body.get("sheets", [])] or ["Sheet1"]
+            file_id = self.add_spreadsheet(body.get("properties", {}).get("title", "Untitled spreadsheet"), {title: [] for title in tabs})
+            return self.get_metadata(file_id)
+
+    def sheets_spreadsheets_get(self, spreadsheetId, fields=None, ranges=None, includeGridData=False):
+        with self.lock:
+            return self.get_metadata(spreadsheetId)
+
+    def sheets_spreadsheets_batchUpdate(self, spreadsheetId, body):
+        with self.lock:
+            spreadsheet = self.get_file(spreadsheetId)
+            tabs_by_id = {tab["sheet_id"]: title for title, tab in spreadsheet["tabs"].items()}
+            replies = []
+            for request in body.get("requests", []):
+                if "addSheet" in request:
+                    title = request["addSheet"].get("properties", {}).get("title", f"Sheet{len(spreadsheet['tabs']) + 1}")
+                    tab = self.add_tab(spreadsheetId, title)
+                    replies.append({"addSheet": {"properties": {"sheetId": tab["sheet_id"], "title": title}}})
+                elif "updateSheetProperties" in request:
+                    properties = request["updateSheetProperties"]["properties"]
+                    old_title = tabs_by_id.get(properties.get("sheetId", 0), next(iter(spreadsheet["tabs"])))
+                    if "title" in properties and properties["title"] != old_title:
+                        spreadsheet["tabs"] = OrderedDict((properties["title"] if title == old_title else title, tab)
+                                                          for title, tab in spreadsheet["tabs"].items())
+                        tabs_by_id = {tab["sheet_id"]: title for title, tab in spreadsheet["tabs"].items()}
+                    replies.append({})
+                elif "appendDimension" in request:
+                    append = request["appendDimension"]
+                    tab = spreadsheet["tabs"][tabs_by_id.get(append["sheetId"], next(iter(spreadsheet["tabs"])))]
+                    tab["row_count" if append["dimension"] == "ROWS" else "column_count"] += append["length"]
+                    replies.append({})
+                elif "deleteSheet" in request:
+                    del spreadsheet["tabs"][tabs_by_id[request["deleteSheet"]["sheetId"]]]
+                    replies.append({})
+                elif "addChart" in request:
+                    replies.append({"addChart": {"chart": {"chartId": next(self.ids), **request["addChart"]["chart"]}}})
+                else:
+                    replies.append({})
+            spreadsheet["version"] += 1
+            return {"spreadsheetId": spreadsheetId, "replies": replies}
+
+    def sheets_spreadsheets_values_get(self, spreadsheetId, range, valueRenderOption="FORMATTED_VALUE", majorDimension="ROWS", **kwargs):
+        with self.lock:
+            return self.get_values(spreadsheetId, range, valueRenderOption)
+
+    def sheets_spreadsheets_values_batchGet(self, spreadsheetId, ranges, valueRenderOption="FORMATTED_VALUE", majorDimension="ROWS", **kwargs):
+        with self.lock:
+            return {"spreadsheetId": spreadsheetId,
+                    "valueRanges": [self.get_values(spreadsheetId, a1_range, valueRenderOption) for a1_range in ranges]}
+
+    def sheets_spreadsheets_values_update(self, spreadsheetId, range, body, valueInputOption="RAW", **kwargs):
+        with self.lock:
+            return self.set_values(spreadsheetId, range, body.get("values", []), valueInputOption)
+
+    def sheets_spreadsheets_values_batchUpdate(self, spreadsheetId, body):
+        with self.lock:
+            responses = [self.set_values(spreadsheetId, data["range"], data.get("values", []), body.get("valueInputOption", "RAW"))
+                         for data in body.get("data", [])]
+            return {"spreadsheetId": spreadsheetId, "totalUpdatedCells": sum(response["updatedCells"] for response in responses),
+                    "responses": responses}
+
+    # Drive v3
+
+    def get_drive_file(self, file_id):
+        spreadsheet = self.get_file(file_id)
+        return {
+            "id": file_id,
+            "name": spreadsheet["name"],
+            "mimeType": "application/vnd.google-apps.spreadsheet",
+            "parents": list(spreadsheet["parents"]),
+            "version": str(spreadsheet["version"]),
+            "webViewLink": f"https://docs.google.com/spreadsheets/d/{file_id}/edit?usp=drivesdk",
+        }
+
+    def drive_files_get(self, fileId, fields=None, **kwargs):
+        with self.lock:
+            return self.get_drive_file(fileId)
+
+    def drive_files_list(self, q="", fields=None, pageSize=100, **kwargs):
+        """Supports queries joining "'<id>' in parents", "appProperties has { key='k' and value='v' }",
+        "createdTime < '<RFC 3339 UTC time>'" and "trashed = false" with and
+        """
+        parents = re.findall(r"'([^']*)' in parents", q)
+        app_properties = re.findall(r"appProperties has \{ key='([^']*)' and value='([^']*)' \}", q)
+        created_before = re.findall(r"createdTime < '([^']*)'", q)
+        cutoff = datetime.datetime.fromisoformat(created_before[0]).replace(tzinfo=datetime.timezone.utc).timestamp() if created_before else None
+        with self.lock:
+            files = []
+            for file_id, spreadsheet in self.files.items():
+                if any(parent not in spreadsheet["parents"] for parent in parents):
+                    continue
+                if any(spreadsheet["app_properties"].get(key) != value for key, value in app_properties):
+                    continue
+                if cutoff is not None and spreadsheet["created_at"] >= cutoff:
+                    continue
+                files.append({"id": file_id, "name": spreadsheet["name"]})
+            return {"files": files[:pageSize]}
+
+    def drive_files_copy(self, fileId, body=None, fields=None, **kwargs):
+        with self.lock:
+            source = self.get_file(fileId)
+            file_id = f"fake-sheet-{next(self.ids)}"
+            copied = copy.deepcopy(source)
+            copied.update({"name": (body or {}).get("name", "Copy of " + source["name"]),
+                           "parents": list((body or {}).get("parents", [])), "version": 1, "permissions": [],
+                           "app_properties": {}, "created_at": time.time()})
+            self.files[file_id] = copied
+            return self.get_drive_file(file_id)
+
+    def drive_files_update(self, fileId, body=None, addParents=None, removeParents=None, fields=None, **kwargs):
+        with self.lock:
+            spreadsheet = self.get_file(fileId)
+            if addParents:
+                spreadsheet["parents"].extend(addParents.split(","))
+            if removeParents:
+                spreadsheet["parents"] = [parent for parent in spreadsheet["parents"] if parent not in removeParents.split(",")]
+            if body and "name" in body:
+                spreadsheet["name"] = body["name"]
+            for key, value in (body or {}).get("appProperties", {}).items():
+                if value is None:
+                    spreadsheet["app_properties"].pop(key, None)
+                else:
+                    spreadsheet["app_properties"][key] = value
+            spreadsheet["version"] += 1
+            return self.get_drive_file(fileId)
+
+    def drive_files_delete(self, fileId, **kwargs):
+        with self.lock:
+            self.get_file(fileId)
+            del self.files[fileId]
+            return ""
+
+    def drive_permissions_create(self, fileId, body, fields=None, **kwargs):
+        with self.lock:
+            permission = {"id": f"permission-{next(self.ids)}", **body}
+            self.get_file(fileId)["permissions"].append(permission)
+            return permission
+
+class FakeUploadFile:
+    """Stands in for fastapi.UploadFile"""
+    def __init__(self, filename, contents):
+        self.filename = filename
+        self.file = io.BytesIO(contents)
+
+    async def read(self, size=-1):
+        return self.file.read(size)
+
+    async def seek(self, offset):
+        self.file.seek(offset)
+
+    async def close(self):
+        self.file.close()
@@ -0,0 +1,460 @@
+"""
+Local evaluation of the formulas instructions write, so the rest of a request sees computed values
+without reading the sheet back. The sheet still gets the formula text, see TableAgent.push_sheet_content.
+Supports numbers, strings, TRUE/FALSE, cell refs and ranges (A1, $A$1, A1:B10, B:B), the operators
++ - * / ^ & = <> < > <= >= and SUM, AVERAGE, MIN, MAX, COUNT and IF.
+Formulas written down a column that only differ by their relative refs, like =B2+C2 then =B3+C3,
+form one group evaluated once over all its rows with numpy. References to empty cells read as 0 in
+arithmetic and as empty text otherwise, like in Sheets. Errors (text in arithmetic, division by zero,
+anything unsupported) leave the formula text in the cell.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+MAX_PASSES = 3 # Groups referencing formulas of later groups are retried after them
+
+token_pattern = re.compile(r"""\s*(?:
+    (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)|
+    (?P<string>"(?:[^"]|"")*")|
+    (?P<range>\$?[A-Za-z]{1,3}\$?\d+:\$?[A-Za-z]{1,3}\$?\d+|\$?[A-Za-z]{1,3}:\$?[A-Za-z]{1,3}(?![A-Za-z0-9(]))|
+    (?P<ref>\$?[A-Za-z]{1,3}\$?\d+(?![A-Za-z0-9(]))|
+    (?P<name>[A-Za-z_][A-Za-z0-9_.]*)|
+    (?P<op><>|<=|>=|[-+*/^&=<>(),]))""", re.X)
+cell_pattern = re.compile(r"(\$?)([A-Za-z]{1,3})(\$?)(\d*)")
+fill_pattern = re.compile(r'("(?:[^"]|"")*")|(?<![A-Za-z0-9_.$])(\$?[A-Za-z]{1,3})(\$?)(\d+)(?![A-Za-z0-9(])')
+# Refs and ranges with the columns they start and end at, quoted text is matched to be skipped
+column_ref_pattern = re.compile(
+    r'"(?:[^"]|"")*"|(?<![A-Za-z0-9_.$])\$?([A-Za-z]{1,3})'
+    r'(?:\$?\d+(?::\$?([A-Za-z]{1,3})\$?\d+)?|:\$?([A-Za-z]{1,3}))(?![A-Za-z0-9(])')
+number_pattern = re.compile(r"\d+")
+comparison_ops = {"=", "<>", "<", ">", "<=", ">="}
+aggregate_functions = {"SUM", "AVERAGE", "MIN", "MAX", "COUNT"}
+
+class FormulaError(Exception):
+    pass
+
+class NeedsRowByRow(Exception):
+    """A group uses a construct that can't be evaluated over all its rows at once"""
+
+def is_formula(value):
+    return isinstance(value, str) and value.startswith("=") and len(value) > 1
+
+def get_column_index(letters):
+    """Converts A1 column letters to a 0-index column (A -> 0, AA -> 26)"""
+    col = 0
+    for letter in letters.upper():
+        col = col * 26 + ord(letter) - ord("A") + 1
+    return col - 1
+
+def get_referenced_columns(formula, cache=None):
+    """Returns the columns a formula's refs and ranges read, without parsing it. cache maps formulas
+    with their numbers collapsed to their columns, so formulas filled down a column are scanned once.
+    """
+    if cache is not None:
+        key = number_pattern.sub("0", formula)
+        if key not in cache:
+            cache[key] = get_referenced_columns(key)
+        return cache[key]
+    columns = set()
+    for match in column_ref_pattern.finditer(formula):
+        first, last, column_last = match.groups()
+        if first is None:
+            continue
+        left, right = get_column_index(first), get_column_index(last or column_last or first)
+        columns.update(range(min(left, right), max(left, right) + 1))
+    return columns
+
+def parse_cell(text):
+    """Returns (row, col, row_abs, col_abs) of an A1 cell, row None for a whole column"""
+    col_abs, letters, row_abs, digits = cell_pattern.fullmatch(text).groups()
+    row = int(digits) - 1 if digits else None
+    return row, get_column_index(letters), bool(row_abs) or row is None, bool(col_abs)
+
+def tokenize(formula):
+    tokens = []
+    position = 0
+    formula = formula.rstrip()
+    while position < len(formula):
+        match = token_pattern.match(formula, position)
+        if match is None or match.end() == position:
+            raise FormulaError(f"Unsupported syntax at {formula[position:]!r}")
+        position = match.end()
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+    return tokens
+
+class Parser:
+    """Recursive descent parser building tuples: ("value", v), ("ref", row, col, row_abs, col_abs),
+    ("range", top, left, bottom, right, top_abs, bottom_abs), ("unary", op, x), ("binary", op, a, b)
+    and ("call", name, args)
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        kind, text = self.peek()
+        if kind is None or (value is not None and text != value):
+            raise FormulaError(f"Expected {value or 'a value'}")
+        self.position += 1
+        return kind, text
+
+    def parse(self):
+        node = self.parse_binary(0)
+        if self.position != len(self.tokens):
+            raise FormulaError("Unexpected trailing input")
+        return node
+
+    # Lowest precedence first
+    levels = [comparison_ops, {"&"}, {"+", "-"}, {"*", "/"}, {"^"}]
+
+    def parse_binary(self, level):
+        if level == len(self.levels):
+            return self.parse_unary()
+        node = self.parse_binary(level + 1)
+        while self.peek()[0] == "op" and self.peek()[1] in self.levels[level]:
+            op = self.take()[1]
+            node = ("binary", op, node, self.parse_binary(level + 1))
+        return node
+
+    def parse_unary(self):
+        if self.peek() in (("op", "-"), ("op", "+")):
+            return ("unary", self.take()[1], self.parse_unary())
+        return self.parse_primary()
+
+    def parse_primary(self):
+        kind, text = self.take()
+        if kind == "number":
+            return ("value", float(text))
+        if kind == "string":
+            return ("value", text[1:-1].replace('""', '"'))
+        if kind == "ref":
+            return ("ref", *parse_cell(text))
+        if kind == "range":
+            start, end = text.split(":")
+            top, left, top_abs, _ = parse_cell(start)
+            bottom, right, bottom_abs, _ = parse_cell(end)
+            return ("range", top, min(left, right), bottom, max(left, right), top_abs, bottom_abs)
+        if kind == "name":
+            name = text.upper()
+            if self.peek() != ("op", "("):
+                if name in ("TRUE", "FALSE"):
+                    return ("value", name == "TRUE")
+                raise FormulaError(f"Unsupported name {text}")
+            if name not in aggregate_functions and name != "IF":
+                raise FormulaError(f"Unsupported function {text}")
+            self.take("(")
+            args = []
+            if self.peek() != ("op", ")"):
+                args.append(self.parse_binary(0))
+                while self.peek() == ("op", ","):
+                    self.take(",")
+                    args.append(self.parse_binary(0))
+            self.take(")")
+            if name == "IF" and len(args) not in (2, 3):
+                raise FormulaError("IF takes 2 or 3 arguments")
+            return ("call", name, args)
+        if (kind, text) == ("op", "("):
+            node = self.parse_binary(0)
+            self.take(")")
+            return node
+        raise FormulaError(f"Unexpected {text}")
+
+def parse_formula(formula):
+    """Parses a formula string starting with =, raising FormulaError if it is outside the supported subset"""
+    return Parser(tokenize(formula[1:])).parse()
+
+def get_signature(node, row):
+    """Returns the formula in R1C1 terms relative to row, equal for formulas filled down a column"""
+    kind = node[0]
+    if kind == "value":
+        return repr(node[1])
+    if kind == "ref":
+        _, ref_row, col, row_abs, _ = node
+        return f"R{ref_row if row_abs else f'[{ref_row - row}]'}C{col}"
+    if kind == "range":
+        _, top, left, bottom, right, top_abs, bottom_abs = node
+        top_text = top if top_abs else f"[{top - row}]"
+        bottom_text = bottom if bottom_abs else f"[{bottom - row}]"
+        return f"R{top_text}C{left}:R{bottom_text}C{right}"
+    if kind == "unary":
+        return f"({node[1]}{get_signature(node[2], row)})"
+    if kind == "binary":
+        return f"({get_signature(node[2], row)}{node[1]}{get_signature(node[3], row)})"
+    return f"{node[1]}(" + ",".join(get_signature(arg, row) for arg in node[2]) + ")"
+
+def get_fill_key(formula, row):
+    """Returns the formula with its relative row numbers made relative to row, so formulas filled
+    down a column share a key without being parsed. Text in quotes is left as is.
+    """
+    # Split pieces repeat text, quoted string, column, row $, row number
+    parts = fill_pattern.split(formula)
+    for i in range(4, len(parts), 5):
+        if parts[i] is not None and not parts[i-1]:
+            parts[i] = int(parts[i]) - row
+    return tuple(parts)
+
+def is_vector(value):
+    return isinstance(value, np.ndarray)
+
+def to_numbers(values, empty=0.0, bools=True):
+    """Converts sheet values to floats, NaN marking values that aren't numbers. Empty cells become
+    empty, booleans 1 and 0 unless bools is False, and numeric text its number.
+    """
+    if not is_vector(values):
+        return to_numbers(np.array([values], dtype=object), empty, bools)[0]
+    if values.dtype.kind in "fiu":
+        return values.astype(float)
+    if values.dtype.kind == "b":
+        return values.astype(float) if bools else np.full(len(values), np.nan)
+    series = pd.Series(values, dtype=object)
+    is_empty = series.isna() | series.eq("")
+    numbers = np.array(pd.to_numeric(series.mask(is_empty, 0), errors="coerce"), dtype=float)
+    numbers[is_empty.to_numpy()] = empty
+    if not bools:
+        numbers[series.map(type).eq(bool).to_numpy()] = np.nan
+    return numbers
+
+def to_texts(values):
+    """Converts sheet values to text like the sheet displays them"""
+    def to_text(value):
+        if value is None or (isinstance(value, float) and value != value):
+            return ""
+        if isinstance(value, bool):
+            return "TRUE" if value else "FALSE"
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+    if is_vector(values):
+        return np.array([to_text(value) for value in values], dtype=object)
+    return to_text(values)
+
+def to_bools(values):
+    """Converts sheet values to truth values, NaN marking ones that are neither numbers nor booleans"""
+    numbers = to_numbers(values)
+    if is_vector(values) and values.dtype == object:
+        texts = pd.Series(values, dtype=object).map(lambda value: value.upper() if isinstance(value, str) else None)
+        numbers = np.where(texts.eq("TRUE"), 1.0, np.where(texts.eq("FALSE"), 0.0, numbers))
+    elif isinstance(values, str) and values.upper() in ("TRUE", "FALSE"):
+        numbers = float(values.upper() == "TRUE")
+    return numbers
+
+class GroupEvaluator:
+    """Evaluates one group of filled-down formulas over the grid rows of its cells"""
+    def __init__(self, table, rows, first_row):
+        self.table = table
+        self.rows = rows
+        self.first_row = first_row
+
+    def evaluate(self, node):
+        kind = node[0]
+        if kind == "value":
+            return node[1]
+        if kind == "ref":
+            _, row, col, row_abs, _ = node
+            if row_abs:
+                return self.table.take(col, [row])[0]
+            return self.table.take(col, self.rows + (row - self.first_row))
+        if kind == "range":
+            raise FormulaError("Ranges are only supported inside functions")
+        if kind == "unary":
+            value = to_numbers(self.evaluate(node[2]))
+            return -value if node[1] == "-" else value
+        if kind == "binary":
+            return self.evaluate_binary(node[1], self.evaluate(node[2]), self.evaluate(node[3]))
+        name, args = node[1], node[2]
+        if name == "IF":
+            condition = to_bools(self.evaluate(args[0]))
+            if_true = self.evaluate(args[1])
+            if_false = self.evaluate(args[2]) if len(args) == 3 else False
+            if not is_vector(condition):
+                return condition if condition != condition else (if_true if condition else if_false)
+            result = np.where(condition != 0, broadcast(if_true, len(self.rows)), broadcast(if_false, len(self.rows)))
+            result = result.astype(object)
+            result[np.isnan(condition)] = np.nan
+            return result
+        return self.evaluate_aggregate(name, args)
+
+    def evaluate_binary(self, op, left, right):
+        if op == "&":
+            return np_add(to_texts(left), to_texts(right))
+        if op in comparison_ops:
+            return compare(op, left, right)
+        left, right = to_numbers(left), to_numbers(right)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            if op == "+":
+                return left + right
+            if op == "-":
+                return left - right
+            if op == "*":
+                return left * right
+            if op == "/":
+                # Division by zero gives inf or NaN, which are errors
+                return left / right
+            return np.power(left, right)
+
+    def get_range_values(self, node):
+        """Returns the values of a range as a list of (values, per_row) pairs, one per column.
+        per_row values hold one value per group row, the others are the whole range for every row.
+        """
+        _, top, left, bottom, right, top_abs, bottom_abs = node
+        if top is None:
+            top, bottom = 0, self.table.n_rows - 1
+        elif not (top_abs and bottom_abs):
+            if len(self.rows) == 1:
+                shift = self.rows[0] - self.first_row
+                top, bottom = top + (0 if top_abs else shift), bottom + (0 if bottom_abs else shift)
+            elif not top_abs and not bottom_abs and top == bottom:
+                shifted = self.rows + (top - self.first_row)
+                return [(self.table.take(col, shifted), True) for col in range(left, right + 1)]
+            else:
+                raise NeedsRowByRow()
+        rows = np.arange(top, min(bottom, self.table.n_rows - 1) + 1)
+        return [(self.table.take(col, rows), False) for col in range(left, right + 1)]
+
+    def evaluate_aggregate(self, name, args):
+        """Sums, counts, mins and maxes the numbers of every argument, per group row where needed.
+        Text and booleans in ranges are skipped like in Sheets, direct arguments must be numbers.
+        """
+        n = len(self.rows)
+        total, count = 0.0, 0.0
+        minimum, maximum = np.inf, -np.inf
+        errors = np.zeros(n, dtype=bool)
+        parts = []
+        for arg in args:
+            if arg[0] == "range":
+                for values, per_row in self.get_range_values(arg):
+                    parts.append((to_numbers(values, empty=np.nan, bools=False), per_row, False))
+            else:
+                value = to_numbers(self.evaluate(arg))
+                parts.append((value if is_vector(value) else np.array([value]), is_vector(value), True))
+        for numbers, per_row, direct in parts:
+            if per_row:
+                present = ~np.isnan(numbers)
+                if direct:
+                    errors |= ~present
+                total = total + np.where(present, numbers, 0.0)
+                count = count + present
+                minimum = np.fmin(minimum, np.where(present, numbers, np.inf))
+                maximum = np.fmax(maximum, np.where(present, numbers, -np.inf))
+            else:
+                present = numbers[~np.isnan(numbers)]
+                if direct and len(present) < len(numbers):
+                    errors |= True
+                total = total + present.sum()
+                count = count + len(present)
+                if len(present):
+                    minimum = np.fmin(minimum, present.min())
+                    maximum = np.fmax(maximum, present.max())
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if name == "SUM":
+                result = total
+            elif name == "COUNT":
+                result = count
+            elif name == "AVERAGE":
+                result = np.where(np.asarray(count) == 0, np.nan, np.asarray(total) / np.maximum(count, 1))
+            elif name == "MIN":
+                result = np.where(np.asarray(count) == 0, 0.0, minimum)
+            else:
+                result = np.where(np.asarray(count) == 0, 0.0, maximum)
+        result = np.broadcast_to(np.asarray(result, dtype=float), (n,)).copy()
+        result[errors] = np.nan
+        return result
+
+def broadcast(value, n):
+    if is_vector(value):
+        return value if len(value) == n else np.broadcast_to(value, (n,))
+    values = np.empty(n, dtype=object)
+    values[:] = [value] * n
+    return values
+
+def np_add(left, right):
+    if is_vector(left) or is_vector(right):
+        n = len(left) if is_vector(left) else len(right)
+        return np.array([a + b for a, b in zip(broadcast(left, n), broadcast(right, n))], dtype=object)
+    return left + right
+
+def compare(op, left, right):
+    """Compares numbers as numbers and anything else as case-insensitive text"""
+    left_numbers, right_numbers = to_numbers(left), to_numbers(right)
+    numeric = ~(np.isnan(left_numbers) | np.isnan(right_numbers))
+    left_texts = np.char.lower(np.asarray(to_texts(left), dtype=str))
+    right_texts = np.char.lower(np.asarray(to_texts(right), dtype=str))
+    operators = {"=": np.equal, "<>": np.not_equal, "<": np.less, ">": np.greater, "<=": np.less_equal, ">=": np.greater_equal}
+    result = np.where(numeric, operators[op](left_numbers, right_numbers), operators[op](left_texts, right_texts))
+    return result if is_vector(left) or is_vector(right) else bool(result)
+
+def to_sheet_values(values, n):
+    """Returns the results as sheet values, None where the formula failed. Integral numbers become ints
+    like unformatted reads return them, and a result that is an empty cell becomes empty text.
+    """
+    results = []
+    for value in broadcast(values, n):
+        if isinstance(value, np.generic):
+            value = value.item()
+        if value is None:
+            value = ""
+        elif isinstance(value, float):
+            if value != value or value in (np.inf, -np.inf):
+                value = None
+            elif value.is_integer():
+                value = int(value)
+        results.append(value)
+    return results
+
+def evaluate_formulas(table, cells):
+    """Evaluates formula cells written to the table, given as (row, col, formula) grid cells.
+    Returns the table with the computed values written over the formulas, and how many were computed.
+    """
+    groups = {}
+    fill_keys = {} # Formulas are only parsed once per fill key
+    for row, col, formula in cells:
+        fill_key = (col, get_fill_key(formula, row))
+        if fill_key not in fill_keys:
+            try:
+                node = parse_formula(formula)
+            except (FormulaError, RecursionError) as e:
+                print(f"Not evaluating {formula}: {e}")
+                fill_keys[fill_key] = None
+                continue
+            fill_keys[fill_key] = groups.setdefault((col, get_signature(node, row)), {"node": node, "first_row": row, "rows": []})
+        if fill_keys[fill_key] is not None:
+            fill_keys[fill_key]["rows"].append(row)
+
+    pending = list(groups.items())
+    evaluated = 0
+    for _ in range(MAX_PASSES):
+        evaluated_before = evaluated
+        failed = []
+        for (col, signature), group in pending:
+            rows = np.asarray(group["rows"], dtype=np.intp)
+            try:
+                values = evaluate_group(table, group["node"], rows, group["first_row"])
+            except (FormulaError, ValueError, TypeError) as e:
+                print(f"Not evaluating {signature}: {e}")
+                continue
+            done = [i for i, value in enumerate(values) if value is not None]
+            if done:
+                table = table.write_cells(rows[done], [col] * len(done), [values[i] for i in done])
+                evaluated += len(done)
+            if len(done) < len(rows):
+                remaining = [row for i, row in enumerate(group["rows"]) if values[i] is None]
+                failed.append(((col, signature), {**group, "rows": remaining}))
+        if not failed or evaluated == evaluated_before:
+            break
+        pending = failed
+    return table, evaluated
+
+def evaluate_group(table, node, rows, first_row):
+    """Returns the sheet value of every cell of a group, evaluated together unless it needs row by row evaluation"""
+    try:
+        return to_sheet_values(GroupEvaluator(table, rows, first_row).evaluate(node), len(rows))
+    except NeedsRowByRow:
+        values = []
+        for row in rows:
+            values += to_sheet_values(GroupEvaluator(table, np.array([row]), first_row).evaluate(node), 1)
+        return values
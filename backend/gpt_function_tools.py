@@ -6,6 +6,7 @@ Function calling tools
 - gpt_create_chart
 - gpt_question
 - gpt_other_instruction
+- gpt_single_call (system message offering every execution tool at once)
 """
 
 gpt_get_instructions_tool = {
@@ -103,7 +104,7 @@ gpt_write_table_tool = {
 
 gpt_write_table_sys_msg = {"role": "system",
                               "content": """You are an expert assistant using Google Sheets.
-    Given a table in a pandas dataframe representation and new-line separated instructions to write values to cells,
+    Given a table (tab separated, with the row and column labels its first line describes) and new-line separated instructions to write values to cells,
     return the function call to complete the writes as if the table is a Google Sheets. 
     Each index of the returned lists should correspond to each instruction, so all the arrays should have the same length.
     If a Google Sheets formula can be used, use the formula instead of hard-coding values or I will touch you."""
@@ -143,7 +144,7 @@ gpt_read_table_tool = {
 
 gpt_read_table_sys_msg = {"role": "system",
                       "content": """You are an expert assistant using Google Sheets.
-    Given a table in a pandas dataframe representation and new-line separated instructions to get values inside cells,
+    Given a table (tab separated, with the row and column labels its first line describes) and new-line separated instructions to get values inside cells,
     return the function call to complete the get calls as if the table is a Google Sheets. 
     Each index of the returned lists correspond, so both the arrays will have the same length."""
 }
@@ -176,7 +177,7 @@ gpt_create_chart_tool = {
 
 gpt_create_chart_sys_msg = {"role": "system",
                                "content": """You are an expert assistant using Google Sheets.
-    Given a table in a pandas dataframe representation and a create basic chart operation to be executed via the spreadsheets batchUpdate() API endpoint,
+    Given a table (tab separated, with the row and column labels its first line describes) and a create basic chart operation to be executed via the spreadsheets batchUpdate() API endpoint,
     return the list of exactly 7 specified arguments from the Google Sheets Add Chart Request API. 
     Use the Google Sheets documentation to return the exact value and type needed for the API request.
     By default, create charts in an overlayed position of the same sheet that does not cover the cells with values, unless user specifies otherwise.
@@ -271,7 +272,7 @@ gpt_question_tool = {
 
 gpt_question_sys_msg = {"role": "system",
                     "content": """You are an expert assistant using Google Sheets.
-    Given a table in a pandas dataframe representation and a question regarding Google Sheets
+    Given a table (tab separated, with the row and column labels its first line describes) and a question regarding Google Sheets
     return the function call to answer the question as if the table is a Google Sheets."""
 }
 
@@ -295,7 +296,7 @@ gpt_other_instruction_tool = {
 
 gpt_other_instruction_sys_msg = {"role": "system",
                                     "content": """You are an expert assistant using Google Sheets.
-    Given a table in a pandas dataframe representation and an operation to be executed via the spreadsheets batchUpdate() API endpoint,
+    Given a table (tab separated, with the row and column labels its first line describes) and an operation to be executed via the spreadsheets batchUpdate() API endpoint,
     return the request body to complete the requested operation as if the table is a Google Sheets sheet. 
     """
 }
@@ -307,4 +308,14 @@ gpt_tools = {
     "gpt_create_chart": (gpt_create_chart_tool, gpt_create_chart_sys_msg),
     "gpt_question": (gpt_question_tool, gpt_question_sys_msg),
     "gpt_other_instruction": (gpt_other_instruction_tool, gpt_other_instruction_sys_msg),
-}
\ No newline at end of file
+}
+
+gpt_single_call_sys_msg = {"role": "system",
+                           "content": """You are an expert assistant using Google Sheets.
+    Given a table (tab separated, with the row and column labels its first line describes) and a task, complete the task directly with the write_table, create_chart, question, or other_instruction functions.
+    You may call several of these functions if the task needs them, each call is executed in the order given.
+    If the task is complex and needs several dependent steps, or you are unsure how to complete it directly, call only get_instructions to break it down into lower level instructions instead.
+    If the task is not relevant to Google Sheets at all, never complete it with question, call only get_instructions with a single INAPPROPRIATE instruction so the task is refused.
+    The instructions for each function follow.
+    """ + "\n".join(sys_msg["content"] for sys_msg in [gpt_write_table_sys_msg, gpt_create_chart_sys_msg, gpt_question_sys_msg, gpt_other_instruction_sys_msg, gpt_get_instructions_sys_msg])
+}
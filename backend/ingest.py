@@ -0,0 +1,244 @@
+"""
+Streaming ingestion of uploaded .csv and .xlsx files into a Google Sheet, one tab per worksheet.
+Rows are read a chunk at a time (pandas chunked CSV parsing, openpyxl read-only iteration) and
+written in fixed-size batches by BatchedValuesWriter, so memory stays roughly constant in the
+file size and no single request gets near the Sheets API request size limit.
+"""
+import shutil
+import datetime
+import tempfile
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from TableAgent import get_a1_range
+
+CSV_CHUNK_ROWS = 5000
+BATCH_CELLS = 50_000 # Cells per values().batchUpdate, about 0.5-1MB of JSON for typical data
+MAX_CONCURRENT_BATCHES = 4
+MAX_CONCURRENT_WORKSHEETS = 4
+
+def to_upload_value(value):
+    """Converts a parsed cell to a JSON value the Sheets API accepts"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value != value:
+        return ""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat(sep=" ") if isinstance(value, datetime.datetime) else value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return str(value)
+    return value
+
+def iter_csv_rows(file, chunk_rows=CSV_CHUNK_ROWS):
+    """Yields lists of rows of a CSV file, the header row first, parsing chunk_rows rows at a time"""
+    header_sent = False
+    for chunk in pd.read_csv(file, chunksize=chunk_rows):
+        if not header_sent:
+            yield [[str(column) for column in chunk.columns]]
+            header_sent = True
+        chunk = chunk.astype(object)
+        yield chunk.where(chunk.notna(), "").values.tolist()
+
+def iter_xlsx_rows(file, worksheet_name=None, chunk_rows=CSV_CHUNK_ROWS):
+    """Yields lists of rows of one worksheet (the first by default) using openpyxl's read-only mode,
+    which streams rows from the file instead of loading the workbook
+    """
+    from openpyxl import load_workbook
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[worksheet_name] if worksheet_name else workbook.worksheets[0]
+        rows = []
+        for row in worksheet.iter_rows(values_only=True):
+            rows.append([to_upload_value(value) for value in row])
+            if len(rows) == chunk_rows:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+    finally:
+        workbook.close()
+
+class BatchedValuesWriter:
+    """Writes rows to the tabs of one spreadsheet through values().batchUpdate, packing about batch_cells
+    cells from any tabs into each request, with at most max_concurrent requests in flight.
+    Requests are sent on worker threads while callers read the next rows, and callers block once
+    max_concurrent requests are pending so memory stays bounded. Tabs' grids are grown with
+    appendDimension before a request would write past them. Safe to feed from several threads.
+    tab_properties maps each tab title to its sheet properties as returned by spreadsheets().create.
+    """
+    def __init__(self, sheets_service, spreadsheet_id, tab_properties, batch_cells=BATCH_CELLS,
+                 max_concurrent=MAX_CONCURRENT_BATCHES, value_input_option="RAW"):
+        self.sheets_service = sheets_service
+        self.spreadsheet_id = spreadsheet_id
+        self.tabs = {}
+        for title, properties in tab_properties.items():
+            grid_properties = properties.get("gridProperties", {})
+            self.tabs[title] = {
+                "sheet_id": properties.get("sheetId", 0),
+                "row_count": grid_properties.get("rowCount", 1000),
+                "column_count": grid_properties.get("columnCount", 26),
+                "next_row": 0, # First row not yet taken by a batch
+                "pending_rows": [],
+            }
+        self.batch_cells = batch_cells
+        self.value_input_option = value_input_option
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent)
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.futures = []
+        self.pending_cells = 0
+        self.rows_written = 0
+        self.cells_written = 0
+        self.requests = 0
+
+    def write_rows(self, tab_title, rows):
+        with self.lock:
+            tab = self.tabs[tab_title]
+            for row in rows:
+                tab["pending_rows"].append(row)
+                self.pending_cells += max(1, len(row))
+                if self.pending_cells >= self.batch_cells:
+                    self.flush()
+
+    def flush(self):
+        """Sends the pending rows of every tab as one request, caller holds the lock"""
+        data = []
+        grow_requests = []
+        for title, tab in self.tabs.items():
+            rows = tab["pending_rows"]
+            if not rows:
+                continue
+            data.append({"range": get_a1_range(title, tab["next_row"], 0, tab["next_row"], 0), "values": rows})
+            tab["pending_rows"] = []
+            tab["next_row"] += len(rows)
+            grow_requests += self.get_grow_requests(tab, tab["next_row"], max(len(row) for row in rows))
+        self.pending_cells = 0
+        if not data:
+            return
+        if grow_requests:
+            self.sheets_service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id, body={"requests": grow_requests}).execute()
+            self.requests += 1
+        self.collect_finished()
+        self.slots.acquire()
+        try:
+            # Run in a copy of the caller's context so the request shows up in its trace
+            self.futures.append(self.executor.submit(contextvars.copy_context().run, self.write_batch, data))
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def get_grow_requests(self, tab, n_rows, n_cols):
+        """Returns the appendDimension requests that make the tab's grid hold n_rows x n_cols, at least
+        doubling the rows each time so a long upload only grows the grid a logarithmic number of times
+        """
+        requests = []
+        if n_rows > tab["row_count"]:
+            length = max(n_rows - tab["row_count"], tab["row_count"])
+            requests.append({"appendDimension": {"sheetId": tab["sheet_id"], "dimension": "ROWS", "length": length}})
+            tab["row_count"] += length
+        if n_cols > tab["column_count"]:
+            requests.append({"appendDimension": {"sheetId": tab["sheet_id"], "dimension": "COLUMNS", "length": n_cols - tab["column_count"]}})
+            tab["column_count"] = n_cols
+        return requests
+
+    def write_batch(self, data):
+        try:
+            self.sheets_service.spreadsheets().values().batchUpdate(
+                spreadsheetId=self.spreadsheet_id,
+                body={"valueInputOption": self.value_input_option, "data": data},
+            ).execute()
+            return sum(len(entry["values"]) for entry in data), sum(len(row) for entry in data for row in entry["values"])
+        finally:
+            self.slots.release()
+
+    def collect_finished(self, wait=False):
+        """Counts the requests that are done (all of them if wait), raising the error of a failed one"""
+        pending = []
+        for future in self.futures:
+            if not wait and not future.done():
+                pending.append(future)
+                continue
+            rows, cells = future.result()
+            self.rows_written += rows
+            self.cells_written += cells
+            self.requests += 1
+        self.futures = pending
+
+    def close(self):
+        """Sends the remaining rows and waits for every request, raising the first error.
+        Returns the number of rows and cells written.
+        """
+        try:
+            with self.lock:
+                self.flush()
+            self.collect_finished(wait=True)
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+        return self.rows_written, self.cells_written
+
+    def abort(self):
+        """Drops the pending rows and requests that have not started, for when reading the file fails"""
+        with self.lock:
+            for tab in self.tabs.values():
+                tab["pending_rows"] = []
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+def save_upload(upload):
+    """Copies the uploaded file to a temporary file and returns its path, so each worksheet can be
+    read through its own handle. The caller removes the file.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as f:
+        upload.seek(0)
+        shutil.copyfileobj(upload, f)
+        return f.name
+
+def get_worksheet_names(path):
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return workbook.sheetnames
+    finally:
+        workbook.close()
+
+def get_tab_titles(worksheet_names):
+    """Returns a tab title per worksheet, its own name so formulas and prompts naming it keep working.
+    Sheets compares tab titles ignoring case, so a name that would repeat one gets a suffix.
+    """
+    titles = []
+    for name in worksheet_names:
+        title = name
+        suffix = 2
+        while title.lower() in (existing.lower() for existing in titles):
+            title = f"{name} ({suffix})"
+            suffix += 1
+        titles.append(title)
+    return titles
+
+def ingest_upload(sheets_service, source, file_type, spreadsheet_id, worksheets, tab_properties):
+    """Streams the rows of an uploaded file into the spreadsheet and returns the rows and cells written.
+    worksheets lists (worksheet name, tab title) pairs; a CSV has one pair whose name is None.
+    Worksheets are parsed concurrently, each through its own read-only openpyxl workbook on source.
+    """
+    writer = BatchedValuesWriter(sheets_service, spreadsheet_id, tab_properties)
+
+    def ingest_worksheet(worksheet_name, tab_title):
+        row_batches = iter_xlsx_rows(source, worksheet_name) if file_type == "xlsx" else iter_csv_rows(source)
+        for rows in row_batches:
+            writer.write_rows(tab_title, rows)
+
+    try:
+        if len(worksheets) == 1:
+            ingest_worksheet(*worksheets[0])
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(worksheets), MAX_CONCURRENT_WORKSHEETS)) as executor:
+                futures = [executor.submit(contextvars.copy_context().run, ingest_worksheet, worksheet_name, tab_title)
+                           for worksheet_name, tab_title in worksheets]
+                for future in futures:
+                    future.result()
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
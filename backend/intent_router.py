@@ -0,0 +1,177 @@
+"""
+Local intent router that plans single-intent tasks without the get_instructions model call.
+A task like "Make a bar chart of A and B" becomes the one instruction ["CHART", task] right away.
+Keyword rules and a multinomial naive Bayes model over the task's words must agree on the
+instruction type, with the model at least ROUTE_THRESHOLD sure. Anything else, like tasks with
+several steps, vague tasks or ones unrelated to sheets that the planner may refuse, goes to the planner.
+Questions are only routed when they name a cell, row or column of the sheet, by reference or as the
+column of one of its headers ("the Price column"), since a question that doesn't ("Who won the world
+cup?", "What is the price of bitcoin?") may be one the planner refuses.
+The model's word counts ship in intent_model.json, trained on the labeled prompts in intent_prompts.jsonl.
+Retrain with: python intent_router.py
+"""
+import os
+import re
+import json
+import math
+
+ROUTE_THRESHOLD = 0.9
+PLANNER_INTENT = "PLAN" # Label of the labeled prompts only the planner should handle
+MODEL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_model.json")
+PROMPTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_prompts.jsonl")
+
+token_pattern = re.compile(r"\$?[a-z]{1,3}\$?\d+(?::\$?[a-z]{1,3}\$?\d+)?(?![a-z0-9])|[a-z]+(?:'[a-z]+)?|\d+(?:\.\d+)?|[?%]")
+
+# Tasks with more than one step always go to the planner
+sequence_pattern = re.compile(
+    r"\b(then|after that|afterwards|also|as well|followed by)\b|;|[.!?]\s+\w"
+    r"|\b(and|,)\s+(make|create|add|write|read|sort|plot|chart|highlight|bold|freeze|tell|show|compute|calculate"
+    r"|fill|put|delete|format|describe|summari[sz]e|explain|clear|copy|duplicate)\b"
+    r"|\band (a |an )?(chart|graph|plot|summary|pivot table)\b",
+    re.I,
+)
+
+# Instruction types a task's wording allows, see the instruction types of gpt_function_tools
+rule_patterns = {
+    "OTHER": re.compile(
+        r"\b(pie|donut|doughnut|histogram|treemap|gauge|pivot|sort|bold|italic|freeze|merge|highlight|conditional"
+        r"|formatting|format|colou?r|borders?|filter|hide|resize|wrap|protect|validation|rename|delete|insert a blank"
+        r"|remove duplicates?|duplicate rows)\b", re.I),
+    "CHART": re.compile(r"\b(chart|graph|plot|visuali[sz]e)\b", re.I),
+    "READ": re.compile(
+        r"^\s*(get|read|show|fetch|look up|return|display)\b|\bwhat('s| is)?( the value)? in\b|\bwhat value\b"
+        r"|\bvalue (of|in|at)\b|\bwhat does cell\b", re.I),
+    "QUESTION": re.compile(
+        r"\?\s*$|^\s*(what|which|who|how|why|is|are|can|does|do|summari[sz]e|describe|explain|give me a summary)\b", re.I),
+    "WRITE": re.compile(
+        r"\b(fill|put|write|set|add|calculate|compute|enter|insert|replace|change|convert|capitali[sz]e|multiply"
+        r"|round|populate|label|translate|make column)\b", re.I),
+}
+
+# Cells, rows and columns named by reference, like B7, A2:C5, "row 3" or "column B"
+cell_reference_pattern = re.compile(
+    r"(?<![A-Za-z0-9$])\$?[A-Z]{1,3}\$?\d+(?::\$?[A-Z]{1,3}\$?\d+)?(?![A-Za-z0-9])|\b(?:columns?|col)\s+[A-Z]{1,3}\b"
+    r"|\brows?\s+\d+\b")
+
+def tokenize(text):
+    """Returns the words of a task with cell references and numbers generalized, plus their bigrams"""
+    words = []
+    for token in token_pattern.findall(text.lower()):
+        if token[0].isdigit():
+            words.append("<num>")
+        elif any(char.isdigit() for char in token):
+            words.append("<range>" if ":" in token else "<cell>")
+        else:
+            words.append(token)
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+def get_rule_intents(task_prompt):
+    """Returns the instruction types the keyword rules allow for a task, none if it has several steps"""
+    if sequence_pattern.search(task_prompt.strip()):
+        return set()
+    intents = {intent for intent, pattern in rule_patterns.items() if pattern.search(task_prompt)}
+    # Formatting and the charts CHART can't make are OTHER even when they sound like writes or charts
+    return {"OTHER"} if "OTHER" in intents else intents
+
+def names_sheet_cells(task_prompt, headers=()):
+    """Returns whether a task names a cell, row or column of the sheet, by reference or as the column of
+    one of the sheet's normalized headers, see sheet_table.normalize_header. A header on its own doesn't
+    count, common headers like "price" or "date" are words of off-topic questions too.
+    """
+    if cell_reference_pattern.search(task_prompt):
+        return True
+    text = task_prompt.lower()
+    for header in headers:
+        header_pattern = r"(?<!\w)" + re.escape(header) + r"(?!\w)"
+        if re.search(rf"{header_pattern}\s+columns?\b|\bcolumns?\s+{header_pattern}", text):
+            return True
+    return False
+
+class IntentModel:
+    """Multinomial naive Bayes over tokenize's tokens with add-one smoothing"""
+    def __init__(self, label_counts, token_counts):
+        self.label_counts = label_counts # Labeled prompts per intent
+        self.token_counts = token_counts # Occurrences of each token in the prompts of each intent
+        vocabulary = {token for counts in token_counts.values() for token in counts}
+        self.vocabulary = vocabulary
+        n_prompts = sum(label_counts.values())
+        self.log_priors = {label: math.log(count / n_prompts) for label, count in label_counts.items()}
+        self.log_denominators = {
+            label: math.log(sum(token_counts[label].values()) + len(vocabulary)) for label in label_counts
+        }
+
+    @classmethod
+    def train(cls, examples):
+        """Builds the model from (prompt, intent) pairs"""
+        label_counts = {}
+        token_counts = {}
+        for prompt, intent in examples:
+            label_counts[intent] = label_counts.get(intent, 0) + 1
+            counts = token_counts.setdefault(intent, {})
+            for token in tokenize(prompt):
+                counts[token] = counts.get(token, 0) + 1
+        return cls(label_counts, token_counts)
+
+    @classmethod
+    def load(cls, path=MODEL_FILE):
+        with open(path) as f:
+            model = json.load(f)
+        return cls(model["label_counts"], model["token_counts"])
+
+    def save(self, path=MODEL_FILE):
+        with open(path, "w") as f:
+            json.dump({"label_counts": self.label_counts, "token_counts": self.token_counts}, f, indent=1, sort_keys=True)
+
+    def predict(self, task_prompt):
+        """Returns the most likely intent of a task and its posterior probability"""
+        tokens = [token for token in tokenize(task_prompt) if token in self.vocabulary]
+        scores = {}
+        for label, log_prior in self.log_priors.items():
+            counts = self.token_counts[label]
+            scores[label] = log_prior + sum(math.log(counts.get(token, 0) + 1) for token in tokens) - len(tokens) * self.log_denominators[label]
+        best = max(scores, key=scores.get)
+        total = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / total
+
+def load_intent_model(path=MODEL_FILE):
+    try:
+        return IntentModel.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        print("Could not load the intent model, every task goes to the planner:", e)
+        return None
+
+def load_labeled_prompts(path=PROMPTS_FILE):
+    """Returns the (prompt, intent) pairs of the labeled prompt set"""
+    with open(path) as f:
+        examples = [json.loads(line) for line in f if line.strip()]
+    return [(example["prompt"], example["intent"]) for example in examples]
+
+intent_model = load_intent_model()
+
+def classify_task(task_prompt, model=None, threshold=ROUTE_THRESHOLD, headers=()):
+    """Returns the instruction type of a single-intent task and the model's confidence in it.
+    The type is PLANNER_INTENT when the rules and the model disagree, the model isn't sure enough or
+    the task is a question that names no cells of the sheet, headers being the sheet's normalized headers.
+    """
+    model = model or intent_model
+    if model is None:
+        return PLANNER_INTENT, 0.0
+    intent, confidence = model.predict(task_prompt)
+    if intent == PLANNER_INTENT or intent not in get_rule_intents(task_prompt) or confidence < threshold:
+        return PLANNER_INTENT, confidence
+    if intent == "QUESTION" and not names_sheet_cells(task_prompt, headers):
+        return PLANNER_INTENT, confidence
+    return intent, confidence
+
+def route_task(task_prompt, model=None, threshold=ROUTE_THRESHOLD, headers=()):
+    """Returns the instructions of a task the router is sure has a single intent, or None for the planner"""
+    intent, confidence = classify_task(task_prompt, model, threshold, headers)
+    if intent == PLANNER_INTENT:
+        return None
+    print(f"Routed task locally as {intent} ({confidence:.3f})")
+    return [[intent, task_prompt]]
+
+if __name__ == "__main__":
+    examples = load_labeled_prompts()
+    IntentModel.train(examples).save()
+    print(f"Trained on {len(examples)} labeled prompts, saved to {MODEL_FILE}")
@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+class ToolCallCache:
+    """Content-addressed cache of parsed tool-call results.
+    Entries live in memory as an LRU with a TTL, and optionally in cache_dir as one JSON file
+    per key so they survive container restarts (e.g. when cache_dir is on a Modal Volume).
+    """
+    def __init__(self, max_entries=1024, ttl_seconds=24 * 60 * 60, cache_dir=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict() # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def get_key(model_ID, tool, sys_msg, user_msg):
+        """Hashes everything that determines the model's answer"""
+        content = json.dumps([model_ID, tool, sys_msg, user_msg], sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Returns the cached value for key, or None if missing or expired"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.entries.pop(key, None)
+        entry = self.read_disk_entry(key)
+        with self.lock:
+            if entry is not None and entry[0] > now:
+                self.store(key, entry)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        entry = (time.time() + self.ttl_seconds, value)
+        with self.lock:
+            self.store(key, entry)
+        self.write_disk_entry(key, entry)
+
+    def delete(self, key):
+        """Removes key from memory and disk, for results that turned out to be bad"""
+        with self.lock:
+            self.entries.pop(key, None)
+        if self.cache_dir:
+            self.remove_disk_entry(key)
+
+    def store(self, key, entry):
+        """Stores entry in memory, evicting least recently used entries, caller holds the lock"""
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get_disk_path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def read_disk_entry(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.get_disk_path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["expires_at"] <= time.time():
+            self.remove_disk_entry(key)
+            return None
+        return entry["expires_at"], entry["value"]
+
+    def write_disk_entry(self, key, entry):
+        if not self.cache_dir:
+            return
+        try:
+            tmp_path = self.get_disk_path(key) + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"expires_at": entry[0], "value": entry[1]}, f)
+            os.replace(tmp_path, self.get_disk_path(key))
+            self.prune_disk()
+        except (OSError, TypeError, ValueError) as e:
+            print("Could not write tool call cache entry:", e)
+
+    def remove_disk_entry(self, key):
+        try:
+            os.remove(self.get_disk_path(key))
+        except OSError:
+            pass
+
+    def prune_disk(self):
+        """Keeps at most max_entries files on disk, removing the oldest first"""
+        paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".json")]
+        if len(paths) <= self.max_entries:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+# Shared by every request served by this container
+tool_call_cache = ToolCallCache(cache_dir=os.environ.get("TOOL_CALL_CACHE_DIR"))
@@ -0,0 +1,76 @@
+import json
+
+class PlanStreamParser:
+    """Incrementally parses the streamed JSON arguments of a get_instructions tool call.
+    feed() takes the next fragment of the arguments and returns the [type, instruction] pairs
+    completed by it, so instructions can be executed before the rest of the plan arrives.
+    Only the string items of the top level "types" and "instructions" arrays are collected.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.string_start = 0
+        self.expecting_key = False
+        self.current_key = None
+        self.current_array = None
+        self.arrays = {"types": [], "instructions": []}
+        self.emitted = 0
+
+    def feed(self, fragment):
+        self.buffer += fragment
+        for i in range(self.position, len(self.buffer)):
+            char = self.buffer[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    self.read_string(json.loads(self.buffer[self.string_start:i+1]))
+            elif char == '"':
+                self.in_string = True
+                self.string_start = i
+            elif char in "{[":
+                self.depth += 1
+                if char == "{" and self.depth == 1:
+                    self.expecting_key = True
+                elif char == "[" and self.depth == 2:
+                    self.current_array = self.current_key
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 1:
+                    self.current_array = None
+            elif char == "," and self.depth == 1:
+                self.expecting_key = True
+        self.position = len(self.buffer)
+        # Drop what has been parsed, unless we are inside a string that still needs its start
+        if not self.in_string:
+            self.buffer = ""
+            self.position = 0
+        elif self.string_start > 0:
+            self.buffer = self.buffer[self.string_start:]
+            self.position -= self.string_start
+            self.string_start = 0
+        return self.pop_completed()
+
+    def read_string(self, value):
+        if self.depth == 1 and self.expecting_key:
+            self.current_key = value
+            self.expecting_key = False
+        elif self.depth == 2 and self.current_array in self.arrays:
+            self.arrays[self.current_array].append(value)
+
+    def pop_completed(self):
+        """Returns the pairs that have both their type and instruction and were not returned yet"""
+        completed = min(len(self.arrays["types"]), len(self.arrays["instructions"]))
+        pairs = [[self.arrays["types"][i], self.arrays["instructions"][i]] for i in range(self.emitted, completed)]
+        self.emitted = completed
+        return pairs
+
+    def is_valid(self):
+        """Whether the finished plan has as many types as instructions"""
+        return len(self.arrays["types"]) == len(self.arrays["instructions"]) and len(self.arrays["types"]) > 0
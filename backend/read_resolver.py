@@ -0,0 +1,112 @@
+"""
+Resolves READ instructions that address their cells directly, like "Get the value in B7",
+"Read A2:C5" or "What's in the Revenue column for row 12", to read_table args without a model call.
+Cells are named by A1 references and ranges, "row N" / "rows N to M", "column B" and the table's
+headers, looked up in the header index SheetTable builds on load. An instruction is resolved only
+when every other word is a filler word, so anything with conditions, aggregates or vague wording
+("the first ten names", "the highest price") is left to the model. Instructions with an aggregate word
+are left to the model even when it is a header, "Get the Total" may mean the Total column or a sum.
+"""
+import re
+
+from formula_engine import get_column_index
+
+MAX_RESOLVED_CELLS = 1000 # Larger reads are left to the model
+
+a1_pattern = re.compile(r"(?<![A-Za-z0-9$])\$?([A-Z]{1,3})\$?(\d+)(?::\$?([A-Z]{1,3})\$?(\d+))?(?![A-Za-z0-9(])")
+column_range_pattern = re.compile(r"(?<![A-Za-z0-9$])\$?([A-Z]{1,3}):\$?([A-Z]{1,3})(?![A-Za-z0-9(])")
+rows_pattern = re.compile(r"\brows?\s+(\d+)(?:\s*(?:-|to|through)\s*(\d+))?\b", re.I)
+column_letters_pattern = re.compile(r"\b(?:columns?|col)\s+([A-Z]{1,3})\b")
+column_word_pattern = re.compile(r"\b(?:columns?|col)\b", re.I)
+word_pattern = re.compile(r"[a-z0-9]+")
+
+filler_words = {
+    "get", "read", "return", "show", "display", "fetch", "find", "look", "lookup", "up", "tell", "give",
+    "list", "print", "what", "whats", "s", "is", "are", "the", "a", "an", "me", "please", "value", "values",
+    "cell", "cells", "content", "contents", "entry", "entries", "data", "in", "of", "at", "for", "from",
+    "on", "to", "and", "stored", "there", "current", "currently", "all", "every", "column", "columns",
+    "col", "row", "rows", "range", "sheet", "table", "header", "headers",
+}
+
+aggregate_words = {
+    "total", "totals", "count", "sum", "average", "avg", "mean", "max", "maximum", "min", "minimum",
+}
+
+def resolve_read(instruction, sheet_content, first_row_label=0):
+    """Returns read_table args, a [row, col] grid cell per value to read, for an instruction that names
+    its cells, or None when the model is needed. Row numbers after "row" are in the prompt's row
+    labels starting at first_row_label, A1 references are in sheet rows like in the sheet itself.
+    """
+    if not aggregate_words.isdisjoint(word_pattern.findall(instruction.lower())):
+        return None
+    n_rows, n_cols = sheet_content.shape
+    # Ranges are kept as bounds and only turned into cells once their size is known to be small enough
+    rectangles = [] # (top, left, bottom, right) grid cell ranges
+    row_ranges = [] # (first, last) grid rows
+    cols = []
+
+    def add_rectangle(top, left, bottom, right):
+        rectangles.append((min(top, bottom), min(left, right), max(top, bottom), max(left, right)))
+        return " "
+
+    def take_a1(match):
+        left_letters, top, right_letters, bottom = match.groups()
+        if right_letters is None:
+            right_letters, bottom = left_letters, top
+        return add_rectangle(int(top) - 1, get_column_index(left_letters), int(bottom) - 1, get_column_index(right_letters))
+
+    def take_column_range(match):
+        return add_rectangle(0, get_column_index(match.group(1)), n_rows - 1, get_column_index(match.group(2)))
+
+    def take_rows(match):
+        first = int(match.group(1)) - first_row_label
+        last = int(match.group(2)) - first_row_label if match.group(2) else first
+        row_ranges.append((min(first, last), max(first, last)))
+        return " "
+
+    def take_column_letters(match):
+        cols.append(get_column_index(match.group(1)))
+        return " "
+
+    text = instruction.replace("’", "'")
+    # Headers first, so a header that looks like a cell reference ("Q3") is read as the header
+    for name, col in sorted(sheet_content.header_index.items(), key=lambda item: -len(item[0])):
+        pattern = r"(?<!\w)" + re.escape(name) + r"(?!\w)"
+        if name in filler_words:
+            # A header like "Value" only counts when it is called a column
+            pattern = rf"{pattern}\s+columns?\b|\bcolumns?\s+{pattern}"
+        text, count = re.subn(pattern, " ", text, flags=re.I)
+        if count:
+            cols.append(col)
+    text = rows_pattern.sub(take_rows, text)
+    text = column_letters_pattern.sub(take_column_letters, text)
+    text = a1_pattern.sub(take_a1, text)
+    text = column_range_pattern.sub(take_column_range, text)
+
+    words = word_pattern.findall(text.lower())
+    if any(word not in filler_words for word in words) or (rectangles and (row_ranges or cols)):
+        return None
+    if cols and not row_ranges and not column_word_pattern.search(instruction):
+        # A bare header is only a column read when it says so, "the Revenue" could mean anything
+        return None
+    if any(top < 0 for top, _, _, _ in rectangles) or any(first < 0 for first, _ in row_ranges):
+        return None
+    n_row_range_rows = sum(last - first + 1 for first, last in row_ranges)
+    if rectangles:
+        n_cells = sum((bottom - top + 1) * (right - left + 1) for top, left, bottom, right in rectangles)
+    elif row_ranges:
+        n_cells = n_row_range_rows * (len(cols) or n_cols)
+    else:
+        n_cells = len(cols) * (n_rows - 1)
+    if not n_cells or n_cells > MAX_RESOLVED_CELLS:
+        return None
+
+    cells = []
+    for top, left, bottom, right in rectangles:
+        cells.extend((row, col) for row in range(top, bottom + 1) for col in range(left, right + 1))
+    rows = [row for first, last in row_ranges for row in range(first, last + 1)]
+    if rows:
+        cells.extend((row, col) for row in rows for col in (cols or range(n_cols)))
+    elif cols:
+        cells.extend((row, col) for col in cols for row in range(1, n_rows))
+    return [[row, col] for row, col in dict.fromkeys(cells)]
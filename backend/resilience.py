@@ -0,0 +1,160 @@
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from tracing import span
+
+# HTTP statuses and AWS error codes worth retrying
+retryable_status_codes = {408, 409, 429, 500, 502, 503, 504, 529}
+retryable_aws_error_codes = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+}
+retryable_exception_names = {
+    "APIConnectionError",
+    "APITimeoutError",
+    "EndpointConnectionError",
+    "ReadTimeoutError",
+    "ConnectTimeoutError",
+    "ConnectionClosedError",
+}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open"""
+
+class CircuitBreaker:
+    """Stops calling a provider after failure_threshold transient failures in a row.
+    After reset_timeout seconds one trial call is let through, closing the breaker if it succeeds.
+    """
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def release_trial(self):
+        """Lets another trial call through after one that ended without an answer, like a cancelled one"""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                if self.opened_at is None:
+                    print(f"Opening {self.name} circuit breaker after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+# Shared by every request served by this container
+circuit_breakers = {
+    "gpt": CircuitBreaker("gpt"),
+    "claude": CircuitBreaker("claude"),
+}
+
+def get_status_code(e):
+    status_code = getattr(e, "status_code", None)
+    if status_code is None:
+        response = getattr(e, "response", None)
+        if isinstance(response, dict):
+            status_code = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return status_code
+
+def is_retryable(e):
+    """Returns whether e is a throttling, server or connection error that may succeed if retried"""
+    if isinstance(e, CircuitOpenError):
+        return True
+    if type(e).__name__ in retryable_exception_names:
+        return True
+    response = getattr(e, "response", None)
+    if isinstance(response, dict) and response.get("Error", {}).get("Code") in retryable_aws_error_codes:
+        return True
+    return get_status_code(e) in retryable_status_codes
+
+def get_retry_after(e):
+    """Returns the seconds the provider asked us to wait in its Retry-After header, if any"""
+    response = getattr(e, "response", None)
+    if isinstance(response, dict):
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+    else:
+        headers = getattr(response, "headers", None) or {}
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def get_backoff_delay(attempt_num, base_delay=0.5, max_delay=20):
+    """Exponential backoff with full jitter for the given 1-indexed attempt"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt_num - 1)))
+
+async def call_with_backoff(call, provider, max_attempts=4, max_retry_after=30):
+    """Awaits call(), retrying transient errors with backoff and recording them on the provider's breaker.
+    Honors Retry-After when the provider sends it. Raises CircuitOpenError without calling
+    if the provider's breaker is open, and the last error once attempts run out.
+    """
+    circuit_breaker = circuit_breakers[provider]
+    for attempt_num in range(1, max_attempts+1):
+        if not circuit_breaker.allow():
+            raise CircuitOpenError(f"{provider} circuit breaker is open")
+        try:
+            with span("llm_attempt", provider=provider, attempt=attempt_num):
+                result = await call()
+        except Exception as e:
+            if not is_retryable(e):
+                # The provider answered, so it is up even though it rejected the call
+                circuit_breaker.record_success()
+                raise
+            circuit_breaker.record_failure()
+            if attempt_num == max_attempts:
+                raise
+            delay = get_retry_after(e)
+            if delay is not None and delay > max_retry_after:
+                # Failing over beats waiting this long
+                raise
+            if delay is None:
+                delay = get_backoff_delay(attempt_num)
+            print(f"{provider} call failed ({e}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # Cancelled before the provider answered, a half-open breaker must not wait on this trial forever
+            circuit_breaker.release_trial()
+            raise
+        circuit_breaker.record_success()
+        return result
@@ -0,0 +1,69 @@
+import os
+import threading
+from collections import OrderedDict
+
+class SheetSnapshotCache:
+    """In-process LRU cache of SheetTables keyed by spreadsheet ID and tab.
+    Each snapshot is stored with the Drive file version it was read at and is only returned
+    for that same version. Tables are shared, not copied, which is safe because SheetTable
+    writes always return a new table.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.snapshots = OrderedDict() # (sheet_id, sheet_range) -> (version, sheet_content, size)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, sheet_id, sheet_range, version):
+        """Returns the cached sheet content if it was stored at the given version, otherwise None"""
+        key = (sheet_id, sheet_range)
+        with self.lock:
+            snapshot = self.snapshots.get(key)
+            if snapshot is None or snapshot[0] != version:
+                self.misses += 1
+                return None
+            self.snapshots.move_to_end(key)
+            self.hits += 1
+            return snapshot[1]
+
+    def put(self, sheet_id, sheet_range, version, sheet_content):
+        """Stores the sheet content read at the given version, evicting least recently used snapshots"""
+        key = (sheet_id, sheet_range)
+        size = int(sheet_content.memory_usage(index=True, deep=True).sum())
+        with self.lock:
+            self.discard(key)
+            if size > self.max_bytes:
+                print(f"Not caching {key}, {size} bytes is over the cache limit")
+                return
+            self.snapshots[key] = (version, sheet_content, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self.snapshots.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, sheet_id, sheet_range):
+        with self.lock:
+            self.discard((sheet_id, sheet_range))
+
+    def discard(self, key):
+        """Removes key if present, caller holds the lock"""
+        snapshot = self.snapshots.pop(key, None)
+        if snapshot is not None:
+            self.total_bytes -= snapshot[2]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "snapshots": len(self.snapshots),
+                "bytes": self.total_bytes,
+            }
+
+# Shared by every request served by this container
+sheet_snapshot_cache = SheetSnapshotCache(int(os.environ.get("SHEET_CACHE_MAX_BYTES", 256 * 1024 * 1024)))
@@ -0,0 +1,229 @@
+"""
+Typed columnar representation of a sheet.
+A SheetTable holds the header row as a list and every column below it as its own pandas Series
+with a compact dtype inferred from the unformatted values: Int64, float64, boolean, datetime64,
+category for repetitive text, and object for anything else.
+Tables use grid coordinates like the sheet and the model: row 0 is the header row and data row i
+is grid row i+1, columns are 0-indexed. Tables are never modified in place, writes return a new
+table sharing the untouched columns, so snapshots can be shared across requests.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+HEADER_ROWS = 1
+CATEGORY_MAX_UNIQUE_RATIO = 0.5 # Text columns with at most this share of distinct values become categorical
+ITER_CHUNK_ROWS = 1000
+iso_date_pattern = re.compile(r"\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?")
+
+def is_missing(value):
+    return value is None or value == "" or (isinstance(value, float) and value != value)
+
+def infer_column(values):
+    """Returns the values as a Series of the most compact dtype holding them, and the strftime
+    format of the column if it holds dates. Missing values are None or "".
+    """
+    values = [None if is_missing(value) else value for value in values]
+    present = [value for value in values if value is not None]
+    types = {type(value) for value in present}
+    if not present:
+        return pd.Series(np.full(len(values), np.nan)), None
+    if types == {bool}:
+        return pd.Series(values, dtype="boolean"), None
+    if types == {int}:
+        return pd.Series(values, dtype="Int64"), None
+    if types <= {int, float}:
+        return pd.Series(values, dtype="float64"), None
+    if types == {str}:
+        if all(iso_date_pattern.fullmatch(value) for value in present):
+            dates = pd.to_datetime(pd.Series(values, dtype=object), format="ISO8601")
+            has_time = (dates.dropna() != dates.dropna().dt.normalize()).any()
+            return dates, "%Y-%m-%d %H:%M:%S" if has_time else "%Y-%m-%d"
+        if len(set(present)) <= CATEGORY_MAX_UNIQUE_RATIO * len(present):
+            return pd.Series(values, dtype="category"), None
+    return pd.Series(values, dtype=object), None
+
+def normalize_header(value):
+    """Returns the key a header is looked up by, ignoring case and surrounding spaces"""
+    return str(value).strip().lower()
+
+def get_header_index(header):
+    """Maps each normalized header to its column, the first column wins when headers repeat"""
+    header_index = {}
+    for j, value in enumerate(header):
+        if not is_missing(value) and normalize_header(value):
+            header_index.setdefault(normalize_header(value), j)
+    return header_index
+
+def to_object_array(column, date_format=None):
+    """Returns a column's values as an object array of sheet values: Python scalars, dates as text and None for missing"""
+    if date_format is not None:
+        column = column.dt.strftime(date_format)
+    return column.to_numpy(dtype=object, na_value=None)
+
+class SheetTable:
+    def __init__(self, header, columns, n_data_rows, date_formats=None):
+        self.header = header # Grid row 0, one value per column
+        self.columns = columns # One Series per column holding the data rows
+        self.n_data_rows = n_data_rows
+        self.date_formats = date_formats or {} # strftime format of each datetime column
+        self.header_index = get_header_index(header) # Column of each normalized header, see get_column_index
+
+    @classmethod
+    def from_values(cls, values):
+        """Builds a table from the rows of a values() read, the first row being the header"""
+        if not values:
+            return cls([], [], 0)
+        n_cols = max(len(row) for row in values)
+        header = [None if j >= len(values[0]) or is_missing(values[0][j]) else values[0][j] for j in range(n_cols)]
+        data = values[HEADER_ROWS:]
+        columns = []
+        date_formats = {}
+        for j in range(n_cols):
+            column, date_format = infer_column([row[j] if j < len(row) else None for row in data])
+            columns.append(column)
+            if date_format is not None:
+                date_formats[j] = date_format
+        return cls(header, columns, len(data), date_formats)
+
+    @property
+    def n_rows(self):
+        """Rows in grid coordinates, the header row included"""
+        return self.n_data_rows + HEADER_ROWS if self.columns else 0
+
+    @property
+    def n_cols(self):
+        return len(self.columns)
+
+    @property
+    def shape(self):
+        return self.n_rows, self.n_cols
+
+    def to_grid(self, data_row, col):
+        """Returns the grid coordinates of a data row's cell"""
+        return data_row + HEADER_ROWS, col
+
+    def from_grid(self, row, col):
+        """Returns the data row and column of a grid cell, data row None for the header row"""
+        return (row - HEADER_ROWS if row >= HEADER_ROWS else None), col
+
+    def get_column_index(self, name):
+        """Returns the column whose header is name, ignoring case and surrounding spaces, or None"""
+        return self.header_index.get(normalize_header(name))
+
+    def get_column(self, col):
+        """Returns the typed Series of a column's data rows, for vectorized computation"""
+        return self.columns[col]
+
+    def get_column_values(self, col, start=0, stop=None):
+        """Returns the sheet values of a column's data rows start to stop"""
+        return to_object_array(self.columns[col].iloc[start:stop], self.date_formats.get(col)).tolist()
+
+    def take(self, col, rows):
+        """Returns the sheet values of a column at the given grid rows as an object array, None outside the table"""
+        rows = np.asarray(rows, dtype=np.intp)
+        values = np.full(len(rows), None, dtype=object)
+        if not 0 <= col < self.n_cols:
+            return values
+        data_rows = rows - HEADER_ROWS
+        inside = (data_rows >= 0) & (data_rows < self.n_data_rows)
+        if inside.any():
+            values[inside] = to_object_array(self.columns[col].iloc[data_rows[inside]], self.date_formats.get(col))
+        values[(rows >= 0) & (rows < HEADER_ROWS)] = self.header[col]
+        return values
+
+    def get_cell(self, row, col):
+        """Returns the sheet value at a grid cell, None if it is empty and pd.NA if it is outside the table"""
+        if not (0 <= row < self.n_rows and 0 <= col < self.n_cols):
+            return pd.NA
+        data_row, col = self.from_grid(row, col)
+        if data_row is None:
+            return self.header[col]
+        return self.get_column_values(col, data_row, data_row + 1)[0]
+
+    def iter_rows(self, max_rows=None):
+        """Yields the grid rows as tuples of sheet values, the header first, a chunk of rows at a time"""
+        if not self.columns:
+            return
+        yield tuple(self.header)
+        n_data_rows = self.n_data_rows if max_rows is None else min(self.n_data_rows, max_rows - HEADER_ROWS)
+        for start in range(0, n_data_rows, ITER_CHUNK_ROWS):
+            stop = min(start + ITER_CHUNK_ROWS, n_data_rows)
+            yield from zip(*(self.get_column_values(j, start, stop) for j in range(self.n_cols)))
+
+    def get_rows(self, start, stop):
+        """Returns grid rows start to stop as tuples of sheet values"""
+        if not self.columns:
+            return []
+        rows = [tuple(self.header)] if start < HEADER_ROWS and stop > 0 else []
+        data_start, data_stop = max(start - HEADER_ROWS, 0), min(max(stop - HEADER_ROWS, 0), self.n_data_rows)
+        if data_start < data_stop:
+            rows += zip(*(self.get_column_values(j, data_start, data_stop) for j in range(self.n_cols)))
+        return rows
+
+    def count_filled(self):
+        """Returns the number of non-empty cells per column, header included"""
+        return [int(self.header[j] is not None) + int(self.columns[j].notna().sum()) for j in range(self.n_cols)]
+
+    def write_cells(self, rows, cols, values):
+        """Returns a table with values written at the given grid rows and cols, grown to fit them.
+        Later duplicates of the same cell win like sequential writes would. Written columns become
+        object columns, the other columns are shared with this table.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        cols = np.asarray(cols, dtype=np.intp)
+        n_cols = max(self.n_cols, int(cols.max()) + 1)
+        n_data_rows = max(self.n_data_rows, int(rows.max()) + 1 - HEADER_ROWS)
+        cell_values = np.empty(len(values), dtype=object)
+        cell_values[:] = list(values)
+        header = list(self.header) + [None] * (n_cols - self.n_cols)
+        header_cells = np.flatnonzero(rows < HEADER_ROWS)
+        for i in header_cells:
+            header[cols[i]] = cell_values[i]
+
+        data_cells = rows >= HEADER_ROWS
+        rows, cols, cell_values = rows[data_cells] - HEADER_ROWS, cols[data_cells], cell_values[data_cells]
+        written_cols = set(cols.tolist())
+        columns = []
+        date_formats = {}
+        for j in range(n_cols):
+            if j in written_cols:
+                grid = np.full(n_data_rows, None, dtype=object)
+                if j < self.n_cols:
+                    grid[:self.n_data_rows] = to_object_array(self.columns[j], self.date_formats.get(j))
+                in_col = cols == j
+                grid[rows[in_col]] = cell_values[in_col]
+                columns.append(pd.Series(grid, dtype=object, copy=False))
+                continue
+            column = self.columns[j] if j < self.n_cols else pd.Series(np.full(n_data_rows, np.nan))
+            if len(column) < n_data_rows:
+                column = column.reindex(range(n_data_rows))
+            columns.append(column)
+            if j in self.date_formats:
+                date_formats[j] = self.date_formats[j]
+        return SheetTable(header, columns, n_data_rows, date_formats)
+
+    def expand(self, n_rows, n_cols):
+        """Returns the table grown to at least n_rows x n_cols grid cells"""
+        if n_rows <= self.n_rows and n_cols <= self.n_cols:
+            return self
+        header = list(self.header) + [None] * (n_cols - self.n_cols)
+        n_data_rows = max(self.n_data_rows, n_rows - HEADER_ROWS)
+        columns = [column.reindex(range(n_data_rows)) if len(column) < n_data_rows else column for column in self.columns]
+        columns += [pd.Series(np.full(n_data_rows, np.nan)) for _ in range(n_cols - self.n_cols)]
+        return SheetTable(header, columns, n_data_rows, dict(self.date_formats))
+
+    def memory_usage(self, index=True, deep=True):
+        """Bytes used by each column, like DataFrame.memory_usage"""
+        return pd.Series([column.memory_usage(index=index, deep=deep) for column in self.columns], dtype="int64")
+
+    def get_dtypes(self):
+        return [str(column.dtype) for column in self.columns]
+
+    def to_frame(self):
+        """Returns the grid as an object DataFrame with integer labels, the header as row 0"""
+        return pd.DataFrame(list(self.iter_rows()), dtype=object)
+
+    def __repr__(self):
+        return f"<SheetTable {self.n_rows} x {self.n_cols}, dtypes {self.get_dtypes()}>"
@@ -0,0 +1,133 @@
+"""
+Pool of blank spreadsheets made ahead of time for uploads.
+Each pooled spreadsheet is already in GOOGLE_DRIVE_FOLDER_ID, editable by anyone with the link,
+and marked with the POOL_MARKER app property, so an upload only has to rename it and write values.
+The pool is refilled on a background thread. Its inventory outlives containers: api.py keeps it in
+the Modal Dict named SHEET_POOL_DICT, shared by every container, which claim a spreadsheet by popping
+its entry so no two uploads get the same one. Spreadsheets pooled longer than SHEET_POOL_MAX_AGE_S
+are deleted, including ones the inventory lost track of, which are found by their marker.
+"""
+import os
+import time
+import datetime
+import threading
+
+from clients import execute_batch
+
+SHEET_POOL_SIZE = int(os.environ.get("SHEET_POOL_SIZE", 4))
+SHEET_POOL_DICT = os.environ.get("SHEET_POOL_DICT", "sheetfreak-sheet-pool")
+SHEET_POOL_MAX_AGE_S = float(os.environ.get("SHEET_POOL_MAX_AGE_S", 24 * 60 * 60))
+GARBAGE_COLLECTION_INTERVAL_S = 60 * 60
+POOL_MARKER = "sheetfreak_pool"
+POOL_TAB_TITLE = "Sheet1"
+
+def get_shared_inventory(name=SHEET_POOL_DICT):
+    """Returns the Modal Dict holding the pool's inventory, created on first use"""
+    import modal
+    return modal.Dict.from_name(name, create_if_missing=True)
+
+class SpreadsheetPool:
+    """Pool of ready spreadsheets. The inventory maps each spreadsheet ID to its entry
+    {"spreadsheet_id", "url", "tab_properties", "created_at"}, where tab_properties are the sheet
+    properties of the pooled spreadsheet's only tab. It is a Modal Dict shared by the containers, see
+    get_shared_inventory, or a dict of this process by default.
+    """
+    def __init__(self, drive_service, sheets_service, target_size=SHEET_POOL_SIZE, inventory=None, max_age_s=SHEET_POOL_MAX_AGE_S):
+        self.drive_service = drive_service
+        self.sheets_service = sheets_service
+        self.target_size = target_size
+        self.inventory = {} if inventory is None else inventory
+        self.max_age_s = max_age_s
+        self.lock = threading.Lock()
+        self.refilling = False
+        self.collected_at = None # Garbage is collected by the first refill and then hourly
+
+    def get_size(self):
+        return sum(1 for _ in self.inventory.keys())
+
+    def take(self):
+        """Returns a ready spreadsheet's entry, or None if the pool is empty, and starts a refill.
+        Entries are claimed by popping them, another container may pop an entry first.
+        """
+        entry = None
+        try:
+            for spreadsheet_id in list(self.inventory.keys()):
+                try:
+                    entry = self.inventory.pop(spreadsheet_id)
+                except KeyError:
+                    continue
+                if entry is not None and not self.is_stale(entry):
+                    break
+                entry = None
+        except Exception as e:
+            print("Could not take from the spreadsheet pool:", e)
+        self.start_refill()
+        return entry
+
+    def is_stale(self, entry):
+        return time.time() - entry["created_at"] > self.max_age_s
+
+    def is_collection_due(self):
+        return self.collected_at is None or time.time() - self.collected_at > GARBAGE_COLLECTION_INTERVAL_S
+
+    def provision(self):
+        """Makes a blank spreadsheet in the folder, shared and marked as pooled, in two round trips"""
+        spreadsheet = self.sheets_service.spreadsheets().create(
+            body={'properties': {'title': 'sheetfreak'}, 'sheets': [{'properties': {'title': POOL_TAB_TITLE}}]},
+            fields='spreadsheetId,spreadsheetUrl,sheets.properties'
+        ).execute()
+        spreadsheet_id = spreadsheet['spreadsheetId']
+        execute_batch(self.drive_service, [
+            self.drive_service.files().update(
+                fileId=spreadsheet_id,
+                addParents=os.environ["GOOGLE_DRIVE_FOLDER_ID"],
+                body={'appProperties': {POOL_MARKER: 'ready'}},
+                fields='id'
+            ),
+            self.drive_service.permissions().create(fileId=spreadsheet_id, body={'type': 'anyone', 'role': 'writer'}, fields='id'),
+        ])
+        return {
+            "spreadsheet_id": spreadsheet_id,
+            "url": spreadsheet['spreadsheetUrl'],
+            "tab_properties": spreadsheet['sheets'][0]['properties'],
+            "created_at": time.time(),
+        }
+
+    def start_refill(self):
+        """Refills the pool on a background thread, unless a refill is already running"""
+        with self.lock:
+            if self.refilling:
+                return
+            self.refilling = True
+        threading.Thread(target=self.refill, daemon=True).start()
+
+    def refill(self):
+        try:
+            if self.is_collection_due():
+                self.collected_at = time.time()
+                self.collect_garbage()
+            while self.get_size() < self.target_size:
+                entry = self.provision()
+                self.inventory[entry["spreadsheet_id"]] = entry
+        except Exception as e:
+            print("Could not refill the spreadsheet pool:", e)
+        finally:
+            with self.lock:
+                self.refilling = False
+
+    def collect_garbage(self):
+        """Deletes stale pooled spreadsheets, whether or not they are in the inventory"""
+        for spreadsheet_id, entry in list(self.inventory.items()):
+            if self.is_stale(entry):
+                try:
+                    self.inventory.pop(spreadsheet_id)
+                except KeyError:
+                    pass
+        cutoff = datetime.datetime.fromtimestamp(time.time() - self.max_age_s, datetime.timezone.utc)
+        query = (f"'{os.environ['GOOGLE_DRIVE_FOLDER_ID']}' in parents and trashed = false"
+                 f" and appProperties has {{ key='{POOL_MARKER}' and value='ready' }}"
+                 f" and createdTime < '{cutoff.strftime('%Y-%m-%dT%H:%M:%S')}'")
+        stale_files = self.drive_service.files().list(q=query, fields='files(id)', pageSize=100).execute().get('files', [])
+        if stale_files:
+            execute_batch(self.drive_service, [self.drive_service.files().delete(fileId=file['id']) for file in stale_files])
+            print(f"Deleted {len(stale_files)} stale pooled spreadsheets")
@@ -0,0 +1,53 @@
+"""
+Server-sent events streamed by the act endpoint.
+Every event is a JSON object with a "type" field, sent as an SSE event of the same name:
+    status     {"message"}
+    error      {"message", "index"?}
+    plan       {"index", "instruction_type", "instruction"}
+    executing  {"index", "instruction"}
+    result     {"index", "result", "elapsed_ms"}
+    refused    {"message"}
+    done       {"request_id", "total_ms", "cells_written"}
+    timings    {"request_id", "total_ms", "phases"}, only when requested, see tracing
+Instruction indices are 1-indexed as shown to the user.
+"""
+import json
+import asyncio
+
+HEARTBEAT_INTERVAL = 15 # seconds
+HEARTBEAT = ": heartbeat\n\n"
+
+def format_event(event_type, **payload):
+    """Returns the SSE text for one event, JSON never spans lines so one data field is enough"""
+    data = json.dumps({"type": event_type, **payload}, default=str)
+    return f"event: {event_type}\ndata: {data}\n\n"
+
+async def with_heartbeats(events, interval=HEARTBEAT_INTERVAL):
+    """Passes events through, sending an SSE comment whenever the stream is idle for interval
+    seconds so proxies don't close it. The pending read is kept across heartbeats, not cancelled.
+    """
+    events = events.__aiter__()
+    next_event = None
+    try:
+        while True:
+            if next_event is None:
+                next_event = asyncio.ensure_future(events.__anext__())
+            done, _ = await asyncio.wait({next_event}, timeout=interval)
+            if not done:
+                yield HEARTBEAT
+                continue
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            next_event = None
+            yield event
+    finally:
+        if next_event is not None:
+            # The generator can only be closed once the cancelled read has stopped running it
+            next_event.cancel()
+            try:
+                await next_event
+            except (asyncio.CancelledError, Exception):
+                pass
+        await events.aclose()
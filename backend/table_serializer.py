@@ -0,0 +1,168 @@
+"""
+Table serializers used to paste a SheetTable into LLM prompts
+- string: DataFrame.to_string(), the original padded format
+- tsv: tab separated, rows and columns labeled with their 0-index
+- a1: tab separated, rows and columns labeled with A1 coordinates
+- sample: header row plus the first rows of the sheet
+TableRenderer keeps the rendered rows of the table instructions work on in blocks, so the prompt of
+each instruction can show the current table re-rendering only the blocks earlier writes touched.
+"""
+import math
+import threading
+
+import pandas as pd
+
+DEFAULT_TABLE_FORMAT = "tsv"
+DEFAULT_TOKEN_BUDGET = 8000
+MAX_CELL_CHARS = 200
+SAMPLE_ROWS = 20
+RENDER_BLOCK_ROWS = 256
+
+def estimate_tokens(text):
+    """Rough token count of text, about 4 characters per token for English and numbers"""
+    return math.ceil(len(text) / 4)
+
+def format_cell(value):
+    """Returns the compact single-line text of a cell, empty for missing values"""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return ""
+    if isinstance(value, bool):
+        text = "TRUE" if value else "FALSE"
+    elif isinstance(value, float) and value.is_integer():
+        text = str(int(value))
+    else:
+        text = str(value)
+    text = text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+    if len(text) > MAX_CELL_CHARS:
+        text = text[:MAX_CELL_CHARS] + "..."
+    return text
+
+def get_column_letter(col):
+    """Converts 0-index column to its A1 letters (0 -> A, 26 -> AA)"""
+    letters = ""
+    col += 1
+    while col > 0:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+def render_cells(row_values):
+    """Returns a row's cells as one tab separated line, without its row label"""
+    return "\t".join(format_cell(value) for value in row_values)
+
+def render_rows(sheet_content, row_label, header_line, notes, token_budget, max_rows=None, row_texts=None):
+    """Renders header_line then one line per row until token_budget would be exceeded.
+    row_texts yields the rendered cells of each row, see TableRenderer, by default they are rendered here.
+    Says explicitly how many rows were left out when the table does not fit.
+    """
+    n_rows = sheet_content.n_rows
+    if max_rows is not None:
+        n_rows = min(n_rows, max_rows)
+    if row_texts is None:
+        row_texts = (render_cells(row_values) for row_values in sheet_content.iter_rows(n_rows))
+    lines = notes + [header_line]
+    used_tokens = sum(estimate_tokens(line) + 1 for line in lines)
+    # Leave room for the truncation notice
+    budget = token_budget - 40
+    shown_rows = 0
+    for i, row_text in enumerate(row_texts):
+        if i >= n_rows:
+            break
+        line = row_label(i) + "\t" + row_text
+        line_tokens = estimate_tokens(line) + 1
+        if used_tokens + line_tokens > budget:
+            break
+        lines.append(line)
+        used_tokens += line_tokens
+        shown_rows += 1
+    if shown_rows < sheet_content.n_rows:
+        omitted = sheet_content.n_rows - shown_rows
+        lines.append(f"[Truncated: showing {shown_rows} of {sheet_content.n_rows} rows, {omitted} rows omitted to fit the prompt. Omitted rows still exist in the sheet.]")
+    return "\n".join(lines)
+
+def serialize_string(sheet_content, token_budget, row_texts=None):
+    """Original DataFrame.to_string() format, truncated to the token budget.
+    Only the rows that could fit are formatted, every line is at least two characters per column.
+    """
+    max_chars = token_budget * 4
+    max_rows = max_chars // (2 * max(sheet_content.n_cols, 1)) + 1
+    text = pd.DataFrame(sheet_content.get_rows(0, max_rows), dtype=object).to_string()
+    if len(text) <= max_chars:
+        return text
+    text = text[:max_chars].rsplit("\n", 1)[0]
+    return text + f"\n[Truncated: table is larger than the prompt allows, only the first {text.count(chr(10))} rows are shown.]"
+
+def serialize_tsv(sheet_content, token_budget, row_texts=None):
+    """Tab separated rows labeled with their 0-index row, header line holds 0-index columns"""
+    notes = ["Tab separated table. The first column is the 0-index row and the first line holds the 0-index columns."]
+    header_line = "row\t" + "\t".join(str(col) for col in range(sheet_content.n_cols))
+    return render_rows(sheet_content, str, header_line, notes, token_budget, row_texts=row_texts)
+
+def serialize_a1(sheet_content, token_budget, row_texts=None):
+    """Tab separated rows labeled with A1 coordinates"""
+    notes = ["Tab separated table with A1 coordinates. Column A is 0-index column 0 and row 1 is 0-index row 0."]
+    header_line = "\t" + "\t".join(get_column_letter(col) for col in range(sheet_content.n_cols))
+    return render_rows(sheet_content, lambda i: str(i + 1), header_line, notes, token_budget, row_texts=row_texts)
+
+def serialize_sample(sheet_content, token_budget, row_texts=None):
+    """Header row plus the first SAMPLE_ROWS rows, with the number of filled cells per column"""
+    filled = sheet_content.count_filled()
+    notes = [
+        f"Sample of a {sheet_content.n_rows} row x {sheet_content.n_cols} column table. The first column is the 0-index row and the first line holds the 0-index columns.",
+        "Filled cells per column: " + ", ".join(f"{col}={count}" for col, count in enumerate(filled)),
+    ]
+    header_line = "row\t" + "\t".join(str(col) for col in range(sheet_content.n_cols))
+    return render_rows(sheet_content, str, header_line, notes, token_budget, max_rows=SAMPLE_ROWS, row_texts=row_texts)
+
+table_serializers = {
+    "string": serialize_string,
+    "tsv": serialize_tsv,
+    "a1": serialize_a1,
+    "sample": serialize_sample,
+}
+
+def serialize_table(sheet_content, table_format=DEFAULT_TABLE_FORMAT, token_budget=DEFAULT_TOKEN_BUDGET, row_texts=None):
+    """Serializes the sheet for a prompt using the given table format within token_budget tokens"""
+    if table_format not in table_serializers:
+        print("Unrecognized table format", table_format, "using", DEFAULT_TABLE_FORMAT)
+        table_format = DEFAULT_TABLE_FORMAT
+    return table_serializers[table_format](sheet_content, token_budget, row_texts=row_texts)
+
+class TableRenderer:
+    """Serializes a changing table for prompts. The rendered cells of each block of RENDER_BLOCK_ROWS rows
+    are kept until a write touches the block, so re-rendering after a write costs about the rows it
+    changed, and blocks past the token budget are never rendered. Safe to use from several threads.
+    """
+    def __init__(self, table_format=DEFAULT_TABLE_FORMAT, token_budget=DEFAULT_TOKEN_BUDGET):
+        self.table_format = table_format
+        self.token_budget = token_budget
+        self.lock = threading.Lock()
+        self.sheet_content = None
+        self.blocks = {} # Rendered cells of each row block by block index
+        self.blocks_rendered = 0
+
+    def update(self, sheet_content, rows=None):
+        """Switches to a new version of the table where only the given grid rows changed, all of them if rows is None"""
+        with self.lock:
+            if rows is None or self.sheet_content is None or sheet_content.n_cols != self.sheet_content.n_cols:
+                self.blocks = {}
+            else:
+                for block in {row // RENDER_BLOCK_ROWS for row in rows}:
+                    self.blocks.pop(block, None)
+            self.sheet_content = sheet_content
+
+    def iter_row_texts(self):
+        """Yields the rendered cells of each row, rendering the blocks that aren't kept, caller holds the lock"""
+        n_rows = self.sheet_content.n_rows
+        for start in range(0, n_rows, RENDER_BLOCK_ROWS):
+            block = start // RENDER_BLOCK_ROWS
+            # A kept last block is shorter than it should be when the table grew since
+            if len(self.blocks.get(block, ())) != min(RENDER_BLOCK_ROWS, n_rows - start):
+                self.blocks[block] = [render_cells(row_values) for row_values in self.sheet_content.get_rows(start, start + RENDER_BLOCK_ROWS)]
+                self.blocks_rendered += 1
+            yield from self.blocks[block]
+
+    def render(self):
+        """Serializes the current table"""
+        with self.lock:
+            return serialize_table(self.sheet_content, self.table_format, self.token_budget, row_texts=self.iter_row_texts())
@@ -0,0 +1,148 @@
+"""
+Span based latency tracing for act requests.
+A Trace is started per request and holds a tree of spans. The current span lives in a context
+variable, so spans opened in asyncio tasks and asyncio.to_thread workers nest under the span
+that was current when the task or worker was started. Outside a trace span() does nothing.
+Finished traces are written as JSON lines, one line per span, to TRACE_FILE when it is set. Once the
+file holds TRACE_FILE_MAX_BYTES it is moved to TRACE_FILE.1, replacing the previous one.
+"""
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+class Span:
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.name = name
+        self.span_id = trace.next_span_id()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def get_duration_ms(self):
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+    def to_dict(self):
+        return {
+            "request_id": self.trace.request_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ms": round((self.start - self.trace.root.start) * 1000, 3),
+            "duration_ms": round(self.get_duration_ms(), 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+class Trace:
+    """The spans of one request, rooted at a span named after the request"""
+    def __init__(self, name, request_id=None, exporter=None, **attributes):
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.exporter = exporter if exporter is not None else trace_exporter
+        self.lock = threading.Lock()
+        self.span_count = 0
+        self.spans = []
+        self.root = Span(self, name, None, attributes)
+        self.spans.append(self.root)
+
+    def next_span_id(self):
+        with self.lock:
+            self.span_count += 1
+            return self.span_count
+
+    def add_span(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def activate(self):
+        """Makes the root span current, for code running outside the tasks the trace started in.
+        Don't yield from a generator inside this block, the next step may run in another context.
+        """
+        token = current_span.set(self.root)
+        try:
+            yield self.root
+        finally:
+            current_span.reset(token)
+
+    def finish(self):
+        if self.root.end is not None:
+            return
+        self.root.end = time.perf_counter()
+        if self.exporter:
+            self.exporter.export(self)
+
+    def get_breakdown(self):
+        """Returns the number of spans and their total milliseconds by span name"""
+        breakdown = {}
+        with self.lock:
+            spans = list(self.spans[1:])
+        for span in spans:
+            phase = breakdown.setdefault(span.name, {"count": 0, "total_ms": 0.0})
+            phase["count"] += 1
+            phase["total_ms"] += span.get_duration_ms()
+        for phase in breakdown.values():
+            phase["total_ms"] = round(phase["total_ms"], 2)
+        return breakdown
+
+@contextmanager
+def span(name, **attributes):
+    """Times the block as a child of the current span, recording the exception type if it raises"""
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    token = current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        child.end = time.perf_counter()
+        current_span.reset(token)
+        parent.trace.add_span(child)
+
+def set_span_attributes(**attributes):
+    """Adds attributes to the current span, if any"""
+    parent = current_span.get()
+    if parent is not None:
+        parent.set(**attributes)
+
+class JSONLinesExporter:
+    """Appends every span of a finished trace to path as one JSON object per line, rotating the file
+    once it holds max_bytes
+    """
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def export(self, trace):
+        with trace.lock:
+            lines = [json.dumps(span.to_dict(), default=str) for span in trace.spans]
+        try:
+            with self.lock:
+                if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a") as f:
+                    f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            print("Could not export trace:", e)
+
+trace_file = os.environ.get("TRACE_FILE", "")
+trace_file_max_bytes = int(os.environ.get("TRACE_FILE_MAX_BYTES", 50 * 1024 * 1024))
+trace_exporter = JSONLinesExporter(trace_file, trace_file_max_bytes) if trace_file else None
@@ -5,8 +5,7 @@ import { useSearchParams } from 'next/navigation'
 import { Input } from "@/components/ui/input"
 import { Button } from "@/components/ui/button"
 import Link from 'next/link'
-
-const CHUNK_DELIMITER = "--END_CHUNK--"
+import { SSEParser, getEventText } from "@/lib/sse"
 
 interface Message {
     text: string;
@@ -28,21 +27,6 @@ export default function Act() {
     }
   }, [messages]);
 
-  const appendToLastMessage = (txt: string) => {
-    setMessages(prevMessages => {
-      let newMessages = [...prevMessages];
-
-      if (newMessages.length > 0) {
-        newMessages[newMessages.length - 1] = {
-          ...newMessages[newMessages.length - 1],
-          text: newMessages[newMessages.length - 1].text + " " + txt,
-        };
-      }
-
-      return newMessages;
-    });
-  }
-
   async function handleSendMessage() {
     if (inputMessage.trim() !== '') {
         setMessages([...messages, { text: inputMessage, sender: 'user' }])
@@ -65,32 +49,25 @@ export default function Act() {
         }
 
         let done = false;
-        let buffer = ""
-        let newMessage = true
+        const parser = new SSEParser()
 
         while (!done) {
             const { value, done: readerDone } = await reader.read()
             done = readerDone;
 
             if (value) {
-                const chunk = decoder.decode(value, { stream: true })
-                buffer += chunk
-                const buffer_parts = buffer.split(" ")
-                for (let i = 0; i < buffer_parts.length - 1; i++) {
-                  const part = buffer_parts[i]
-                  if (part == CHUNK_DELIMITER) {
-                    newMessage = true
-                  } else {
-                    if (newMessage) {
-
-                      setMessages(prevMessages => [...prevMessages, { text: part, sender: 'bot' }])
-                      newMessage = false
-                    } else {
-                      appendToLastMessage(part)
-                    }
+                const events = parser.push(decoder.decode(value, { stream: true }))
+                const texts = events.map(getEventText).filter((text): text is string => text !== null)
+                if (texts.length > 0) {
+                  setMessages(prevMessages => [...prevMessages, ...texts.map(text => ({ text: text, sender: 'bot' }))])
+                }
+                for (const event of events) {
+                  if (event.type === "done") {
+                    console.log(`Request ${event.request_id} finished in ${event.total_ms}ms`)
+                  } else if (event.type === "timings") {
+                    console.log("Timings:", event.phases)
                   }
                 }
-                buffer = buffer_parts[buffer_parts.length - 1]
             }
         }
     }
@@ -0,0 +1,76 @@
+// Events streamed by the act endpoint, see backend/stream_events.py
+export interface ActEvent {
+  type: "status" | "error" | "plan" | "executing" | "result" | "refused" | "done" | "timings";
+  index?: number;
+  message?: string;
+  instruction_type?: string;
+  instruction?: string;
+  result?: string;
+  elapsed_ms?: number;
+  request_id?: string;
+  total_ms?: number;
+  cells_written?: number;
+  phases?: Record<string, { count: number; total_ms: number }>;
+}
+
+// Incremental text/event-stream parser. Each call to push() only scans the text it has not
+// scanned before, so parsing a whole stream is linear in its length.
+export class SSEParser {
+  private buffer = ""
+  private scanned = 0
+
+  push(text: string): ActEvent[] {
+    this.buffer += text
+    const events: ActEvent[] = []
+    let start = 0
+    let end = this.buffer.indexOf("\n\n", Math.max(this.scanned - 1, 0))
+    while (end !== -1) {
+      const event = parseEvent(this.buffer.slice(start, end))
+      if (event) {
+        events.push(event)
+      }
+      start = end + 2
+      end = this.buffer.indexOf("\n\n", start)
+    }
+    this.buffer = this.buffer.slice(start)
+    this.scanned = this.buffer.length
+    return events
+  }
+}
+
+function parseEvent(block: string): ActEvent | null {
+  const data: string[] = []
+  for (const line of block.split("\n")) {
+    // Lines starting with ":" are comments, e.g. heartbeats
+    if (line.startsWith("data:")) {
+      data.push(line.slice(line.startsWith("data: ") ? 6 : 5))
+    }
+  }
+  if (data.length === 0) {
+    return null
+  }
+  try {
+    return JSON.parse(data.join("\n")) as ActEvent
+  } catch (err) {
+    console.error("Invalid event", err)
+    return null
+  }
+}
+
+export function getEventText(event: ActEvent): string | null {
+  switch (event.type) {
+    case "plan":
+      return `[${event.index}] Plan: ${event.instruction}`
+    case "executing":
+      return `[${event.index}] Executing...\n${event.instruction}`
+    case "result":
+      return `[${event.index}] ${event.result}`
+    case "error":
+      return event.index ? `[${event.index}] ${event.message}` : event.message ?? null
+    case "done":
+    case "timings":
+      return null
+    default:
+      return event.message ?? null
+  }
+}